@@ -6,7 +6,7 @@ import signal
 import time
 
 import web.modeltr as data
-from web.modeltr.enums import RequestState
+from web.modeltr.enums import MachineState, RequestState
 from web.settings import Settings
 import vcenter.vcenter as vcenter
 
@@ -103,6 +103,129 @@ def host_info_obtainer(conn, vc):
                     f'in: {time.time() - start_host_info_obtainer}')
 
 
+def datastore_info_obtainer(conn, vc):
+    global last_datastore_refresh
+    tracker = Settings.app['vsphere']['datastore_tracker']
+    if not tracker['enabled'] or time.time() - last_datastore_refresh < tracker['refresh_interval']:
+        return
+
+    start_datastore_info_obtainer = time.time()
+    info = vc.get_destination_datastores_info()
+    expiration = time.time() - tracker['reservation_timeout']
+    mo_refs = [item['mo_ref'] for item in info]
+    for datastore in data.DatastoreInfo.get_for_update({}, conn=conn):
+        if datastore.mo_ref not in mo_refs:
+            data.DatastoreInfo.delete({'_id': datastore.id}, conn=conn)
+            logger.debug(f'datastore: {datastore.name} deleted from database')
+            continue
+        item = info[mo_refs.index(datastore.mo_ref)]
+        datastore.name = item['name']
+        datastore.free_space = int(item['free_space'])
+        datastore.capacity = int(item['capacity'])
+        datastore.accessible = item['accessible']
+        # reservations of crashed workers would block the datastore forever
+        datastore.reservations = [
+            reservation for reservation in datastore.reservations if reservation['created_at'] > expiration
+        ]
+        datastore.save(conn=conn)
+        mo_refs.remove(datastore.mo_ref)
+        info.remove(item)
+
+    for item in info:
+        data.DatastoreInfo(
+            reservations=[], **{**item, 'free_space': int(item['free_space']), 'capacity': int(item['capacity'])}
+        ).save(conn=conn)
+
+    last_datastore_refresh = time.time()
+    logger.info(f'datastore_info_obtainer finished successfully in: {time.time() - start_datastore_info_obtainer}')
+
+
+def get_busy_folders(conn):
+    """
+    :return: folders relative to vsphere.folder which deploys may be cloning into,
+             Destroy_Task of a folder would destroy such a clone as well
+    """
+    since = (datetime.datetime.now() - datetime.timedelta(
+        seconds=Settings.app['vsphere']['folder_cleanup']['interval']
+    )).strftime('%Y-%m-%d %H:%M:%S')
+    deploys = data.Request.get_page(
+        {'type': data.RequestType.DEPLOY.value}, ranges={'modified_at': (since, None)}, conn=conn
+    )
+    for state in [RequestState.CREATED, RequestState.DELAYED]:
+        deploys += data.Request.get({'type': data.RequestType.DEPLOY.value, 'state': state.value}, conn=conn)
+    busy_folders = {deploy.target_folder for deploy in deploys}
+    if Settings.app['warm_pool']['enabled']:
+        busy_folders.add(Settings.app['warm_pool']['folder'])
+    return busy_folders
+
+
+def folder_cleaner(conn, vc):
+    global last_folder_cleanup
+    cleanup = Settings.app['vsphere']['folder_cleanup']
+    if not cleanup['enabled'] or time.time() - last_folder_cleanup < cleanup['interval']:
+        return
+
+    start_folder_cleaner = time.time()
+    removed = vc.remove_empty_folders(get_busy_folders(conn))
+    last_folder_cleanup = time.time()
+    logger.info(f'folder_cleaner removed {removed} empty folders in: {time.time() - start_folder_cleaner}')
+
+
+def slot_counter_reconciler(conn):
+    """
+    Recomputes the slot counter from scratch, it fixes drift caused e.g. by concurrent changes
+    of unlocked machines or by deleted deploy tickets
+    """
+    global last_slot_reconciliation
+    capabilities = Settings.app['service']['capabilities']
+    if not capabilities['slot_counters'] or \
+            time.time() - last_slot_reconciliation < capabilities['reconciliation_interval']:
+        return
+
+    counter = data.SlotCounter.get_for_unit(for_update=True, conn=conn) or data.SlotCounter()
+    used = sum(
+        data.Machine.count({'state': state.value}, conn=conn) for state in MachineState if state.takes_slot()
+    ) + data.PooledMachine.count({}, conn=conn)
+    if Settings.app["vsphere"]["hosts_folder_name"]:
+        ready_hosts = [
+            host for host in data.HostRuntimeInfo.get({"maintenance": "false"}, conn=conn)
+            if host.to_be_in_maintenance is False
+        ]
+        num_hosts = data.HostRuntimeInfo.count({}, conn=conn)
+        vm_per_host = 0 if num_hosts == 0 else int(Settings.app["slot_limit"] / num_hosts)
+        slot_limit = vm_per_host * len(ready_hosts)
+        free_tickets = data.DeployTicket.count({'taken': 0, 'enabled': 'true'}, conn=conn)
+    else:
+        slot_limit = Settings.app['slot_limit']
+        free_tickets = 0
+
+    if (counter.used, counter.free_tickets, counter.slot_limit) != (used, free_tickets, slot_limit):
+        logger.info(f'slot counter reconciled from used: {counter.used}, free_tickets: {counter.free_tickets}, '
+                    f'slot_limit: {counter.slot_limit} to {used}, {free_tickets}, {slot_limit}')
+        counter.used = used
+        counter.free_tickets = free_tickets
+        counter.slot_limit = slot_limit
+        counter.save(conn=conn)
+    last_slot_reconciliation = time.time()
+
+
+def event_pruner(conn):
+    global last_event_pruning
+    events = Settings.app['service']['events']
+    # pruning more often than once per minute would not make the stream any lighter
+    if not events['enabled'] or time.time() - last_event_pruning < 60:
+        return
+
+    data.Event.prune(datetime.datetime.now() - datetime.timedelta(seconds=events['retention']), conn=conn)
+    last_event_pruning = time.time()
+
+
+last_datastore_refresh = 0
+last_event_pruning = 0
+last_folder_cleanup = 0
+last_slot_reconciliation = 0
+
+
 if __name__ == '__main__':
 
     data.Connection.connect('conn2', dsn=Settings.app['db']['dsn'])
@@ -110,7 +233,8 @@ if __name__ == '__main__':
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
     vc = None
-    if Settings.app["vsphere"]["hosts_folder_name"]:
+    if Settings.app["vsphere"]["hosts_folder_name"] or Settings.app['vsphere']['datastore_tracker']['enabled'] \
+            or Settings.app['vsphere']['folder_cleanup']['enabled']:
         vc = vcenter.VCenter()
         vc.connect(quick=True)
 
@@ -124,6 +248,34 @@ if __name__ == '__main__':
                 Settings.raven.captureException(exc_info=True)
                 logger.error('Could not obtain host information: ', exc_info=True)
 
+        with data.Connection.use('conn2') as conn:
+            try:
+                datastore_info_obtainer(conn, vc)
+            except Exception:
+                Settings.raven.captureException(exc_info=True)
+                logger.error('Could not obtain datastore information: ', exc_info=True)
+
+        with data.Connection.use('conn2') as conn:
+            try:
+                slot_counter_reconciler(conn)
+            except Exception:
+                Settings.raven.captureException(exc_info=True)
+                logger.error('Could not reconcile slot counter: ', exc_info=True)
+
+        with data.Connection.use('conn2') as conn:
+            try:
+                event_pruner(conn)
+            except Exception:
+                Settings.raven.captureException(exc_info=True)
+                logger.error('Could not prune events: ', exc_info=True)
+
+        with data.Connection.use('conn2') as conn:
+            try:
+                folder_cleaner(conn, vc)
+            except Exception:
+                Settings.raven.captureException(exc_info=True)
+                logger.error('Could not remove empty folders: ', exc_info=True)
+
         with data.Connection.use('conn2') as conn:
             while process_actions:
                 try:
@@ -0,0 +1,53 @@
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import Mock, patch
+from pyVmomi import VmomiSupport
+import spec.modeltr.test_helper
+
+import delayed
+import web.modeltr as data
+from web.settings import Settings
+
+
+def datastore_item():
+    # sizes deserialized by pyVmomi are not plain int
+    return {
+        'name': 'ds1',
+        'mo_ref': 'datastore-1',
+        'free_space': VmomiSupport.long(50 * 2 ** 30),
+        'capacity': VmomiSupport.long(100 * 2 ** 30),
+        'accessible': True,
+    }
+
+
+with description('delayed'):
+
+    with context('datastore_info_obtainer()'):
+
+        with before.each:
+            self.enabled = Settings.app['vsphere']['datastore_tracker']['enabled']
+            Settings.app['vsphere']['datastore_tracker']['enabled'] = True
+            delayed.last_datastore_refresh = 0
+            self.vc = Mock()
+            self.vc.get_destination_datastores_info.return_value = [datastore_item()]
+
+        with after.each:
+            Settings.app['vsphere']['datastore_tracker']['enabled'] = self.enabled
+
+        with it('updates known datastores with sizes returned by pyVmomi'):
+            datastore = data.DatastoreInfo(name='ds1', mo_ref='datastore-1', free_space=0, capacity=0, reservations=[])
+            with patch.object(data.DatastoreInfo, 'get_for_update', return_value=[datastore]), \
+                    patch.object(data.DatastoreInfo, '_Document__insert') as insert:
+                delayed.datastore_info_obtainer(Mock(), self.vc)
+
+            expect(insert.called).to(be_true)
+            expect(type(datastore.free_space)).to(be(int))
+            expect(type(datastore.capacity)).to(be(int))
+            expect(datastore.capacity).to(equal(100 * 2 ** 30))
+
+        with it('inserts new datastores with sizes returned by pyVmomi'):
+            with patch.object(data.DatastoreInfo, 'get_for_update', return_value=[]), \
+                    patch.object(data.DatastoreInfo, '_Document__insert') as insert:
+                delayed.datastore_info_obtainer(Mock(), self.vc)
+
+            expect(insert.call_count).to(equal(1))
@@ -74,6 +74,62 @@ with description('Document'):
         with it('raises an exception when no connection is provided'):
             expect(lambda: Document.get({})).to(raise_error(ValueError))
 
+    with context('class->get_by_ids()'):
+
+        with it('raises an exception when no connection is provided'):
+            expect(lambda: Document.get_by_ids(['1'])).to(raise_error(ValueError))
+
+        with it('does not query the db when no id is numeric'):
+            conn = Mock()
+            expect(Document.get_by_ids(['foo', ''], conn=conn)).to(be_empty)
+            expect(conn.get_cursor.called).to(be_false)
+
+        with it('queries all numeric ids at once'):
+            conn = Mock()
+            conn.get_cursor.return_value.fetchall.return_value = []
+            Document.get_by_ids(['3', 'foo', 5], conn=conn)
+            expect(conn.get_cursor.return_value.execute.call_args[0][1]).to(equal([[3, 5], 'document']))
+
+    with context('class->get_page()'):
+
+        with it('raises an exception when no connection is provided'):
+            expect(lambda: Document.get_page({})).to(raise_error(ValueError))
+
+        with it('continues after given id in the order of ids'):
+            conn = Mock()
+            conn.get_cursor.return_value.fetchall.return_value = []
+            Document.get_page({'state': 'running'}, after='10', limit=5, conn=conn)
+            sql_query, params = conn.get_cursor.return_value.execute.call_args[0]
+            expect(sql_query).to(contain('id > %s', 'ORDER BY id', 'LIMIT %s'))
+            expect(params).to(equal(['state', 'running', 'document', 10, 5]))
+
+        with it('skips unbounded sides of ranges'):
+            conn = Mock()
+            conn.get_cursor.return_value.fetchall.return_value = []
+            Document.get_page({}, ranges={'created_at': (None, '2020-01-01 00:00:00')}, conn=conn)
+            sql_query, params = conn.get_cursor.return_value.execute.call_args[0]
+            expect(sql_query).not_to(contain('>='))
+            expect(params).to(equal(['document', 'created_at', '2020-01-01 00:00:00']))
+
+        with it('orders by given field and limits in the db'):
+            conn = Mock()
+            conn.get_cursor.return_value.fetchall.return_value = []
+            Document.get_page({'state': 'stopped'}, order_by='modified_at', limit=3, conn=conn)
+            sql_query, params = conn.get_cursor.return_value.execute.call_args[0]
+            expect(sql_query).to(contain("ORDER BY data::json->>%s, id", 'LIMIT %s'))
+            expect(params).to(equal(['state', 'stopped', 'document', 'modified_at', 3]))
+
+    with context('class->get_fields()'):
+
+        with it('selects only given fields'):
+            conn = Mock()
+            conn.get_cursor.return_value.fetchall.return_value = [(8, 'stop', 'success')]
+            fields = Document.get_fields({'_id': '8'}, ['type', 'state'], conn=conn)
+            sql_query, params = conn.get_cursor.return_value.execute.call_args[0]
+            expect(sql_query).to(start_with('SELECT id, data::json->>%s, data::json->>%s FROM documents'))
+            expect(params).to(equal(['type', 'state', '8', 'document']))
+            expect(fields).to(equal([{'id': '8', 'type': 'stop', 'state': 'success'}]))
+
 #         with it('returns DocumentList object'):
 #             expect(Document.get({}, conn=self.conn)).to(be_an(DocumentList))
 
@@ -0,0 +1,76 @@
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import MagicMock, patch
+import itertools
+import time
+import spec.modeltr.test_helper
+
+import web.modeltr as data
+from web.settings import Settings
+
+
+def new_connection():
+    conn = data.Connection(dsn='')
+    conn.client = MagicMock()
+    conn._last_usage_timestamp = time.time()
+    return conn
+
+
+with description('Event'):
+
+    with before.each:
+        self.enabled = Settings.app['service']['events']['enabled']
+        Settings.app['service']['events']['enabled'] = True
+        self.ids = itertools.count(1)
+        self.inserted = []
+
+        def insert(event, **kwargs):
+            event.id = str(next(self.ids))
+            self.inserted.append(event)
+
+        self.insert = insert
+
+    with after.each:
+        Settings.app['service']['events']['enabled'] = self.enabled
+
+    with context('class->emit()'):
+
+        with it('inserts the event just before the transaction commits'):
+            conn = new_connection()
+            conn.client.commit.side_effect = lambda: self.inserted.append('commit')
+            with patch.object(data.Event, '_Document__insert', autospec=True, side_effect=self.insert), \
+                    patch.object(data.Event, '_Document__notify'):
+                with conn:
+                    data.Event.emit('machine', 1, {'state': 'running'}, conn=conn)
+                    expect(self.inserted).to(be_empty)
+
+            expect([getattr(item, 'kind', item) for item in self.inserted]).to(equal(['machine', 'commit']))
+
+        with it('orders events of a late committed transaction after those committed meanwhile'):
+            long_conn = new_connection()
+            short_conn = new_connection()
+            with patch.object(data.Event, '_Document__insert', autospec=True, side_effect=self.insert), \
+                    patch.object(data.Event, '_Document__notify'):
+                with long_conn:
+                    # e.g. aborted subrequests saved before the vSphere calls of a bulk action
+                    data.Event.emit('request', 1, {'state': 'aborted'}, conn=long_conn)
+                    with short_conn:
+                        data.Event.emit('request', 2, {'state': 'success'}, conn=short_conn)
+
+            expect([event.subject_id for event in self.inserted]).to(equal(['2', '1']))
+            expect(int(self.inserted[1].id)).to(be_above(int(self.inserted[0].id)))
+
+        with it('drops events of a rolled back transaction'):
+            conn = new_connection()
+            with patch.object(data.Event, '_Document__insert', autospec=True, side_effect=self.insert):
+                try:
+                    with conn:
+                        data.Event.emit('machine', 1, {'state': 'running'}, conn=conn)
+                        raise RuntimeError('failed')
+                except RuntimeError:
+                    pass
+                with conn:
+                    pass
+
+            expect(self.inserted).to(be_empty)
+            expect(conn.client.rollback.called).to(be_true)
@@ -0,0 +1,61 @@
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import Mock, patch
+import spec.modeltr.test_helper
+
+import web.modeltr as data
+from web.modeltr.enums import RequestState, RequestType
+
+
+def stored_request(request_id, state, **kwargs):
+    request = data.Request(type=RequestType.DEPLOY, state=state, **kwargs)
+    request.id = request_id
+    request._stored_state = state
+    return request
+
+
+with description('Request'):
+
+    with before.each:
+        self.save = patch.object(data.Request, '_Document__save')
+        self.save.start()
+        self.notify = patch.object(data.Request, '_Document__notify')
+        self.notify.start()
+
+    with after.each:
+        self.save.stop()
+        self.notify.stop()
+
+    with context('save()'):
+
+        with it('finishes the aggregate request along with its last subrequest'):
+            aggregate = stored_request('1', RequestState.CREATED, subrequests=['2', '3'])
+            aggregate.type = RequestType.BULK
+            finished = stored_request('2', RequestState.SUCCESS, parent='1')
+            last = stored_request('3', RequestState.CREATED, parent='1')
+            with patch.object(data.Request, 'get_one_for_update', return_value=aggregate) as get_aggregate, \
+                    patch.object(data.Request, 'get_by_ids', side_effect=lambda ids, **kwargs: [finished, last]):
+                last.state = RequestState.FAILED
+                last.save(conn=Mock())
+
+            get_aggregate.assert_called_once()
+            expect(aggregate.state).to(be(RequestState.FAILED))
+
+        with it('leaves the aggregate request unfinished while some subrequest is pending'):
+            aggregate = stored_request('1', RequestState.CREATED, subrequests=['2', '3'])
+            pending = stored_request('2', RequestState.DELAYED, parent='1')
+            last = stored_request('3', RequestState.CREATED, parent='1')
+            with patch.object(data.Request, 'get_one_for_update', return_value=aggregate), \
+                    patch.object(data.Request, 'get_by_ids', side_effect=lambda ids, **kwargs: [pending, last]):
+                last.state = RequestState.SUCCESS
+                last.save(conn=Mock())
+
+            expect(aggregate.state).to(be(RequestState.CREATED))
+
+        with it('does not look for the aggregate request of requests without one'):
+            request = stored_request('3', RequestState.CREATED)
+            with patch.object(data.Request, 'get_one_for_update') as get_aggregate:
+                request.state = RequestState.SUCCESS
+                request.save(conn=Mock())
+
+            expect(get_aggregate.called).to(be_false)
@@ -0,0 +1,44 @@
+from mamba import description, context, it
+from expects import *
+from unittest.mock import Mock
+import spec.modeltr.test_helper
+
+from web.modeltr import Screenshot
+
+
+def new_connection(record):
+    conn = Mock()
+    conn.get_cursor.return_value.fetchone.return_value = record
+    return conn
+
+
+with description('Screenshot'):
+
+    with context('get_image_size()'):
+
+        with it('reads only the size of the stored image'):
+            conn = new_connection((70000,))
+
+            size = Screenshot(id='3', status='obtained').get_image_size(conn=conn)
+
+            sql_query, params = conn.get_cursor.return_value.execute.call_args[0]
+            expect(sql_query).to(contain('octet_length(data)'))
+            expect(size).to(equal(70000))
+
+        with it('has no size without an obtained screenshot'):
+            conn = new_connection(None)
+
+            expect(Screenshot(id='3', status='not_obtained').get_image_size(conn=conn)).to(be_none)
+            expect(Screenshot(id='3', status='obtained').get_image_size(conn=conn)).to(be_none)
+
+    with context('load_image_range()'):
+
+        with it('reads only the requested part of the image'):
+            conn = new_connection((memoryview(b'part'),))
+
+            part = Screenshot(id='3', status='obtained').load_image_range(65536, 65536, conn=conn)
+
+            sql_query, params = conn.get_cursor.return_value.execute.call_args[0]
+            expect(sql_query).to(contain('substring(data from %s for %s)'))
+            expect(params).to(equal([65537, 65536, '3']))
+            expect(part).to(equal(b'part'))
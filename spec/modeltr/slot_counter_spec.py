@@ -0,0 +1,127 @@
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import Mock, patch
+import spec.modeltr.test_helper
+
+from web.modeltr.deploy_ticket import DeployTicket
+from web.modeltr.enums import MachineState
+from web.modeltr.event import Event
+from web.modeltr.machine import Machine
+from web.modeltr.slot_counter import SlotCounter
+from web.settings import Settings
+
+
+def stored_machine(state):
+    return Machine._db_record_to_instance_pq([1, 'machine', {'state': state.value}])
+
+
+def stored_ticket(taken):
+    return DeployTicket._db_record_to_instance_pq([1, 'deployticket', {'enabled': True, 'taken': taken}])
+
+
+with description('SlotCounter'):
+
+    with before.each:
+        self.hosts_folder_name = Settings.app['vsphere']['hosts_folder_name']
+
+    with after.each:
+        Settings.app['vsphere']['hosts_folder_name'] = self.hosts_folder_name
+
+    with context('get_free_slots()'):
+
+        with it('subtracts used slots from the limit'):
+            Settings.app['vsphere']['hosts_folder_name'] = None
+
+            expect(SlotCounter(used=3, slot_limit=5).get_free_slots()).to(equal(2))
+            expect(SlotCounter(used=7, slot_limit=5).get_free_slots()).to(equal(0))
+
+        with it('is limited by free deploy tickets'):
+            Settings.app['vsphere']['hosts_folder_name'] = 'hosts'
+
+            expect(SlotCounter(used=3, free_tickets=4, slot_limit=5).get_free_slots()).to(equal(4))
+            expect(SlotCounter(used=3, free_tickets=9, slot_limit=5).get_free_slots()).to(equal(5))
+
+    with context('class->add()'):
+
+        with it('does not touch the db when nothing has changed'):
+            conn = Mock()
+            with patch.object(SlotCounter, 'enabled', return_value=True):
+                SlotCounter.add(used=0, conn=conn)
+
+            expect(conn.get_cursor.called).to(be_false)
+
+        with it('does not touch the db when disabled'):
+            conn = Mock()
+            with patch.object(SlotCounter, 'enabled', return_value=False):
+                SlotCounter.add(used=1, conn=conn)
+
+            expect(conn.get_cursor.called).to(be_false)
+
+    with context('Machine->save()'):
+
+        with before.each:
+            self.add = patch.object(SlotCounter, 'add').start()
+            patch.object(Machine, '_Document__insert').start()
+            patch.object(Machine, '_Document__save').start()
+            patch.object(Event, 'emit').start()
+
+        with after.each:
+            patch.stopall()
+
+        with it('counts a new machine in'):
+            Machine().save(conn=Mock())
+
+            expect(self.add.call_args[1]['used']).to(equal(1))
+
+        with it('counts a machine out when it stops taking a slot'):
+            machine = stored_machine(MachineState.RUNNING)
+            machine.state = MachineState.STOPPED
+            machine.save(conn=Mock())
+
+            expect(self.add.call_args[1]['used']).to(equal(-1))
+
+        with it('counts a machine in again when it takes a slot again'):
+            machine = stored_machine(MachineState.STOPPED)
+            machine.state = MachineState.RUNNING
+            machine.save(conn=Mock())
+
+            expect(self.add.call_args[1]['used']).to(equal(1))
+
+        with it('does not count a reloaded machine again'):
+            machine = stored_machine(MachineState.RUNNING)
+            machine.save(conn=Mock())
+            machine.state = MachineState.DEPLOYED
+            machine.save(conn=Mock())
+
+            expect([call[1]['used'] for call in self.add.call_args_list]).to(equal([0, 0]))
+
+    with context('DeployTicket->save()'):
+
+        with before.each:
+            self.add = patch.object(SlotCounter, 'add').start()
+            patch.object(DeployTicket, '_Document__insert').start()
+            patch.object(DeployTicket, '_Document__save').start()
+
+        with after.each:
+            patch.stopall()
+
+        with it('counts a new enabled ticket in as free'):
+            DeployTicket(enabled=True).save(conn=Mock())
+            DeployTicket(enabled=False).save(conn=Mock())
+
+            expect([call[1]['free_tickets'] for call in self.add.call_args_list]).to(equal([1, 0]))
+
+        with it('counts a taken ticket out and a released one in'):
+            ticket = stored_ticket(taken=0)
+            ticket.taken = 1
+            ticket.save(conn=Mock())
+            ticket.taken = 0
+            ticket.save(conn=Mock())
+
+            expect([call[1]['free_tickets'] for call in self.add.call_args_list]).to(equal([-1, 1]))
+
+        with it('does not count a reloaded ticket again'):
+            stored_ticket(taken=0).save(conn=Mock())
+            stored_ticket(taken=1).save(conn=Mock())
+
+            expect([call[1]['free_tickets'] for call in self.add.call_args_list]).to(equal([0, 0]))
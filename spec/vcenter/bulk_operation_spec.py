@@ -0,0 +1,99 @@
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import Mock, patch
+from pyVmomi import vim, vmodl
+import spec.modeltr.test_helper
+
+from vcenter.vcenter import VCenter
+
+
+def fake_task(moid):
+    return Mock(_GetMoId=Mock(return_value=moid))
+
+
+def task_state(task, state):
+    return {'obj': task, 'info.state': state}
+
+
+def fake_vm(moid, power_state):
+    vm = Mock(_GetMoId=Mock(return_value=moid))
+    vm.__str__ = Mock(return_value=f"'vim.VirtualMachine:{moid}'")
+    vm.power_state = power_state
+    vm.PowerOffVM_Task.return_value = fake_task(f'task-{moid}')
+    return vm
+
+
+def new_vcenter(vms=()):
+    vc = VCenter()
+    vc._check_connection = Mock()
+    vc.content = Mock()
+    vms_by_uuid = {vm._GetMoId(): vm for vm in vms}
+    vc.content.searchIndex.FindByUuid.side_effect = lambda datacenter, machine_uuid, vm_search: \
+        vms_by_uuid.get(machine_uuid)
+    return vc
+
+
+with description('VCenter'):
+
+    with before.each:
+        self.sleep = patch('vcenter.vcenter.time.sleep')
+        self.sleep.start()
+
+    with after.each:
+        self.sleep.stop()
+
+    with context('wait_for_tasks()'):
+
+        with it('fails tasks still pending after the timeout'):
+            done, running = fake_task('task-1'), fake_task('task-2')
+            vc = new_vcenter()
+            vc._get_objects_properties = Mock(return_value=[
+                task_state(done, 'success'), task_state(running, 'running')
+            ])
+
+            states = vc.wait_for_tasks([done, running], timeout=0)
+
+            expect(states).to(equal({'task-1': 'success', 'task-2': 'error'}))
+
+        with it('fails vanished tasks and keeps waiting for the others'):
+            vanished, done = fake_task('task-1'), fake_task('task-2')
+            vc = new_vcenter()
+            vc._get_objects_properties = Mock(side_effect=[
+                vmodl.fault.ManagedObjectNotFound(obj=vim.Task('task-1')),
+                [task_state(done, 'success')],
+            ])
+
+            states = vc.wait_for_tasks([vanished, done], timeout=60)
+
+            expect(states).to(equal({'task-1': 'error', 'task-2': 'success'}))
+
+    with context('run_bulk_operation()'):
+
+        with it('logs in again and waits without issuing the tasks again'):
+            vm = fake_vm('vm-1', vim.VirtualMachinePowerState.poweredOn)
+            vc = new_vcenter([vm])
+            vc._get_objects_properties = Mock(side_effect=[
+                [{'obj': vm, 'runtime.powerState': vm.power_state}],
+                vim.fault.NotAuthenticated(),
+                [task_state(vm.PowerOffVM_Task.return_value, 'success')],
+            ])
+
+            result = vc.run_bulk_operation('stop', ['vm-1'])
+
+            expect(result).to(equal({'vm-1': True}))
+            expect(vm.PowerOffVM_Task.call_count).to(equal(1))
+            vc._check_connection.assert_any_call(forced=True)
+
+        with it('stops only machines that are not powered off yet'):
+            running = fake_vm('vm-1', vim.VirtualMachinePowerState.poweredOn)
+            stopped = fake_vm('vm-2', vim.VirtualMachinePowerState.poweredOff)
+            vc = new_vcenter([running, stopped])
+            vc._get_objects_properties = Mock(side_effect=[
+                [{'obj': vm, 'runtime.powerState': vm.power_state} for vm in [running, stopped]],
+                [task_state(running.PowerOffVM_Task.return_value, 'success')],
+            ])
+
+            result = vc.run_bulk_operation('stop', ['vm-1', 'vm-2'])
+
+            expect(result).to(equal({'vm-1': True, 'vm-2': True}))
+            expect(stopped.PowerOffVM_Task.called).to(be_false)
@@ -0,0 +1,46 @@
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import Mock, patch
+from pyVmomi import vmodl
+import spec.modeltr.test_helper
+
+from vcenter.vcenter import VCenter
+
+
+def new_vcenter(retrieved):
+    vc = VCenter()
+    vc.content = Mock()
+    vc.content.rootFolder.childEntity = []
+    vc._VCenter__retrieve_properties_from_container = Mock(side_effect=retrieved)
+    return vc
+
+
+def named(*names):
+    return [{'obj': f'vm-{name}', 'name': name} for name in names]
+
+
+with description('VCenter'):
+
+    with before.each:
+        self.sleep = patch('vcenter.vcenter.time.sleep')
+        self.sleep.start()
+
+    with after.each:
+        self.sleep.stop()
+
+    with context('__search_machine_by_name()'):
+
+        with it('retries the lookup when a machine vanishes meanwhile'):
+            vc = new_vcenter([vmodl.fault.ManagedObjectNotFound(), named('other', 'junk')])
+
+            expect(vc._VCenter__search_machine_by_name('junk')).to(equal('vm-junk'))
+
+        with it('returns None when there is no such machine'):
+            vc = new_vcenter([named('other')])
+
+            expect(vc._VCenter__search_machine_by_name('junk')).to(be_none)
+
+        with it('raises when the machines cannot be retrieved'):
+            vc = new_vcenter(RuntimeError('vCenter not available'))
+
+            expect(lambda: vc._VCenter__search_machine_by_name('junk')).to(raise_error(ValueError))
@@ -0,0 +1,63 @@
+from mamba import description, context, it
+from expects import *
+from types import SimpleNamespace
+import spec.modeltr.test_helper
+
+from vcenter.simulator import Simulator, Fault, Ref
+from web.settings import Settings
+
+
+def new_simulator():
+    config = {
+        **Settings.app['vsphere']['simulator'],
+        'inventory': {**Settings.app['vsphere']['simulator']['inventory'], 'vms': 10, 'templates': ['tmpl']},
+        'latency': {},
+    }
+    simulator = Simulator(config)
+    session = simulator.login(Settings.app['vsphere']['username'], Settings.app['vsphere']['password'])
+    return simulator, session
+
+
+def vms_in(simulator, session, container):
+    view = simulator.invoke_method(session, Ref('vim.view.ViewManager', 'ViewManager'), 'CreateContainerView',
+                                   [container, ['vim.VirtualMachine'], True])
+    return simulator.invoke_accessor(session, view, 'view')
+
+
+with description('Simulator'):
+
+    with context('invoke_method()'):
+
+        with it('clones a machine when the clone task finishes'):
+            simulator, session = new_simulator()
+            root = simulator.invoke_accessor(
+                session, Ref('vim.ServiceInstance', 'ServiceInstance'), 'content'
+            ).rootFolder
+            template = next(vm for vm in vms_in(simulator, session, root)
+                            if simulator.invoke_accessor(session, vm, 'name') == 'tmpl')
+            folder = simulator.invoke_accessor(session, template, 'parent')
+
+            task = simulator.invoke_method(session, template, 'CloneVM_Task', [
+                folder, 'clone', SimpleNamespace(location=None, powerOn=False)
+            ])
+            info = simulator.invoke_accessor(session, task, 'info')
+
+            expect(info.state).to(equal('success'))
+            expect(simulator.invoke_accessor(session, info.result, 'name')).to(equal('clone'))
+
+        with it('raises DuplicateName when the folder exists'):
+            simulator, session = new_simulator()
+            root = simulator.invoke_accessor(
+                session, Ref('vim.ServiceInstance', 'ServiceInstance'), 'content'
+            ).rootFolder
+            simulator.invoke_method(session, root, 'CreateFolder', ['new'])
+
+            expect(lambda: simulator.invoke_method(session, root, 'CreateFolder', ['new'])).to(raise_error(Fault))
+
+    with context('invoke_accessor()'):
+
+        with it('refuses unknown sessions'):
+            simulator, session = new_simulator()
+
+            expect(lambda: simulator.invoke_accessor('unknown', Ref('vim.ServiceInstance', 'ServiceInstance'),
+                                                     'content')).to(raise_error(Fault))
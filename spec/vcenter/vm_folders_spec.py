@@ -0,0 +1,31 @@
+from mamba import description, context, it
+from expects import *
+from unittest.mock import Mock
+import spec.modeltr.test_helper
+
+from vcenter.vcenter import VCenter
+
+
+def fake_folder(moid, name, parent=None):
+    obj = Mock()
+    obj._GetMoId = Mock(return_value=moid)
+    return {'obj': obj, 'name': name, 'parent': parent['obj'] if parent else None}
+
+
+with description('VCenter.VmFolders'):
+
+    with context('_build_folder_paths()'):
+
+        with it('assembles full paths from names and parents'):
+            root = fake_folder('group-d1', 'Datacenters')
+            vm = fake_folder('group-v2', 'vm', parent={'obj': Mock(_GetMoId=Mock(return_value='datacenter-3'))})
+            unit = fake_folder('group-v4', 'unit', parent=vm)
+            sub = fake_folder('group-v5', 'sub', parent=unit)
+
+            paths = VCenter.VmFolders._build_folder_paths([sub, unit, root, vm])
+
+            expect(paths).to(have_keys('/Datacenters', '/vm', '/vm/unit', '/vm/unit/sub'))
+            expect(paths['/vm/unit/sub']).to(equal(sub['obj']))
+
+        with it('returns empty dict for no folders'):
+            expect(VCenter.VmFolders._build_folder_paths([])).to(equal({}))
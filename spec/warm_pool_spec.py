@@ -0,0 +1,69 @@
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import MagicMock, patch
+import copy
+import spec.modeltr.test_helper
+
+import warm_pool
+import web.modeltr as data
+from vcenter import simulator
+from vcenter.vcenter import VCenter
+from web.settings import Settings
+
+
+with description('warm_pool'):
+
+    with context('refill_pool()'):
+
+        with before.each:
+            self.vsphere = copy.deepcopy(Settings.app['vsphere'])
+            self.warm_pool = copy.deepcopy(Settings.app['warm_pool'])
+            Settings.app['vsphere'].setdefault('resource_pool', None)
+            Settings.app['vsphere']['simulator'].update(enabled=True, latency={})
+            Settings.app['vsphere']['simulator']['inventory']['templates'] = ['tmpl']
+            Settings.app['warm_pool']['templates'] = {'tmpl': {'size': 1}}
+            simulator._local_simulator = None
+            warm_pool.process_actions = True
+            self.vc = VCenter()
+            self.vc.connect()
+
+        with after.each:
+            Settings.app['vsphere'] = self.vsphere
+            Settings.app['warm_pool'] = self.warm_pool
+            simulator._local_simulator = None
+
+        with it('deploys missing pooled machines into the warm pool folder'):
+            with patch.object(data.Connection, 'use', return_value=MagicMock()), \
+                    patch.object(data.PooledMachine, 'get', return_value=[]), \
+                    patch.object(warm_pool, 'get_free_slots', return_value=1), \
+                    patch.object(data.PooledMachine, 'save', autospec=True) as save:
+                warm_pool.refill_pool(self.vc)
+
+            expect(save.call_count).to(equal(1))
+            pooled = save.call_args[0][0]
+            expect(pooled.template).to(equal('tmpl'))
+            expect(self.vc.get_machine_by_uuid(pooled.provider_id)).not_to(be_none)
+
+        with it('does not deploy pooled machines without a free slot'):
+            with patch.object(data.Connection, 'use', return_value=MagicMock()), \
+                    patch.object(data.PooledMachine, 'get', return_value=[]), \
+                    patch.object(warm_pool, 'get_free_slots', return_value=0), \
+                    patch.object(data.PooledMachine, 'save', autospec=True) as save:
+                warm_pool.refill_pool(self.vc)
+
+            expect(save.called).to(be_false)
+
+    with context('PooledMachine'):
+
+        with it('takes a slot until it is removed from the pool'):
+            pooled = data.PooledMachine(template='tmpl', provider_id='uuid')
+            with patch.object(data.PooledMachine, '_Document__insert'), \
+                    patch.object(data.PooledMachine, '_Document__save'), \
+                    patch.object(data.PooledMachine, 'delete'), \
+                    patch.object(data.SlotCounter, 'add') as add:
+                pooled.save(conn=MagicMock())
+                pooled.id = 'pooled-id'
+                pooled.save(conn=MagicMock())
+                pooled.remove(conn=MagicMock())
+
+            expect([call[1]['used'] for call in add.call_args_list]).to(equal([1, -1]))
@@ -0,0 +1,40 @@
+from mamba import description, context, it, before
+from expects import *
+from unittest.mock import patch, MagicMock
+import spec.modeltr.test_helper
+
+from web.admission import Admission
+from web.settings import Settings
+
+
+with description('Admission'):
+
+    with before.each:
+        Settings.app['service']['admission'].update(max_queue_wait=300, min_queue_depth=10)
+
+    with context('check()'):
+
+        with it('admits deploys below the minimal queue depth'):
+            with patch('web.modeltr.Action.count', return_value=5), \
+                    patch.object(Admission, 'get_deploy_rate', return_value=0.0):
+                expect(Admission.check(5, MagicMock())).to(be_none)
+
+        with it('admits deploys larger than the limit when the queue is empty'):
+            with patch('web.modeltr.Action.count', return_value=0), \
+                    patch.object(Admission, 'get_deploy_rate', return_value=0.0):
+                expect(Admission.check(20, MagicMock())).to(be_none)
+
+        with it('admits deploys processed within max_queue_wait'):
+            with patch('web.modeltr.Action.count', return_value=50), \
+                    patch.object(Admission, 'get_deploy_rate', return_value=0.5):
+                expect(Admission.check(100, MagicMock())).to(be_none)
+
+        with it('computes retry after from the deploy rate'):
+            with patch('web.modeltr.Action.count', return_value=150), \
+                    patch.object(Admission, 'get_deploy_rate', return_value=0.5):
+                expect(Admission.check(10, MagicMock())).to(equal(20))
+
+        with it('limits retry after to max_queue_wait'):
+            with patch('web.modeltr.Action.count', return_value=20), \
+                    patch.object(Admission, 'get_deploy_rate', return_value=0.0):
+                expect(Admission.check(1, MagicMock())).to(equal(300))
@@ -0,0 +1,56 @@
+import queue
+import time
+from mamba import description, context, it
+from expects import *
+from unittest.mock import patch, Mock
+import spec.modeltr.test_helper
+
+from web.middleware.auth_ldap import AuthCache, REFUSED, InvalidCredentials, authenticate, ldap_pool
+
+USER = {'role': 'user', 'dn': 'CN=foo'}
+
+
+with description('AuthCache'):
+
+    with context('key()'):
+
+        with it('does not contain the credentials'):
+            key = AuthCache().key('foo', 'secret')
+
+            expect(key).not_to(contain('foo'))
+            expect(key).not_to(contain('secret'))
+
+        with it('differs between processes'):
+            expect(AuthCache().key('foo', 'secret')).not_to(equal(AuthCache().key('foo', 'secret')))
+
+    with context('get()'):
+
+        with it('returns the result until it expires'):
+            cache = AuthCache()
+            cache.put('key', USER)
+
+            expect(cache.get('key')).to(equal(USER))
+            with patch('time.time', return_value=10 ** 10):
+                expect(cache.get('key')).to(be_none)
+
+        with it('keeps refusals for shorter time'):
+            cache = AuthCache()
+            cache.put('user', USER)
+            cache.put('refused', REFUSED)
+
+            with patch('time.time', return_value=time.time() + 60):
+                expect(cache.get('user')).to(equal(USER))
+                expect(cache.get('refused')).to(be_none)
+
+
+with description('authenticate()'):
+
+    with it('looks the role up by the user\'s connection when no pooled connection is available'):
+        user_conn = Mock()
+        for failure in [queue.Empty(), RuntimeError('not bound'), InvalidCredentials()]:
+            with patch('web.middleware.auth_ldap.get_ldap_connection', return_value=user_conn), \
+                    patch('web.middleware.auth_ldap.get_role', return_value=USER) as get_role, \
+                    patch.object(ldap_pool, 'enabled', return_value=True), \
+                    patch.object(ldap_pool, 'acquire', side_effect=failure):
+                expect(authenticate('foo', 'secret')).to(equal((USER, True)))
+                expect(get_role.call_args[0][0]).to(be(user_conn))
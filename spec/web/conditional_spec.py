@@ -0,0 +1,50 @@
+from mamba import description, context, it
+from expects import *
+from types import SimpleNamespace
+import spec.modeltr.test_helper
+
+from web.conditional import get_validators, is_not_modified
+
+VERSIONS = [('1', '2020-01-01 10:00:00', 'abc'), ('2', '2020-01-02 10:00:00', 'def')]
+
+
+def new_request(**headers):
+    return SimpleNamespace(headers=headers)
+
+
+with description('conditional'):
+
+    with context('get_validators()'):
+
+        with it('changes ETag when a document changes'):
+            etag, _ = get_validators(VERSIONS)
+            changed_etag, _ = get_validators([VERSIONS[0], ('2', '2020-01-02 10:00:00', 'xyz')])
+
+            expect(changed_etag).not_to(equal(etag))
+
+        with it('changes ETag with the variant'):
+            expect(get_validators(VERSIONS, 'admin')[0]).not_to(equal(get_validators(VERSIONS, 'user')[0]))
+
+        with it('has no Last-Modified without documents'):
+            expect(get_validators([])[1]).to(be_none)
+
+    with context('is_not_modified()'):
+
+        with it('matches the current ETag'):
+            etag, last_modified = get_validators(VERSIONS)
+
+            expect(is_not_modified(new_request(**{'If-None-Match': f'"foo", {etag}'}), etag, last_modified)).to(be_true)
+
+        with it('prefers If-None-Match to If-Modified-Since'):
+            etag, last_modified = get_validators(VERSIONS)
+            request = new_request(**{'If-None-Match': '"foo"', 'If-Modified-Since': last_modified})
+
+            expect(is_not_modified(request, etag, last_modified)).to(be_false)
+
+        with it('compares If-Modified-Since with Last-Modified'):
+            etag, last_modified = get_validators(VERSIONS)
+            _, older = get_validators(VERSIONS[:1])
+
+            expect(is_not_modified(new_request(**{'If-Modified-Since': last_modified}), etag, last_modified)) \
+                .to(be_true)
+            expect(is_not_modified(new_request(**{'If-Modified-Since': older}), etag, last_modified)).to(be_false)
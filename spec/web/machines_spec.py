@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import MagicMock, Mock, patch
+import spec.modeltr.test_helper
+
+import web.modeltr as data
+from web.module.machines import to_undeploy_candidate, machines_undeploy_candidates
+
+
+def new_request(raw_args, **args):
+    request = Mock(raw_args=raw_args, headers={})
+    request.args.getlist.side_effect = lambda name: args.get(name)
+    return request
+
+
+with description('machines'):
+
+    with context('to_undeploy_candidate()'):
+
+        with it('joins the machine with the type of its last request'):
+            machine = data.Machine(
+                id='7', machine_name='foo', owner='bar', modified_at=datetime.datetime(2020, 1, 1, 10, 0, 0)
+            )
+            last_request = data.Request(type=data.RequestType.STOP)
+
+            candidate = to_undeploy_candidate(machine, last_request, datetime.datetime(2020, 1, 1, 11, 0, 0))
+
+            expect(candidate).to(equal({
+                'id': '7',
+                'machine_name': 'foo',
+                'owner': 'bar',
+                'modified_at': '2020-01-01 10:00:00',
+                'age': 3600,
+                'last_request_type': 'stop',
+            }))
+
+        with it('has no last request type without requests'):
+            machine = data.Machine(id='7', modified_at=datetime.datetime(2020, 1, 1, 10, 0, 0))
+
+            candidate = to_undeploy_candidate(machine, None, datetime.datetime(2020, 1, 1, 10, 0, 0))
+
+            expect(candidate['last_request_type']).to(be_none)
+
+    with context('machines_undeploy_candidates()'):
+
+        with before.each:
+            self.get_page = patch.object(data.Machine, 'get_page', return_value=[
+                data.Machine(id='7', requests=['8'], modified_at=datetime.datetime(2020, 1, 1, 10, 0, 0)),
+            ]).start()
+            patch.object(data.Request, 'get_by_ids', return_value=[
+                data.Request(id='8', type=data.RequestType.STOP),
+            ]).start()
+            patch.object(data.Connection, 'use', return_value=MagicMock()).start()
+
+        with after.each:
+            patch.stopall()
+
+        with it('selects the oldest machines in the db'):
+            result = asyncio.run(machines_undeploy_candidates(new_request({'state': 'stopped', 'limit': '3'})))
+
+            expect(self.get_page.call_args[1]).to(have_keys(order_by='modified_at', limit='3'))
+            expect([candidate['id'] for candidate in result['result']]).to(equal(['7']))
+
+        with it('reads all machines when they are filtered by their last requests'):
+            request = new_request({'state': 'stopped', 'limit': '3'}, last_request_type=['start'])
+
+            result = asyncio.run(machines_undeploy_candidates(request))
+
+            expect(self.get_page.call_args[1]).to(have_keys(order_by='modified_at', limit=None))
+            expect(result['result']).to(be_empty)
@@ -0,0 +1,71 @@
+import asyncio
+from mamba import description, context, it, before, after
+from expects import *
+from unittest.mock import MagicMock, patch
+import spec.modeltr.test_helper
+
+import web.modeltr as data
+from web.conditional import get_validators
+from web.module.requests import is_versioned, requests
+
+VERSIONS = [('8', '2020-01-01 10:00:00', 'abc')]
+
+# the module reuses the handler name for the request listing
+req_get_info = next(route.handler for route in requests.routes if route.uri == '/requests/<req_id>')
+
+
+async def no_sleep(delay):
+    pass
+
+
+class FakeRequest(dict):
+
+    def __init__(self, **headers):
+        super().__init__()
+        self.raw_args = {}
+        self.headers = headers
+
+
+with description('requests'):
+
+    with context('is_versioned()'):
+
+        with it('covers finished bulk requests and requests other than deploy'):
+            expect(is_versioned([{'type': 'stop', 'state': 'created'}])).to(be_true)
+            expect(is_versioned([{'type': 'bulk', 'state': 'success'}])).to(be_true)
+
+        with it('does not cover deploy requests, unfinished bulk requests and missing requests'):
+            expect(is_versioned([{'type': 'deploy', 'state': 'success'}])).to(be_false)
+            expect(is_versioned([{'type': 'bulk', 'state': 'created'}])).to(be_false)
+            expect(is_versioned([])).to(be_false)
+
+    with context('req_get_info()'):
+
+        with before.each:
+            patch('web.module.requests.asyncio.sleep', new=no_sleep).start()
+            patch.object(data.Connection, 'use', return_value=MagicMock()).start()
+            patch.object(data.Request, 'get_fields', return_value=[{'id': '8', 'type': 'stop', 'state': 'success'}]) \
+                .start()
+            patch.object(data.Request, 'get_versions', return_value=VERSIONS).start()
+            self.load_request = patch('web.module.requests.load_request', return_value=data.Request(
+                id='8', type=data.RequestType.STOP, state=data.RequestState.SUCCESS
+            )).start()
+
+        with after.each:
+            patch.stopall()
+
+        with it('answers an unchanged request without loading it'):
+            etag, _ = get_validators(VERSIONS)
+
+            response = asyncio.run(req_get_info(FakeRequest(**{'If-None-Match': etag}), '8'))
+
+            expect(response.status).to(equal(304))
+            expect(self.load_request.called).to(be_false)
+
+        with it('loads a changed request'):
+            request = FakeRequest(**{'If-None-Match': '"foo"'})
+
+            asyncio.run(req_get_info(request, '8'))
+
+            expect(self.load_request.called).to(be_true)
+            expect(request['response_headers']).to(have_key('ETag'))
@@ -0,0 +1,36 @@
+from mamba import description, context, it
+from expects import *
+import spec.modeltr.test_helper
+
+from web.timing import Timings, current_timings, measure, NOT_MEASURED
+
+
+with description('timing'):
+
+    with context('measure()'):
+
+        with it('does nothing outside of requests'):
+            current_timings.set(None)
+
+            expect(measure('db_execute')).to(be(NOT_MEASURED))
+
+        with it('adds up durations of the phase'):
+            timings = Timings()
+            current_timings.set(timings)
+            with measure('db_execute'):
+                pass
+            with measure('db_execute'):
+                pass
+            current_timings.set(None)
+
+            expect(timings.phases).to(have_key('db_execute'))
+            expect(timings.phases['db_execute']).to(be_above_or_equal(0))
+
+    with context('Timings.to_header()'):
+
+        with it('lists the phases in milliseconds'):
+            timings = Timings()
+            timings.add('auth', 0.0125)
+            timings.add('handler', 0.5)
+
+            expect(timings.to_header()).to(equal('auth;dur=12.5, handler;dur=500.0'))
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import logging
 import os
 import time
-from datetime import datetime
 
 import requests
+import requests.adapters
 import yaml
 
 logging.basicConfig(
@@ -15,75 +16,104 @@ logging.basicConfig(
 )
 
 
+REQUEST_TIMEOUT = 60
+# the same as service.bulk_max_machines of the unit
+DEFAULT_BULK_SIZE = 200
+
+
 def load_config(config_file, env):
     whole_config = yaml.safe_load(open(config_file, 'r').read())
     return whole_config[env]
 
 
-def check_request_type(endpoint, headers, request_id, request_type):
-    response = requests.get(
-        f'{endpoint}requests/{request_id}',
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()['responses'][0]['result']['request_type'] == request_type
-    return False
-
-
-def undeploy_machine(endpoint, headers, machine_id):
-    response = requests.delete(
-        f'{endpoint}machines/{machine_id}',
-        headers=headers
-    )
-    return response.status_code == 200
+def create_session():
+    # connections to the unit are kept alive and reused by the requests of all the reap passes
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_undeploy_candidates(session, endpoint, state, min_age, last_request_type=None, limit=None):
+    """
+    :return: machines in the state, oldest first, joined with their last request type by the unit
+    """
+    params = {'state': state, 'min_age': int(min_age)}
+    if last_request_type is not None:
+        params['last_request_type'] = last_request_type
+    if limit is not None:
+        params['limit'] = limit
+    response = session.get(f'{endpoint}machines/undeploy_candidates', params=params, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError(f'error getting machines in state: {state}, response: {response.status_code}')
+    return response.json()['responses'][0]['result']
+
+
+def undeploy_machines(session, endpoint, machine_ids, bulk_size):
+    """
+    Undeploys the machines by bulk requests of at most bulk_size machines
+    :return: ids of machines the undeploy has been requested for
+    """
+    requested = []
+    for i in range(0, len(machine_ids), bulk_size):
+        chunk = machine_ids[i:i + bulk_size]
+        response = session.post(
+            f'{endpoint}machines/bulk',
+            json={'operation': 'undeploy', 'machine_ids': chunk},
+            timeout=REQUEST_TIMEOUT
+        )
+        if response.status_code == 200:
+            requested += chunk
+            continue
+        # whole bulk request is refused when any of the machines cannot be undeployed, e.g. it is gone already
+        logger.warning(f'bulk undeploy of {len(chunk)} machine(s) failed ({response.status_code}), one by one then')
+        for machine_id in chunk:
+            response = session.delete(f'{endpoint}machines/{machine_id}', timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200:
+                requested.append(machine_id)
+    return requested
 
 
 def check_and_undeploy(
                         endpoint_name,
+                        session,
                         endpoint,
-                        headers,
                         state,
                         interval_to_live,
-                        last_request_type
+                        last_request_type,
+                        bulk_size
 ):
+    """
+    :return: ids of machines the undeploy has been requested for
+    """
     unit_state_name = f'{endpoint_name}[{state}]'
     logger.info(f'{unit_state_name}: examining state: {state}, ensure to live for {interval_to_live} secs.')
     try:
-        response = requests.get(f'{endpoint}machines?state={state}', headers=headers)
-    except Exception:
-        logger.warning(f'{unit_state_name}: error communicating with endpoint: {endpoint}\nSKIPPED!!')
-        return
+        candidates = get_undeploy_candidates(session, endpoint, state, interval_to_live, last_request_type)
+    except Exception as ex:
+        logger.warning(f'{unit_state_name}: error communicating with endpoint: {endpoint}: {repr(ex)}\nSKIPPED!!')
+        return []
 
-    num_machines = 0
-    num_undeployed = 0
-    if response.status_code == 200:
-        for machine in response.json()["responses"][0]["result"]:
-            num_machines += 1
-            machine_id = machine["id"]
-            machine_name = machine["machine_name"]
-            last_request_id = machine["requests"][-1]
-            datetime_obj = datetime.strptime(machine["modified_at"], '%Y-%m-%d %H:%M:%S')
-            seconds_alive = (datetime.now()-datetime_obj).total_seconds()
-            is_request_type_ok = check_request_type(endpoint, headers, last_request_id, last_request_type)
-            hours = seconds_alive / 60 / 60
-            ts = machine["modified_at"]
-            if is_request_type_ok and seconds_alive > interval_to_live:
-                logger.info(f'{unit_state_name}: machine: {machine_name} is to be undeployed ({hours:.2f} hours) {ts}')
-                undeploy_machine(endpoint, headers, machine_id)
-                num_undeployed += 1
-            else:
-                logger.info(f'{unit_state_name}: machine: {machine_name} is to be kept ({hours:.2f} hours) {ts}')
-    else:
-        logger.error(f'{unit_state_name}: error getting machines in state: {state}, response: {response.status_code}')
+    for machine in candidates:
+        hours = machine['age'] / 60 / 60
+        logger.info(f'{unit_state_name}: machine: {machine["machine_name"]} is to be undeployed '
+                    f'({hours:.2f} hours) {machine["modified_at"]}')
+    undeployed = undeploy_machines(session, endpoint, [machine['id'] for machine in candidates], bulk_size)
 
-    logger.info(f'{unit_state_name}: {num_machines} in the state: {state}, {num_undeployed} undeployed')
+    logger.info(f'{unit_state_name}: {len(candidates)} to be undeployed in the state: {state}, '
+                f'{len(undeployed)} undeployed')
+    return undeployed
 
 
-def ensure_capacity(endpoint_name, endpoint, headers, required_free_capacity_percentage):
+def ensure_capacity(endpoint_name, session, endpoint, required_free_capacity_percentage, bulk_size, undeployed=()):
+    """
+    :param undeployed: ids of machines undeployed by this pass already, they can still be stopped
+    """
 
     unit_state_name = f'{endpoint_name}[ensure {required_free_capacity_percentage}%]'
     logger.info(f'{unit_state_name}: ensuring capacity: {required_free_capacity_percentage} percent')
-    response = requests.get(f'{endpoint}capabilities', headers=headers)
+    response = session.get(f'{endpoint}capabilities', timeout=REQUEST_TIMEOUT)
     if response.status_code != 200:
         logger.warning(f"cannot get capabilities of {unit_state_name}, stats not available ({response.status_code})!")
         return
@@ -95,35 +125,71 @@ def ensure_capacity(endpoint_name, endpoint, headers, required_free_capacity_per
     logger.info(f"{unit_state_name}: {slots_free} free, {free_slots_required} required to be free")
 
     if slots_free > free_slots_required:
-        logger.info("-> machine removal not needed, there is enough free slots.")
+        logger.info(f"{unit_state_name}: machine removal not needed, there is enough free slots.")
         return
 
     to_be_removed = free_slots_required - slots_free
-    logger.info(f"-> machine removal NEEDED, {to_be_removed} machine(s) should be removed.")
+    logger.info(f"{unit_state_name}: machine removal NEEDED, {to_be_removed} machine(s) should be removed.")
 
-    machine_seconds = dict()
-    state = "stopped"
     try:
-        response = requests.get(f'{endpoint}machines?state={state}', headers=headers)
-        if response.status_code == 200:
-            all_response_machines = response.json()["responses"][0]["result"]
-            for machine in all_response_machines:
-                machine_id = machine["id"]
-                datetime_obj = datetime.strptime(machine["modified_at"], '%Y-%m-%d %H:%M:%S')
-                seconds_alive = (datetime.now()-datetime_obj).total_seconds()
-                machine_seconds[machine_id] = seconds_alive
+        # the oldest stopped machines only
+        candidates = get_undeploy_candidates(
+            session, endpoint, 'stopped', 0, limit=to_be_removed + len(undeployed)
+        )
     except Exception:
-        logger.error('-> error obtaining machines to be undeployed')
-
-    machine_seconds_sorted = sorted(machine_seconds.items(), key=lambda kv: kv[1], reverse=True)
-    machine_ids_to_be_deleted = machine_seconds_sorted[0:to_be_removed] \
-        if len(machine_seconds_sorted) > to_be_removed else machine_seconds_sorted
-    logger.info(f"-> machine removal NEEDED, {len(machine_ids_to_be_deleted)} machine(s) will be removed.")
-    for machine in machine_ids_to_be_deleted:
-        logger.info(f"-> deleting machine with id {machine[0]}")
-        del_response = requests.delete(f'{endpoint}machines/{machine[0]}', headers=headers)
-        res_str = 'SUCCEEDED' if del_response.status_code == 200 else 'FAILED'
-        logger.info(f"-> deleting machine {res_str}")
+        logger.error(f'{unit_state_name}: error obtaining machines to be undeployed', exc_info=True)
+        return
+    machine_ids = [machine['id'] for machine in candidates if machine['id'] not in undeployed][:to_be_removed]
+
+    logger.info(f"{unit_state_name}: {len(machine_ids)} machine(s) will be removed.")
+    removed = undeploy_machines(session, endpoint, machine_ids, bulk_size)
+    logger.info(f"{unit_state_name}: {len(removed)} machine(s) removed")
+
+
+def reap_cluster(cluster_name, session, config):
+    """
+    One pass over the unit: a few requests per state and a bulk undeploy per bulk_size machines
+    """
+    bulk_size = config.get('bulk_size', DEFAULT_BULK_SIZE)
+    states_dict = {
+        'stopped': {
+            'last_action_type': 'stop',
+            'duration': config['interval']['stopped_duration']
+        },
+        'running': {
+            'last_action_type': 'get_info',
+            'duration': config['interval']['running_duration']
+        },
+        'deployed': {
+            'last_action_type': 'deploy',
+            'duration': config['interval']['deployed_duration']
+        },
+    }
+
+    undeployed = set()
+    for state, data in states_dict.items():
+        undeployed.update(check_and_undeploy(
+            cluster_name,
+            session,
+            config['endpoints'][cluster_name],
+            state,
+            get_custom_config(config.get(f'interval_{cluster_name}'), f'{state}_duration', data['duration']),
+            data['last_action_type'],
+            bulk_size
+        ))
+
+    ensure_capacity(
+        cluster_name,
+        session,
+        config['endpoints'][cluster_name],
+        int(get_custom_config(
+            config.get('required_free_capacity_percentage'),
+            cluster_name,
+            int(config['required_free_capacity_percentage_default']),
+        )),
+        bulk_size,
+        undeployed
+    )
 
 
 def get_custom_config(where, what, default):
@@ -139,49 +205,26 @@ if __name__ == '__main__':
     env = os.getenv('ENV', 'production')
     config = {}
     logger = logging.getLogger(f'idle_undeployer_{env}')
+    sessions = {}
 
     while True:
         config = load_config(config_file, env)
         sleep_interval = config['interval']['sleep']
         logger.debug(config)
-        for cluster_name in config['endpoints'].keys():
-            states_dict = {
-                'stopped': {
-                    'last_action_type': 'stop',
-                    'duration': config['interval']['stopped_duration']
-                },
-                'running': {
-                    'last_action_type': 'get_info',
-                    'duration': config['interval']['running_duration']
-                },
-                'deployed': {
-                    'last_action_type': 'deploy',
-                    'duration': config['interval']['deployed_duration']
-                },
-            }
-
-            for state, data in states_dict.items():
-                check_and_undeploy(
-                    cluster_name,
-                    config['endpoints'][cluster_name],
-                    config['headers'],
-                    state,
-                    get_custom_config(config.get(f'interval_{cluster_name}'), f'{state}_duration', data['duration']),
-                    data['last_action_type']
-                )
-
-            ensure_capacity(
-                cluster_name,
-                config['endpoints'][cluster_name],
-                config['headers'],
-                int(get_custom_config(
-                    config.get('required_free_capacity_percentage'),
-                    cluster_name,
-                    int(config['required_free_capacity_percentage_default']),
-                ))
-            )
-
-            logger.info('')
+        # clusters are independent, they are reaped concurrently
+        concurrency = config.get('concurrency', len(config['endpoints'])) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reaper') as executor:
+            futures = {}
+            for cluster_name in config['endpoints'].keys():
+                session = sessions.setdefault(cluster_name, create_session())
+                # headers can change with the reloaded config
+                session.headers.update(config['headers'])
+                futures[executor.submit(reap_cluster, cluster_name, session, config)] = cluster_name
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    logger.error(f'{futures[future]}: reap pass failed', exc_info=True)
         logger.info('')
         logger.info('')
         time.sleep(sleep_interval)
@@ -13,7 +13,7 @@ import socket
 import vcenter.vcenter as vcenter
 import web.modeltr as data
 from web.modeltr.enums import MachineState, RequestState, RequestType
-from web.settings import Settings, set_context_var, reset_context_var
+from web.settings import Settings, set_context_var, reset_context_var, start_log_queue
 from web.stats import stats_increment_metric_worker as stats_increment_metric
 from web.stats import stats_add_timing_metric_worker as stats_add_timing_metric
 
@@ -82,6 +82,53 @@ def release_deploy_ticket_id(id):
                 logger.warning("Db error when handling release_deploy_ticket_id")
 
 
+def acquire_datastore_reservation(machine_id):
+    """
+    Picks datastore with the most projected free space for a new clone and reserves the space there,
+    so the concurrent deploys spread across datastores
+    :return: moref of picked datastore or None if the tracker is disabled or has no data
+    """
+    tracker = Settings.app['vsphere']['datastore_tracker']
+    if not tracker['enabled']:
+        return None
+
+    reservation_size = int(tracker['clone_reservation_gb'] * 1024 * 1024 * 1024)
+    concurrency_penalty = int(tracker['concurrency_penalty_gb'] * 1024 * 1024 * 1024)
+
+    def projected_free_space(datastore):
+        return datastore.free_space - datastore.get_reserved_space() - \
+            len(datastore.reservations) * concurrency_penalty
+
+    with data.Connection.use('qconn') as conn:
+        datastores = [ds for ds in data.DatastoreInfo.get_for_update({}, conn=conn) if ds.accessible]
+        if not datastores:
+            logger.warning('Datastore tracker has no accessible datastores, falling back to default one')
+            return None
+        datastore = max(datastores, key=projected_free_space)
+        datastore.reservations.append({
+            'machine': machine_id,
+            'size': reservation_size,
+            'created_at': datetime.datetime.now().timestamp(),
+        })
+        datastore.save(conn=conn)
+    logger.debug(f'Datastore {datastore.name} reserved for machine {machine_id}, '
+                 f'{len(datastore.reservations)} clone(s) in flight')
+    return datastore.mo_ref
+
+
+def release_datastore_reservation(machine_id):
+    if Settings.app['vsphere']['datastore_tracker']['enabled']:
+        try:
+            with data.Connection.use('qconn') as conn:
+                for datastore in data.DatastoreInfo.get_for_update({}, conn=conn):
+                    reservations = [item for item in datastore.reservations if item['machine'] != machine_id]
+                    if len(reservations) != len(datastore.reservations):
+                        datastore.reservations = reservations
+                        datastore.save(conn=conn)
+        except Exception as ex:
+            logger.warning(f"Error releasing datastore reservation for {machine_id}: {repr(ex)}", exc_info=True)
+
+
 def get_template(labels):
     for l in labels:
         matches = re.match('template:(.*)', l)
@@ -98,12 +145,35 @@ def get_network_interface(labels):
     return None
 
 
-def get_inventory_folder(labels):
-    for l in labels:
-        matches = re.match('config:inventory_path=(.*)', l)
-        if matches:
-            return matches[1]
-    return None
+def take_pooled_machine(template, running, machine_name, inventory_folder, vc, conn):
+    """
+    Hands a pre-deployed machine over from the warm pool, the pooled machine is removed
+    from the pool in the same transaction as the deploy request is finished
+    :return: uuid of the machine or None if there is no pooled machine available
+    """
+    if not Settings.app['warm_pool']['enabled']:
+        return None
+
+    while True:
+        pooled = data.PooledMachine.get_one_for_update_skip_locked(
+            {'template': template, 'running': 'true' if running else 'false'},
+            conn=conn
+        )
+        if not pooled:
+            return None
+        pooled.remove(conn=conn)
+        try:
+            if vc.assign_pooled_machine(pooled.provider_id, machine_name, inventory_folder):
+                logger.info(f'machine {pooled.machine_name} ({pooled.provider_id}) taken from the warm pool')
+                stats_increment_metric('deploy-pooled')
+                return pooled.provider_id
+        except Exception:
+            Settings.raven.captureException(exc_info=True)
+            logger.warning(f'pooled machine {pooled.provider_id} cannot be assigned, undeploying it', exc_info=True)
+            try:
+                vc.undeploy(pooled.provider_id)
+            except Exception:
+                logger.warning(f'pooled machine {pooled.provider_id} has not been undeployed', exc_info=True)
 
 
 def process_deploy_action(conn, action, vc):
@@ -129,7 +199,7 @@ def process_deploy_action(conn, action, vc):
         else:
             network_interface = get_network_interface(machine_ro.labels)
 
-        inventory_folder = get_inventory_folder(machine_ro.labels)
+        inventory_folder = machine_ro.get_inventory_folder()
         machine_info = {'nos_id': ''}
         if Settings.app['unit_name']:
             output_machine_name = f'{template}-{Settings.app["unit_name"]}-{request.machine}'
@@ -143,7 +213,8 @@ def process_deploy_action(conn, action, vc):
             if Settings.app["vsphere"]["hosts_folder_name"]:
                 ticket = acquire_deploy_ticket()
                 try:
-                    machine = vc.deploy_via_ticket(template, output_machine_name, ticket)
+                    machine = vc.deploy_via_ticket(template, output_machine_name, ticket,
+                                                   network_interface=network_interface)
                     alter_deploy_ticket(ticket, machine["mo_ref"])
                     uuid = machine["uuid"]
                 except Exception as e:
@@ -153,12 +224,21 @@ def process_deploy_action(conn, action, vc):
                     release_deploy_ticket_id(ticket['id'])
                     raise e
             else:
-                uuid = vc.deploy(template,
-                                 output_machine_name,
-                                 running=has_running_label,
-                                 inventory_folder=inventory_folder)
-            if network_interface:
-                vc.config_network(uuid, interface_name=network_interface)
+                uuid = take_pooled_machine(template, has_running_label, output_machine_name, inventory_folder, vc, conn)
+                # pooled machines are reconfigured, clones get the network already by the clone task
+                if uuid and network_interface:
+                    vc.config_network(uuid, interface_name=network_interface)
+            if not uuid:
+                datastore_moref = acquire_datastore_reservation(request.machine)
+                try:
+                    uuid = vc.deploy(template,
+                                     output_machine_name,
+                                     running=has_running_label,
+                                     inventory_folder=inventory_folder,
+                                     datastore_moref=datastore_moref,
+                                     network_interface=network_interface)
+                finally:
+                    release_datastore_reservation(request.machine)
             machine_info = vc.get_machine_info(uuid)
         except Exception as e:
             Settings.raven.captureException(exc_info=True)
@@ -215,12 +295,13 @@ def process_deploy_action(conn, action, vc):
 
 
 def action_undeploy(request, machine, vc):
+    vm_moref = machine.machine_moref
     try:
         stats_increment_metric('undeploy-request')
-        machine_info = vc.get_machine_info(machine.provider_id)
-        result = vc.stop(machine.provider_id)
-        if result is False:
-            logger.debug(f'vc.stop failed (action_undeploy) ({machine.provider_id}) in state {machine.state}')
+        if Settings.app["vsphere"]["hosts_folder_name"] and vm_moref == 'vm-notset':
+            # machines deployed before their moref has been stored need the lookup for the ticket release
+            vm_moref = vc.get_machine_info(machine.provider_id)["mo_ref"]
+        # undeploy powers the machine off itself only if it is running, no separate stop is needed
         vc.undeploy(machine.provider_id)
     except Exception:
         try:
@@ -231,8 +312,8 @@ def action_undeploy(request, machine, vc):
         return MachineState.FAILED
     finally:
         try:
-            if machine_info["mo_ref"] != '':
-                release_deploy_ticket(machine_info["mo_ref"])
+            if vm_moref != 'vm-notset':
+                release_deploy_ticket(vm_moref)
         except Exception:
             logger.warning(f"error in action_undeploy, deploy ticket probably not released", exc_info=True)
 
@@ -331,7 +412,7 @@ def action_take_screenshot(request, machine, vc, conn):
                 ss.image_base64 = screenshot_data
                 ss.status = 'hcpstored'
             else:
-                ss.image_base64 = screenshot_data.decode("utf-8")
+                ss.save_image(screenshot_data, conn=conn)
                 ss.status = 'obtained'
         else:
             ss.image_base64 = ""
@@ -396,6 +477,79 @@ def action_delete_snapshot(request, machine, vc, conn):
     return None
 
 
+def action_bulk(request, vc, action, conn):
+    """
+    Processes the same operation on many machines; all vCenter tasks are issued at once and waited for together
+    """
+    subrequests = [data.Request.get_one_for_update({'_id': sub_id}, conn=conn) for sub_id in request.subrequests]
+    request_type = subrequests[0].type
+    stats_increment_metric(f'bulk-{request_type.value}-request')
+
+    machines = {}
+    snapshots = {}
+    for subrequest in subrequests:
+        machine_ro = data.Machine.get_one({'_id': subrequest.machine}, conn=conn)
+        if request_type is not RequestType.UNDEPLOY and not machine_ro.state.can_be_changed():
+            subrequest.state = RequestState.ABORTED
+            subrequest.save(conn=conn)
+            continue
+        machines[subrequest.id] = machine_ro
+        if request_type is RequestType.TAKE_SNAPSHOT:
+            snapshots[subrequest.id] = data.Snapshot.get_one_for_update({'_id': subrequest.subject_id}, conn=conn)
+
+    snapshot_names = {machines[sub_id].provider_id: snap.get_uniq_name() for sub_id, snap in snapshots.items()}
+    results = vc.run_bulk_operation(
+        request_type.value,
+        [machine.provider_id for machine in machines.values()],
+        snapshot_names=snapshot_names
+    )
+
+    new_machine_states = {
+        RequestType.START: MachineState.RUNNING,
+        RequestType.STOP: MachineState.STOPPED,
+        RequestType.UNDEPLOY: MachineState.UNDEPLOYED,
+    }
+    if request_type in [RequestType.UNDEPLOY, RequestType.STOP]:
+        # tickets are released in their own transactions before any machine is saved here,
+        # saved machines would hold the slot counter locked until this transaction ends
+        for machine_ro in machines.values():
+            release_deploy_ticket(machine_ro.machine_moref)
+
+    for subrequest in subrequests:
+        if subrequest.id not in machines:
+            continue
+        machine_ro = machines[subrequest.id]
+        succeeded = results.get(machine_ro.provider_id, False)
+        subrequest.state = RequestState.SUCCESS if succeeded else RequestState.FAILED
+        subrequest.save(conn=conn)
+
+        if request_type is RequestType.TAKE_SNAPSHOT:
+            snap = snapshots[subrequest.id]
+            snap.status = 'success' if succeeded else 'failed'
+            snap.save(conn=conn)
+
+        machine = data.Machine.get_one_for_update({'_id': machine_ro.id}, conn=conn)
+        if request_type in new_machine_states and machine.state.can_be_changed():
+            if succeeded:
+                machine.state = new_machine_states[request_type]
+            elif request_type is RequestType.UNDEPLOY:
+                machine.state = MachineState.FAILED
+        if request_type is RequestType.TAKE_SNAPSHOT and succeeded:
+            machine.snapshots.append(snapshots[subrequest.id].id)
+        machine.save(conn=conn)
+
+        if request_type is RequestType.START and succeeded and Settings.app['enqueue_get_machine_info'] is True:
+            enqueue_get_info_request(machine, conn)
+
+    failed = [subrequest.id for subrequest in subrequests if subrequest.state.is_error()]
+    if failed:
+        logger.warning(f'bulk request {request.id} failed for subrequests: {failed}')
+    request.state = RequestState.FAILED if failed else RequestState.SUCCESS
+    request.save(conn=conn)
+    action.lock = -1
+    action.save(conn=conn)
+
+
 def process_other_actions(conn, action, vc):
     logger = logging.getLogger('action_others')
     logger.info(f'{os.getpid()}-{action.id}->')
@@ -403,6 +557,10 @@ def process_other_actions(conn, action, vc):
     try:
         request = data.Request.get_one_for_update({'_id': action.request}, conn=conn)
         request_type = request.type
+        if request_type is RequestType.BULK:
+            set_context_var('http_verb', f"B,r:{action.request},a:{action.id},n:{len(request.subrequests)}")
+            action_bulk(request, vc, action, conn)
+            return
         machine_ro = data.Machine.get_one({'_id': request.machine}, conn=conn)
 
         m = f'{os.getpid()}-{action.id}->{request.type}|machine.state:{machine_ro.state}|uuid:{machine_ro.provider_id}'
@@ -495,6 +653,7 @@ if __name__ == '__main__':
         mode = sys.argv[1]
     else:
         mode = 'other'
+    start_log_queue()
 
     logger.info(f'socket default timeout: {socket.getdefaulttimeout()}')
     socket_default_timeout = Settings.app['vsphere']['socket_default_timeout']
@@ -506,7 +665,7 @@ if __name__ == '__main__':
                             dsn=Settings.app['db']['dsn'],
                             socket_reusability=Settings.app['db']['socket_reusability']
     )
-    if Settings.app["vsphere"]["hosts_folder_name"]:
+    if Settings.app["vsphere"]["hosts_folder_name"] or Settings.app['vsphere']['datastore_tracker']['enabled']:
         data.Connection.connect('qconn', dsn=Settings.app['db']['dsn'])
     vc = vcenter.VCenter()
     vc.connect()
@@ -540,7 +699,9 @@ if __name__ == '__main__':
                     if mode == 'deploy':
                         if actions_counter > Settings.app['worker']['load_refresh_interval']:
                             actions_counter = 0
-                            vc.refresh_destination_datastore()
+                            # datastores are picked per deploy when the capacity tracker is enabled
+                            if not Settings.app['vsphere']['datastore_tracker']['enabled']:
+                                vc.refresh_destination_datastore()
                             vc.refresh_destination_resource_pool()
                         process_deploy_action(conn, action, vc)
                     else:
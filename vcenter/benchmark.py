@@ -0,0 +1,81 @@
+"""
+Benchmark of VCenter operations against the vCenter simulator, reports duration and vSphere calls of every phase:
+
+    python -m vcenter.benchmark [machines] [template]   (run from the repository root)
+
+Latencies, inventory sizes and failure rate are configured in vsphere.simulator as for the unit,
+the shared simulator is used when vsphere.simulator.address is set.
+"""
+import collections
+import logging
+import sys
+import time
+
+from vcenter import simulator
+from vcenter.vcenter import VCenter
+from web.settings import Settings
+
+logging.basicConfig(
+    level='INFO',
+    format='%(asctime)s %(thread)d %(threadName)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%dT%H:%M:%S.000Z'
+)
+logger = logging.getLogger(__name__)
+
+# number of the most frequent calls reported per phase
+TOP_CALLS = 5
+
+
+class Benchmark:
+
+    def __init__(self):
+        self.results = []
+
+    def run(self, phase, func, *args):
+        calls_before = collections.Counter(simulator.get_simulator().stats())
+        start = time.perf_counter()
+        result = func(*args)
+        duration = time.perf_counter() - start
+        calls = collections.Counter(simulator.get_simulator().stats())
+        calls.subtract(calls_before)
+        self.results.append((phase, duration, +calls))
+        return result
+
+    def report(self):
+        for phase, duration, calls in self.results:
+            logger.info(f'{phase}: {duration:.3f}s, {sum(calls.values())} calls')
+            for name, count in calls.most_common(TOP_CALLS):
+                logger.info(f'    {name}: {count}')
+
+
+def get_template_name():
+    template_names = Settings.app['vsphere']['simulator']['inventory']['templates'] or [
+        label[len('template:'):] for label in Settings.app['labels'] if label.startswith('template:')
+    ]
+    if not template_names:
+        raise SystemExit('no template configured, set vsphere.simulator.inventory.templates or template labels')
+    return template_names[0]
+
+
+if __name__ == '__main__':
+
+    machines_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    template_name = sys.argv[2] if len(sys.argv) > 2 else get_template_name()
+    Settings.app['vsphere']['simulator']['enabled'] = True
+
+    benchmark = Benchmark()
+    vc = VCenter()
+    benchmark.run('connect', vc.connect)
+
+    machine_uuids = benchmark.run(
+        f'deploy of {machines_count} machine(s)',
+        lambda: [vc.deploy(template_name, f'benchmark-{i}', False) for i in range(machines_count)]
+    )
+    benchmark.run('get_machine_info', lambda: [vc.get_machine_info(uuid) for uuid in machine_uuids])
+    benchmark.run('bulk start', vc.run_bulk_operation, 'start', machine_uuids)
+    benchmark.run('bulk stop', vc.run_bulk_operation, 'stop', machine_uuids)
+    benchmark.run('undeploy', vc.undeploy, machine_uuids[0])
+    benchmark.run('bulk undeploy', vc.run_bulk_operation, 'undeploy', machine_uuids[1:])
+    benchmark.run('remove_empty_folders', vc.remove_empty_folders)
+
+    benchmark.report()
@@ -0,0 +1,102 @@
+import logging
+import ssl
+import threading
+import time
+
+from pyVim.connect import SmartConnect
+from pyVmomi import vim
+from vcenter import simulator
+from web.settings import Settings, log_to
+
+
+# logger for logging in this file
+session_logger = logging.getLogger(__name__)
+
+
+class _Session:
+
+    def __init__(self, service_instance):
+        self.service_instance = service_instance
+        self.last_check = time.time()
+
+
+class SessionManager:
+    """
+    Keeps vCenter sessions authenticated. Liveness is checked by cheap 'currentSession' call
+    at most once per 'check_interval' seconds; expired sessions are logged in again on the same stub,
+    so managed objects obtained before stay usable.
+    """
+
+    def __init__(self):
+        self.__logger = session_logger
+        self.__lock = threading.Lock()
+        self.__main = None
+
+    @property
+    def service_instance(self):
+        return self.__main.service_instance if self.__main else None
+
+    @staticmethod
+    def _smart_connect():
+        if Settings.app['vsphere']['simulator']['enabled']:
+            return simulator.connect()
+        context = ssl._create_unverified_context()
+        return SmartConnect(
+                            host=Settings.app['vsphere']['host'],
+                            user=Settings.app['vsphere']['username'],
+                            pwd=Settings.app['vsphere']['password'],
+                            port=Settings.app['vsphere']['port'],
+                            connectionPoolTimeout=Settings.app['vsphere']['timeout'],
+                            sslContext=context
+        )
+
+    @log_to(session_logger)
+    def connect(self):
+        si = self._smart_connect()
+        if not si:
+            self.__logger.error(
+                'Cannot connect to specified host using specified username and password'
+            )
+        self.__main = _Session(si)
+        return si
+
+    def __is_alive(self, session):
+        try:
+            return session.service_instance.content.sessionManager.currentSession is not None
+        except vim.fault.NotAuthenticated:
+            return False
+
+    def __relogin(self, session):
+        try:
+            session.service_instance.content.sessionManager.Login(
+                Settings.app['vsphere']['username'],
+                Settings.app['vsphere']['password']
+            )
+            self.__logger.info('vCenter session re-authenticated')
+        except Exception:
+            # the stub itself is not usable anymore, completely new connection is needed
+            self.__logger.warning('vCenter re-login failed, reconnecting', exc_info=True)
+            session.service_instance = self._smart_connect()
+
+    def __ensure_session_alive(self, session, forced=False):
+        check_interval = Settings.app['vsphere']['session']['check_interval']
+        if not forced and time.time() - session.last_check < check_interval:
+            return session.service_instance
+        try:
+            alive = self.__is_alive(session)
+        except Exception:
+            self.__logger.warning('vCenter session liveness check failed', exc_info=True)
+            alive = False
+        if not alive:
+            self.__relogin(session)
+        session.last_check = time.time()
+        return session.service_instance
+
+    def ensure_alive(self, forced=False):
+        """
+        Returns authenticated service instance of the main session, re-authenticating it if needed
+        :param forced: check the session regardless of the check interval
+        :return: service instance; it differs from the previous one only in case of complete reconnect
+        """
+        with self.__lock:
+            return self.__ensure_session_alive(self.__main, forced)
@@ -0,0 +1,818 @@
+"""
+Simulator of the subset of vSphere API used by the unit, for tests and benchmarks without vCenter.
+
+Real pyVmomi managed objects are used, only their stub is replaced, so VCenter works unchanged:
+property reads and method calls are answered by Simulator from its in-memory inventory.
+The simulator runs in-process, or it may be shared by all unit processes over a local socket:
+
+    python -m vcenter.simulator   (run from the repository root, serves on vsphere.simulator.address)
+
+Inventory sizes, latencies of calls and tasks and failure rate are configured in vsphere.simulator.
+"""
+import collections
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+from multiprocessing.managers import BaseManager
+from types import SimpleNamespace
+
+from pyVmomi import vim, VmomiSupport
+from web.settings import Settings
+
+
+# logger for logging in this file
+simulator_logger = logging.getLogger(__name__)
+
+# managed object reference as passed between the stub and the simulator
+Ref = collections.namedtuple('Ref', ['type', 'moid'])
+# typed data object, built as real pyVmomi data object by the stub (e.g. devices compared by type)
+Data = collections.namedtuple('Data', ['type', 'fields'])
+
+NIC_TYPE = 'vim.vm.device.VirtualVmxnet3'
+NETWORK_BACKING_TYPE = 'vim.vm.device.VirtualEthernetCard.NetworkBackingInfo'
+
+# folders are also matched when looking for their subtypes
+SUBTYPES = {
+    'vim.Folder': ['vim.StoragePod'],
+    'vim.ManagedEntity': [
+        'vim.Folder', 'vim.StoragePod', 'vim.Datacenter', 'vim.ComputeResource', 'vim.HostSystem',
+        'vim.ResourcePool', 'vim.Datastore', 'vim.VirtualMachine'
+    ],
+}
+
+
+class Fault(Exception):
+    """
+    vSphere fault raised by the simulator, the stub re-raises it as the pyVmomi fault of the same type
+    """
+
+    def __init__(self, fault_type, msg=''):
+        super().__init__(fault_type, msg)
+        self.fault_type = fault_type
+        self.msg = msg
+
+
+class _Entity:
+
+    def __init__(self, type_name, moid, name=None, parent=None, **props):
+        self.type = type_name
+        self.moid = moid
+        self.name = name
+        self.parent = parent
+        self.props = props
+
+    @property
+    def ref(self):
+        return Ref(self.type, self.moid)
+
+
+class _Task:
+
+    def __init__(self, moid, description, duration, complete):
+        self.moid = moid
+        self.description = description
+        self.started_at = time.time()
+        self.finish_at = self.started_at + duration
+        self.complete = complete
+        self.state = 'running'
+        self.result = None
+        self.error = None
+
+
+class Simulator:
+    """
+    In-memory vSphere inventory answering property reads and method calls of pyVmomi managed objects.
+    Tasks take effect when their latency elapses, calls are counted for benchmarking purposes.
+    """
+
+    def __init__(self, config):
+        self.__logger = simulator_logger
+        self.__lock = threading.RLock()
+        self.__config = config
+        self.__latency = config['latency']
+        self.__random = random.Random(config['seed'])
+        self.__counters = collections.defaultdict(itertools.count)
+        self.__entities = {}
+        self.__tasks = {}
+        self.__sessions = {}
+        self.__pages = {}
+        self.__calls = collections.Counter()
+        self.__build_inventory(config['inventory'])
+
+    # -- inventory
+
+    def __new_moid(self, prefix):
+        return f'{prefix}-{next(self.__counters[prefix]) + 1}'
+
+    def __add(self, type_name, prefix, name=None, parent=None, **props):
+        entity = _Entity(type_name, self.__new_moid(prefix), name, parent.moid if parent else None, **props)
+        self.__entities[entity.moid] = entity
+        return entity
+
+    def __add_folder(self, name, parent):
+        return self.__add('vim.Folder', 'group-v', name, parent)
+
+    def __add_folder_path(self, path, vm_folder):
+        # path looks like /vm/root_folder/subfolder
+        folder = vm_folder
+        for name in [item for item in path.split('/')[2:] if item]:
+            folder = self.__find_child(folder, name) or self.__add_folder(name, folder)
+        return folder
+
+    def __add_vm(self, name, folder, host, datastore, power_state='poweredOff', devices=None):
+        return self.__add(
+            'vim.VirtualMachine', 'vm', name, folder,
+            uuid=str(uuid.UUID(int=self.__random.getrandbits(128))),
+            host=host.moid,
+            datastore=datastore.moid if datastore else None,
+            power_state=power_state,
+            frozen=False,
+            devices=devices if devices is not None else [self.__new_nic()],
+            snapshots=[],
+            current_snapshot=None,
+        )
+
+    def __new_nic(self, network='VM Network'):
+        mac = ':'.join(['00', '50', '56'] + ['{:02x}'.format(self.__random.randint(0, 255)) for i in range(3)])
+        return {'key': 4000, 'mac': mac, 'network': network}
+
+    def __build_inventory(self, inventory):
+        vsphere = Settings.app['vsphere']
+        for type_name, moid in [
+            ('vim.view.ViewManager', 'ViewManager'),
+            ('vmodl.query.PropertyCollector', 'propertyCollector'),
+            ('vim.SearchIndex', 'SearchIndex'),
+            ('vim.SessionManager', 'SessionManager'),
+            ('vim.vm.guest.GuestOperationsManager', 'guestOperationsManager'),
+            ('vim.vm.guest.ProcessManager', 'guestOperationsProcessManager'),
+        ]:
+            self.__entities[moid] = _Entity(type_name, moid)
+
+        root = self.__add('vim.Folder', 'group-d', 'Datacenters')
+        self.__root_moid = root.moid
+        datacenter = self.__add('vim.Datacenter', 'datacenter', vsphere['datacenter'] or 'Datacenter', root)
+        vm_folder = self.__add_folder('vm', datacenter)
+        host_folder = self.__add('vim.Folder', 'group-h', 'host', datacenter)
+        datastore_folder = self.__add('vim.Folder', 'group-s', 'datastore', datacenter)
+        datacenter.props.update(vm_folder=vm_folder.moid, host_folder=host_folder.moid)
+
+        # shared datastores, grouped in a datastore cluster named by vsphere.storage
+        capacity = inventory['datastore_capacity_gb'] * 1024 ** 3
+        storage_pod = self.__add('vim.StoragePod', 'group-p', vsphere.get('storage') or 'storage', datastore_folder)
+        datastores = [
+            self.__add('vim.Datastore', 'datastore', f'datastore-{i}', storage_pod, capacity=capacity,
+                       free_space=capacity // 2, hosts=[])
+            for i in range(inventory['datastores'])
+        ]
+
+        # hosts with their own compute resources, resource pools and local datastores
+        hosts_parent = host_folder
+        if vsphere['hosts_folder_name']:
+            hosts_parent = self.__add('vim.Folder', 'group-h', vsphere['hosts_folder_name'], host_folder)
+        hosts = []
+        for i in range(inventory['hosts']):
+            name = f'esx-{i}.simulator.local'
+            compute_resource = self.__add('vim.ComputeResource', 'domain-s', name, hosts_parent)
+            host = self.__add('vim.HostSystem', 'host', name, compute_resource, datastores=[])
+            self.__add('vim.ResourcePool', 'resgroup', 'Resources', compute_resource)
+            local_datastore = self.__add('vim.Datastore', 'datastore', f'{name}-local', datastore_folder,
+                                         capacity=capacity, free_space=capacity // 2, hosts=[host.moid])
+            for datastore in datastores:
+                datastore.props['hosts'].append(host.moid)
+            host.props['datastores'] = [datastore.moid for datastore in datastores] + [local_datastore.moid]
+            hosts.append(host)
+        if vsphere.get('resource_pool') and hosts:
+            self.__add('vim.ResourcePool', 'resgroup', vsphere['resource_pool'], self.__entities[hosts[0].parent])
+        datacenter.props['datastores'] = [
+            entity.moid for entity in self.__entities.values() if entity.type == 'vim.Datastore'
+        ]
+
+        # templates with the snapshot linked clones are based on
+        templates_folder = self.__add_folder('templates', vm_folder)
+        template_names = inventory['templates'] or [
+            label[len('template:'):] for label in Settings.app['labels'] if label.startswith('template:')
+        ]
+        for name in template_names:
+            for host in hosts if not vsphere['hosts_shared_templates'] else hosts[:1]:
+                template = self.__add_vm(name, templates_folder, host, datastores[0] if datastores else None)
+                self.__create_snapshot(template, vsphere.get('default_snapshot_name') or 'default')
+
+        # folder the unit deploys to and the rest of the inventory, scanned by the unit
+        self.__add_folder_path(vsphere['folder'], vm_folder)
+        folders = [self.__add_folder(f'folder-{i}', vm_folder) for i in range(inventory['folders'])] or [vm_folder]
+        for i in range(inventory['vms']):
+            self.__add_vm(f'vm-{i}', self.__random.choice(folders), self.__random.choice(hosts),
+                          self.__random.choice(datastores),
+                          power_state=self.__random.choice(['poweredOn', 'poweredOff']))
+
+        self.__logger.info(f'simulated inventory of {len(self.__entities)} managed objects built')
+
+    def __find_child(self, parent, name):
+        return next((entity for entity in self.__children(parent.moid) if entity.name == name), None)
+
+    def __children(self, moid):
+        return [entity for entity in self.__entities.values() if entity.parent == moid]
+
+    def __descendants(self, moid):
+        # children are indexed once, large inventories would be scanned for every folder otherwise
+        children = collections.defaultdict(list)
+        for entity in self.__entities.values():
+            if entity.parent is not None:
+                children[entity.parent].append(entity)
+        result = []
+        pending = list(children[moid])
+        while pending:
+            entity = pending.pop()
+            result.append(entity)
+            pending.extend(children[entity.moid])
+        return result
+
+    def __entity(self, ref):
+        entity = self.__entities.get(ref.moid) if ref is not None else None
+        if entity is None:
+            raise Fault('vmodl.fault.ManagedObjectNotFound', f'managed object {ref} has been deleted')
+        return entity
+
+    @staticmethod
+    def __is_type(entity_type, wanted_type):
+        return entity_type == wanted_type or entity_type in SUBTYPES.get(wanted_type, [])
+
+    # -- sessions
+
+    def login(self, username, password):
+        """
+        Creates new session, returns its key used by the stub as a session cookie
+        """
+        if username != Settings.app['vsphere']['username'] or password != Settings.app['vsphere']['password']:
+            raise Fault('vim.fault.InvalidLogin', 'Cannot complete login due to an incorrect user name or password')
+        session = uuid.uuid4().hex
+        with self.__lock:
+            self.__sessions[session] = time.time()
+        return session
+
+    def __check_session(self, session):
+        session_timeout = self.__config['session_timeout']
+        last_activity = self.__sessions.get(session)
+        if last_activity is None or (session_timeout and time.time() - last_activity > session_timeout):
+            self.__sessions.pop(session, None)
+            return False
+        self.__sessions[session] = time.time()
+        return True
+
+    # -- dispatching
+
+    def stats(self):
+        """
+        Returns number of calls per method and property, e.g. to compare inventory scan costs
+        """
+        with self.__lock:
+            return dict(self.__calls)
+
+    def invoke_accessor(self, session, ref, name):
+        self.__delay('call')
+        with self.__lock:
+            self.__calls[f'{ref.type}.{name}'] += 1
+            self.__complete_due_tasks()
+            if ref.type == 'vim.SessionManager' and name == 'currentSession':
+                return SimpleNamespace(key=session, userName=Settings.app['vsphere']['username']) \
+                    if self.__check_session(session) else None
+            if not self.__check_session(session):
+                raise Fault('vim.fault.NotAuthenticated', 'The session is not authenticated.')
+            return self.__get_property(ref, name)
+
+    def invoke_method(self, session, ref, name, args):
+        self.__delay('call')
+        with self.__lock:
+            self.__calls[f'{ref.type}.{name}()'] += 1
+            self.__complete_due_tasks()
+            if name == 'Login':
+                self.login(args[0], args[1])
+                self.__sessions[session] = time.time()
+                return SimpleNamespace(key=session, userName=args[0])
+            if not self.__check_session(session):
+                raise Fault('vim.fault.NotAuthenticated', 'The session is not authenticated.')
+            handler = getattr(self, f'_method_{name}', None)
+            if handler is None:
+                raise Fault('vmodl.fault.NotSupported', f'{name} is not supported by the simulator')
+            return handler(ref, *args)
+
+    def __delay(self, kind):
+        latency = self.__latency.get(kind, 0)
+        if latency:
+            time.sleep(latency)
+
+    # -- properties
+
+    def __get_property(self, ref, name):
+        if ref.type == 'vim.ServiceInstance':
+            return self.__get_service_content() if name == 'content' else None
+        if ref.type == 'vim.Task':
+            return self.__get_task_info(ref) if name == 'info' else None
+
+        entity = self.__entity(ref)
+        if name == 'name':
+            return entity.name
+        if name == 'parent':
+            return self.__entities[entity.parent].ref if entity.parent else None
+        getter = getattr(self, '_property_{}_{}'.format(entity.type.split('.')[-1], name), None)
+        return getter(entity) if getter else None
+
+    def __get_service_content(self):
+        return SimpleNamespace(
+            rootFolder=Ref('vim.Folder', self.__root_moid),
+            viewManager=Ref('vim.view.ViewManager', 'ViewManager'),
+            propertyCollector=Ref('vmodl.query.PropertyCollector', 'propertyCollector'),
+            searchIndex=Ref('vim.SearchIndex', 'SearchIndex'),
+            sessionManager=Ref('vim.SessionManager', 'SessionManager'),
+            guestOperationsManager=Ref('vim.vm.guest.GuestOperationsManager', 'guestOperationsManager'),
+            about=SimpleNamespace(vendor='VMware, Inc. (simulated)', apiVersion='6.7'),
+        )
+
+    def _property_Folder_childEntity(self, entity):
+        return [child.ref for child in self.__children(entity.moid)]
+
+    _property_StoragePod_childEntity = _property_Folder_childEntity
+
+    def _property_Datacenter_vmFolder(self, entity):
+        return self.__entities[entity.props['vm_folder']].ref
+
+    def _property_Datacenter_hostFolder(self, entity):
+        return self.__entities[entity.props['host_folder']].ref
+
+    def _property_Datacenter_datastore(self, entity):
+        return [self.__entities[moid].ref for moid in entity.props['datastores']]
+
+    def _property_HostSystem_vm(self, entity):
+        return [vm.ref for vm in self.__entities.values()
+                if vm.type == 'vim.VirtualMachine' and vm.props['host'] == entity.moid]
+
+    def _property_HostSystem_datastore(self, entity):
+        return [self.__entities[moid].ref for moid in entity.props['datastores']]
+
+    def _property_HostSystem_runtime(self, entity):
+        return SimpleNamespace(inMaintenanceMode=False, connectionState='connected', standbyMode='none')
+
+    def _property_Datastore_summary(self, entity):
+        return SimpleNamespace(
+            name=entity.name,
+            freeSpace=entity.props['free_space'],
+            capacity=entity.props['capacity'],
+            accessible=True,
+            maintenanceMode='normal',
+        )
+
+    def _property_Datastore_info(self, entity):
+        return SimpleNamespace(name=entity.name, freeSpace=entity.props['free_space'])
+
+    def _property_Datastore_host(self, entity):
+        return [SimpleNamespace(key=self.__entities[moid].ref) for moid in entity.props['hosts']]
+
+    def _property_VirtualMachine_config(self, entity):
+        return SimpleNamespace(
+            name=entity.name,
+            uuid=entity.props['uuid'],
+            template=False,
+            hardware=SimpleNamespace(device=[
+                Data(NIC_TYPE, {
+                    'key': device['key'],
+                    'macAddress': device['mac'],
+                    'backing': Data(NETWORK_BACKING_TYPE, {'deviceName': device['network']}),
+                }) for device in entity.props['devices']
+            ]),
+        )
+
+    def _property_VirtualMachine_runtime(self, entity):
+        return SimpleNamespace(
+            powerState=entity.props['power_state'],
+            instantCloneFrozen=entity.props['frozen'],
+            host=self.__entities[entity.props['host']].ref,
+        )
+
+    def _property_VirtualMachine_summary(self, entity):
+        return SimpleNamespace(runtime=self._property_VirtualMachine_runtime(entity),
+                               config=SimpleNamespace(name=entity.name, uuid=entity.props['uuid']))
+
+    def _property_VirtualMachine_datastore(self, entity):
+        return [self.__entities[entity.props['datastore']].ref] if entity.props['datastore'] else []
+
+    def _property_VirtualMachine_guest(self, entity):
+        if entity.props['power_state'] != 'poweredOn':
+            return SimpleNamespace(net=[])
+        # deterministic address derived from the mac address
+        mac = entity.props['devices'][0]['mac'] if entity.props['devices'] else '00:00:00:00:00:01'
+        address = '10.{}.{}.{}'.format(*[int(part, 16) for part in mac.split(':')[3:]])
+        return SimpleNamespace(net=[SimpleNamespace(ipConfig=SimpleNamespace(ipAddress=[
+            SimpleNamespace(ipAddress=address)
+        ]))])
+
+    def _property_VirtualMachine_snapshot(self, entity):
+        if not entity.props['snapshots']:
+            return None
+
+        def tree(snapshot):
+            return SimpleNamespace(
+                name=snapshot.name,
+                snapshot=snapshot.ref,
+                childSnapshotList=[tree(self.__entities[moid]) for moid in snapshot.props['children']],
+            )
+        roots = [self.__entities[moid] for moid in entity.props['snapshots']
+                 if self.__entities[moid].props['parent_snapshot'] is None]
+        return SimpleNamespace(
+            currentSnapshot=self.__entities[entity.props['current_snapshot']].ref,
+            rootSnapshotList=[tree(snapshot) for snapshot in roots],
+        )
+
+    def _property_ContainerView_view(self, entity):
+        container = self.__entity(entity.props['container'])
+        candidates = self.__descendants(container.moid) if entity.props['recursive'] else \
+            self.__children(container.moid)
+        return [candidate.ref for candidate in candidates
+                if any(self.__is_type(candidate.type, wanted) for wanted in entity.props['types'])]
+
+    def __resolve_path(self, ref, path):
+        names = path.split('.')
+        value = self.__get_property(ref, names[0])
+        for name in names[1:]:
+            value = getattr(value, name, None)
+        return value
+
+    # -- tasks
+
+    def __new_task(self, description, latency, complete):
+        task = _Task(self.__new_moid('task'), description, self.__latency.get(latency, 0), complete)
+        self.__tasks[task.moid] = task
+        return Ref('vim.Task', task.moid)
+
+    def __complete_due_tasks(self):
+        now = time.time()
+        for task in self.__tasks.values():
+            if task.state == 'running' and task.finish_at <= now:
+                try:
+                    task.result = task.complete()
+                    task.state = 'success'
+                except Fault as fault:
+                    task.error = SimpleNamespace(msg=fault.msg, faultType=fault.fault_type)
+                    task.state = 'error'
+
+    def __get_task_info(self, ref):
+        task = self.__tasks.get(ref.moid)
+        if task is None:
+            raise Fault('vmodl.fault.ManagedObjectNotFound', f'task {ref.moid} does not exist')
+        duration = task.finish_at - task.started_at
+        progress = 100 if task.state != 'running' or duration <= 0 else \
+            min(99, int(100 * (time.time() - task.started_at) / duration))
+        return SimpleNamespace(
+            key=task.moid,
+            state=task.state,
+            progress=progress,
+            result=task.result,
+            error=task.error,
+            description=SimpleNamespace(message=task.description),
+        )
+
+    # -- methods
+
+    def _method_CreateContainerView(self, ref, container, types, recursive):
+        view = self.__add('vim.view.ContainerView', 'session', None, None,
+                          container=container, types=list(types), recursive=recursive)
+        return view.ref
+
+    def _method_DestroyView(self, ref):
+        self.__entities.pop(ref.moid, None)
+
+    def _method_RetrievePropertiesEx(self, ref, spec_set, options):
+        objects = []
+        for spec in spec_set:
+            for object_spec in spec.objectSet:
+                refs = [] if object_spec.skip else [object_spec.obj]
+                for traversal in object_spec.selectSet or []:
+                    if traversal.path == 'view':
+                        refs.extend(self.__get_property(object_spec.obj, 'view'))
+                for obj in refs:
+                    property_spec = next((item for item in spec.propSet if self.__is_type(obj.type, item.type)), None)
+                    if property_spec is None:
+                        continue
+                    prop_set = []
+                    for path in property_spec.pathSet:
+                        value = self.__resolve_path(obj, path)
+                        # unset properties are omitted, as vCenter does
+                        if value is not None:
+                            prop_set.append(SimpleNamespace(name=path, val=value))
+                    objects.append(SimpleNamespace(obj=obj, propSet=prop_set))
+        return self.__page(objects, getattr(options, 'maxObjects', None))
+
+    def _method_ContinueRetrievePropertiesEx(self, ref, token):
+        objects = self.__pages.pop(token, None)
+        if objects is None:
+            raise Fault('vmodl.fault.InvalidArgument', f'invalid token {token}')
+        return self.__page(objects, None)
+
+    def __page(self, objects, max_objects):
+        if not objects:
+            return None
+        page_size = max_objects or self.__config['page_size']
+        token = None
+        if len(objects) > page_size:
+            token = uuid.uuid4().hex
+            self.__pages[token] = objects[page_size:]
+        return SimpleNamespace(objects=objects[:page_size], token=token)
+
+    def _method_FindByUuid(self, ref, datacenter, machine_uuid, vm_search, instance_uuid=None):
+        return next((entity.ref for entity in self.__entities.values()
+                     if entity.type == 'vim.VirtualMachine' and entity.props['uuid'] == machine_uuid), None)
+
+    def _method_CreateFolder(self, ref, name):
+        parent = self.__entity(ref)
+        if self.__find_child(parent, name):
+            raise Fault('vim.fault.DuplicateName', f'The name \'{name}\' already exists.')
+        return self.__add_folder(name, parent).ref
+
+    def _method_MoveIntoFolder_Task(self, ref, entities):
+        def complete():
+            folder = self.__entity(ref)
+            for item in entities:
+                self.__entity(item).parent = folder.moid
+        return self.__new_task('Move entities', 'move', complete)
+
+    def _method_Destroy_Task(self, ref):
+        def complete():
+            entity = self.__entity(ref)
+            for descendant in self.__descendants(entity.moid):
+                self.__entities.pop(descendant.moid, None)
+            self.__entities.pop(entity.moid, None)
+            if entity.type == 'vim.VirtualMachine':
+                for snapshot_moid in entity.props['snapshots']:
+                    self.__entities.pop(snapshot_moid, None)
+                self.__release_space(entity)
+        return self.__new_task('Destroy', 'destroy', complete)
+
+    def __consume_space(self, datastore_moid):
+        datastore = self.__entities.get(datastore_moid)
+        if datastore:
+            clone_size = self.__config['clone_size_gb'] * 1024 ** 3
+            if datastore.props['free_space'] < clone_size:
+                raise Fault('vim.fault.NoDiskSpace', f'Insufficient disk space on datastore \'{datastore.name}\'.')
+            datastore.props['free_space'] -= clone_size
+
+    def __release_space(self, vm):
+        datastore = self.__entities.get(vm.props['datastore'])
+        if datastore:
+            datastore.props['free_space'] += self.__config['clone_size_gb'] * 1024 ** 3
+
+    def __check_failure(self, operation):
+        if self.__random.random() < self.__config['failure_rate']:
+            raise Fault('vim.fault.GenericVmConfigFault', f'simulated failure of {operation}')
+
+    def _method_CloneVM_Task(self, ref, folder, name, spec):
+        def complete():
+            template = self.__entity(ref)
+            destination = self.__entity(folder)
+            self.__check_failure('clone')
+            if self.__find_child(destination, name):
+                raise Fault('vim.fault.DuplicateName', f'The name \'{name}\' already exists.')
+            location = spec.location
+            host = self.__entity(location.host) if location and location.host else \
+                self.__entities[template.props['host']]
+            datastore_moid = location.datastore.moid if location and location.datastore else \
+                template.props['datastore']
+            self.__consume_space(datastore_moid)
+            vm = self.__add_vm(name, destination, host, self.__entities.get(datastore_moid),
+                               power_state='poweredOn' if spec.powerOn else 'poweredOff',
+                               devices=[self.__new_nic(device['network']) for device in template.props['devices']])
+            self.__apply_config(vm, getattr(spec, 'config', None))
+            return vm.ref
+        return self.__new_task(f'Clone virtual machine {name}', 'clone', complete)
+
+    def _method_InstantClone_Task(self, ref, spec):
+        def complete():
+            source = self.__entity(ref)
+            if source.props['power_state'] != 'poweredOn' or not source.props['frozen']:
+                raise Fault('vim.fault.InvalidState', 'The source machine must be running and frozen.')
+            self.__check_failure('instant clone')
+            folder = self.__entity(spec.location.folder) if spec.location and spec.location.folder else \
+                self.__entities[source.parent]
+            vm = self.__add_vm(spec.name, folder, self.__entities[source.props['host']],
+                               self.__entities.get(source.props['datastore']), power_state='poweredOn',
+                               devices=[self.__new_nic(device['network']) for device in source.props['devices']])
+            return vm.ref
+        return self.__new_task(f'Instant clone virtual machine {spec.name}', 'instant_clone', complete)
+
+    def __power_task(self, ref, description, expected_state, new_state):
+        def complete():
+            vm = self.__entity(ref)
+            if expected_state and vm.props['power_state'] != expected_state:
+                raise Fault('vim.fault.InvalidPowerState', f'The attempted operation cannot be performed '
+                                                           f'in the current state ({vm.props["power_state"]}).')
+            vm.props['power_state'] = new_state
+        return self.__new_task(description, 'power', complete)
+
+    def _method_PowerOnVM_Task(self, ref, host=None):
+        return self.__power_task(ref, 'Power On virtual machine', 'poweredOff', 'poweredOn')
+
+    def _method_PowerOffVM_Task(self, ref):
+        return self.__power_task(ref, 'Power Off virtual machine', 'poweredOn', 'poweredOff')
+
+    def _method_ResetVM_Task(self, ref):
+        return self.__power_task(ref, 'Reset virtual machine', None, 'poweredOn')
+
+    def _method_Rename_Task(self, ref, new_name):
+        def complete():
+            entity = self.__entity(ref)
+            if self.__find_child(self.__entities[entity.parent], new_name):
+                raise Fault('vim.fault.DuplicateName', f'The name \'{new_name}\' already exists.')
+            entity.name = new_name
+        return self.__new_task('Rename', 'rename', complete)
+
+    @staticmethod
+    def __apply_config(vm, config):
+        for change in (config.deviceChange or []) if config else []:
+            for device in vm.props['devices']:
+                if device['key'] == change.device.key and change.device.backing is not None:
+                    device['network'] = change.device.backing.deviceName
+
+    def _method_ReconfigVM_Task(self, ref, spec):
+        def complete():
+            self.__apply_config(self.__entity(ref), spec)
+        return self.__new_task('Reconfigure virtual machine', 'reconfigure', complete)
+
+    def _method_CreateScreenshot_Task(self, ref):
+        def complete():
+            vm = self.__entity(ref)
+            datastore = self.__entities.get(vm.props['datastore'])
+            return '[{}] {}/{}-{}.png'.format(datastore.name if datastore else 'datastore', vm.name, vm.name,
+                                              next(self.__counters['screenshot']))
+        return self.__new_task('Create screenshot', 'screenshot', complete)
+
+    def __create_snapshot(self, vm, name):
+        snapshot = self.__add('vim.vm.Snapshot', 'snapshot', name, None, vm=vm.moid, children=[],
+                              parent_snapshot=vm.props['current_snapshot'])
+        if vm.props['current_snapshot']:
+            self.__entities[vm.props['current_snapshot']].props['children'].append(snapshot.moid)
+        vm.props['snapshots'].append(snapshot.moid)
+        vm.props['current_snapshot'] = snapshot.moid
+        return snapshot
+
+    def _method_CreateSnapshot_Task(self, ref, name, description, memory, quiesce):
+        def complete():
+            return self.__create_snapshot(self.__entity(ref), name).ref
+        return self.__new_task(f'Create virtual machine snapshot {name}', 'snapshot', complete)
+
+    def _method_RemoveSnapshot_Task(self, ref, remove_children, consolidate=None):
+        def complete():
+            snapshot = self.__entity(ref)
+            vm = self.__entities[snapshot.props['vm']]
+            parent_moid = snapshot.props['parent_snapshot']
+            if parent_moid:
+                self.__entities[parent_moid].props['children'].remove(snapshot.moid)
+            for child_moid in snapshot.props['children']:
+                self.__entities[child_moid].props['parent_snapshot'] = parent_moid
+                if parent_moid:
+                    self.__entities[parent_moid].props['children'].append(child_moid)
+            vm.props['snapshots'].remove(snapshot.moid)
+            if vm.props['current_snapshot'] == snapshot.moid:
+                vm.props['current_snapshot'] = parent_moid
+            self.__entities.pop(snapshot.moid)
+        return self.__new_task('Remove snapshot', 'snapshot', complete)
+
+    def _method_RevertToSnapshot_Task(self, ref, host=None, suppress_power_on=None):
+        def complete():
+            snapshot = self.__entity(ref)
+            self.__entities[snapshot.props['vm']].props['current_snapshot'] = snapshot.moid
+        return self.__new_task('Revert to snapshot', 'snapshot', complete)
+
+    def _method_StartProgramInGuest(self, ref, vm, auth, spec):
+        if self.__entity(vm).props['power_state'] != 'poweredOn':
+            raise Fault('vim.fault.InvalidState', 'The virtual machine must be powered on.')
+        pid = next(self.__counters['pid']) + 1000
+        self.__entities[f'process-{pid}'] = _Entity(
+            'process', f'process-{pid}', spec.programPath, None,
+            command_line=f'{spec.programPath} {spec.arguments or ""}',
+            finish_at=time.time() + self.__latency.get('guest_command', 0)
+        )
+        return pid
+
+    def _method_ListProcessesInGuest(self, ref, vm, auth, pids=None):
+        result = []
+        for pid in pids or []:
+            process = self.__entities.get(f'process-{pid}')
+            if process:
+                finished = process.props['finish_at'] <= time.time()
+                result.append(SimpleNamespace(pid=pid, cmdLine=process.props['command_line'],
+                                              exitCode=0 if finished else None))
+        return result
+
+
+def _to_plain(value):
+    """
+    Converts pyVmomi objects to plain ones, so that they may be passed to the simulator in other process
+    """
+    if isinstance(value, VmomiSupport.ManagedObject):
+        return Ref(VmomiSupport.GetVmodlName(type(value)), value._moId)
+    if isinstance(value, VmomiSupport.DataObject):
+        return SimpleNamespace(**{
+            prop.name: _to_plain(getattr(value, prop.name, None)) for prop in value._GetPropertyList()
+        })
+    if isinstance(value, type) and issubclass(value, (VmomiSupport.ManagedObject, VmomiSupport.DataObject)):
+        return VmomiSupport.GetVmodlName(value)
+    if isinstance(value, list):
+        return [_to_plain(item) for item in value]
+    if isinstance(value, str):
+        # pyVmomi enums are dynamically created str subclasses, they cannot be pickled
+        return str(value)
+    return value
+
+
+def _from_plain(value, stub):
+    """
+    Converts values returned by the simulator to pyVmomi objects bound to the stub
+    """
+    if isinstance(value, Ref):
+        return VmomiSupport.GetVmodlType(value.type)(value.moid, stub=stub)
+    if isinstance(value, Data):
+        return VmomiSupport.GetVmodlType(value.type)(**{
+            name: _from_plain(item, stub) for name, item in value.fields.items()
+        })
+    if isinstance(value, SimpleNamespace):
+        return SimpleNamespace(**{name: _from_plain(item, stub) for name, item in vars(value).items()})
+    if isinstance(value, list):
+        return [_from_plain(item, stub) for item in value]
+    return value
+
+
+class SimulatorStub:
+    """
+    Replaces SOAP stub of pyVmomi managed objects, their calls are answered by the simulator
+    """
+
+    def __init__(self, simulator, session):
+        self.simulator = simulator
+        self.session = session
+        self.cookie = f'vmware_soap_session="{session}"; Path=/; HttpOnly; Secure;'
+
+    def __call(self, func, *args):
+        try:
+            return _from_plain(func(self.session, *args), self)
+        except Fault as fault:
+            raise VmomiSupport.GetVmodlType(fault.fault_type)(msg=fault.msg)
+
+    def InvokeMethod(self, mo, info, args):
+        return self.__call(self.simulator.invoke_method, _to_plain(mo), info.wsdlName, _to_plain(list(args)))
+
+    def InvokeAccessor(self, mo, info):
+        return self.__call(self.simulator.invoke_accessor, _to_plain(mo), info.name)
+
+
+class SimulatorManager(BaseManager):
+    pass
+
+
+_local_simulator = None
+_local_simulator_lock = threading.Lock()
+
+
+def get_simulator():
+    """
+    Returns the simulator of this process, the shared one is accessed when vsphere.simulator.address is set
+    """
+    global _local_simulator
+    config = Settings.app['vsphere']['simulator']
+    if config['address']:
+        host, port = config['address'].rsplit(':', 1)
+        manager = SimulatorManager(address=(host, int(port)), authkey=config['authkey'].encode())
+        manager.connect()
+        return manager.get_simulator()
+
+    with _local_simulator_lock:
+        if _local_simulator is None:
+            _local_simulator = Simulator(config)
+        return _local_simulator
+
+
+def connect():
+    """
+    Counterpart of pyVim.connect.SmartConnect, returns service instance of the simulator
+    """
+    simulator = get_simulator()
+    session = simulator.login(Settings.app['vsphere']['username'], Settings.app['vsphere']['password'])
+    return vim.ServiceInstance('ServiceInstance', stub=SimulatorStub(simulator, session))
+
+
+SimulatorManager.register('get_simulator')
+
+
+if __name__ == '__main__':
+    simulator_config = Settings.app['vsphere']['simulator']
+    if not simulator_config['address']:
+        raise SystemExit('vsphere.simulator.address must be configured to share the simulator')
+    shared_simulator = Simulator(simulator_config)
+    SimulatorManager.register('get_simulator', callable=lambda: shared_simulator)
+    listen_host, listen_port = simulator_config['address'].rsplit(':', 1)
+    server = SimulatorManager(
+        address=(listen_host, int(listen_port)),
+        authkey=simulator_config['authkey'].encode()
+    ).get_server()
+    simulator_logger.info(f'vCenter simulator listening on {simulator_config["address"]}')
+    server.serve_forever()
@@ -1,5 +1,6 @@
-import base64
 import enum
+import functools
+import io
 import logging
 import re
 import random
@@ -11,8 +12,8 @@ import urllib.request
 
 from typing import Union, Optional
 
-from pyVim.connect import SmartConnect
 from pyVmomi import vim, vmodl
+from vcenter.session import SessionManager
 from web.settings import Settings, log_to
 
 
@@ -25,55 +26,89 @@ class MachineNotFrozenError(RuntimeError):
     pass
 
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# network adapters whose backing is set to the requested network
+NIC_TYPES = (
+    vim.vm.device.VirtualE1000,
+    vim.vm.device.VirtualE1000e,
+    vim.vm.device.VirtualPCNet32,
+    vim.vm.device.VirtualVmxnet,
+    vim.vm.device.VirtualVmxnet2,
+    vim.vm.device.VirtualVmxnet3,
+)
+
+# guest processes are polled more often right after they are started
+GUEST_POLL_INTERVAL_MIN = 0.2
+GUEST_POLL_INTERVAL_MAX = 2
+
 # logger for logging in this file
 vcenter_logger = logging.getLogger(__name__)
 
 
+def relogin_on_not_authenticated(func):
+    """
+    Repeats the call once with re-authenticated session when vCenter session was lost meanwhile
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        except vim.fault.NotAuthenticated:
+            vcenter_logger.warning(f'{func.__name__}(): vCenter session not authenticated, logging in again')
+            self._check_connection(forced=True)
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
 class VCenter:
 
     def __init__(self):
         self._connected = False
         self._connection_cookie = None
+        self._session_manager = SessionManager()
+        self._http_session = None
+        self._template_cache = {}
+        self._snapshot_cache = {}
+        self._devices_cache = {}
+        self._datastore_datacenters = {}
         self.content = None
         self.__logger = vcenter_logger
+        self.si = None
         self.vm_folders = None
         self.destination_datastore = None
         self.destination_resource_pool = None
 
-    def __check_connection(self):
-        result = self.__get_objects_list_from_container(self.content.rootFolder, vim.Datastore)
-        if not result:
-            self.connect()
-
-    @log_to(vcenter_logger)
-    def connect(self, quick=False):
-        context = ssl._create_unverified_context()
-
-        si = SmartConnect(
-                            host=Settings.app['vsphere']['host'],
-                            user=Settings.app['vsphere']['username'],
-                            pwd=Settings.app['vsphere']['password'],
-                            port=Settings.app['vsphere']['port'],
-                            connectionPoolTimeout=Settings.app['vsphere']['timeout'],
-                            sslContext=context
-        )
-
-        if not si:
-            self.__logger.error(
-                'Cannot connect to specified host using specified username and password'
-            )
-
+    def _check_connection(self, forced=False):
+        si = self._session_manager.ensure_alive(forced=forced)
+        if si is not self.si:
+            # completely new connection, all cached managed objects belong to the old one
+            self.__logger.warning('vCenter connection has been re-established')
+            self.__bind_service_instance(si)
+            if self.vm_folders is not None:
+                self.__refresh_cached_objects()
+
+    def __bind_service_instance(self, si):
+        self.si = si
         self.content = si.content
         self._connection_cookie = si._stub.cookie
         self.si_stub = si._stub # to be used for rapid managed object creation
         self._connected = True
+
+    def __refresh_cached_objects(self):
+        self.vm_folders = VCenter.VmFolders(self)
+        self.refresh_destination_datastore()
+        self.refresh_destination_resource_pool()
+
+    @log_to(vcenter_logger)
+    def connect(self, quick=False):
+        si = self._session_manager.connect()
+        self.__bind_service_instance(si)
         if not quick:
-            self.vm_folders = VCenter.VmFolders(self)
-            self.refresh_destination_datastore()
-            self.refresh_destination_resource_pool()
+            self.__refresh_cached_objects()
 
     def idle(self):
-        self.__check_connection()
+        self._check_connection(forced=True)
         self.__logger.debug('keeping connection alive: {}'.format(self.content.about.vendor))
 
     def refresh_destination_datastore(self):
@@ -151,6 +186,35 @@ class VCenter:
 
         return datastore
 
+    @log_to(vcenter_logger)
+    def get_destination_datastores_info(self):
+        """
+        Retrieves capacity of all datastores the unit deploys to, using single PropertyCollector call
+        :return: list of dicts with name, mo_ref, free_space, capacity (both in bytes) and accessible keys
+        """
+        self._check_connection()
+        storage_name = Settings.app['vsphere']['storage']
+        ds_cluster = self.__find_datastore_cluster_by_name(storage_name)
+        container = self.content.rootFolder if ds_cluster is None else ds_cluster
+
+        datastores = self._get_objects_properties_from_container(
+            container,
+            vim.Datastore,
+            ['name', 'summary.freeSpace', 'summary.capacity', 'summary.accessible']
+        )
+        # 'vsphere.storage' may contain directly datastore name
+        if ds_cluster is None:
+            datastores = [item for item in datastores if item['name'] == storage_name]
+
+        # sizes are returned as pyVmomi long, a subclass of int that documents do not accept
+        return [{
+            'name': item['name'],
+            'mo_ref': item['obj']._GetMoId(),
+            'free_space': int(item.get('summary.freeSpace', 0)),
+            'capacity': int(item.get('summary.capacity', 0)),
+            'accessible': item.get('summary.accessible', False),
+        } for item in datastores]
+
     def __get_destination_resource_pool(self):
         self.__logger.debug('Getting destination resource pool...')
         resource_pool_name = Settings.app['vsphere']['resource_pool']
@@ -226,33 +290,96 @@ class VCenter:
     def __search_machine_by_name(self, vm_name):
         for cnt in range(Settings.app['vsphere']['retries']['default']):
             try:
-                container_view = self.content.viewManager.CreateContainerView(
-                                                                       self.__determine_dc_folder(
-                                                                           self.content.rootFolder,
-                                                                       ),
-                                                                       [vim.VirtualMachine],
-                                                                       True
+                # names of all machines are retrieved at once instead of one call per machine
+                vms = self.__retrieve_properties_from_container(
+                    self.__determine_dc_folder(self.content.rootFolder),
+                    vim.VirtualMachine,
+                    ['name']
                 )
-
-                vm = next((item for item in container_view.view if item.name == vm_name), None)
-                container_view.Destroy()
-                return vm
+                return next((item['obj'] for item in vms if item.get('name') == vm_name), None)
             except vmodl.fault.ManagedObjectNotFound:
-                self.__logger.warning(
-                                    'vmodl.fault.ManagedObjectNotFound nas occurred, try: {}'.format(
-                                        cnt
-                                    )
-                )
+                self.__logger.warning(f'vmodl.fault.ManagedObjectNotFound has occurred, try: {cnt}')
                 self.__sleep_between_tries()
             except Exception:
                 Settings.raven.captureException(exc_info=True)
         raise ValueError('machine {} cannot be found'.format(vm_name))
 
-    def __get_linked_clone_task(self, template, machine_name, destination_folder, snapshot_name):
+    def __get_template(self, template_name):
+        """
+        Returns template machine, cached for 'template_cache_ttl' seconds so consecutive clones
+        of the same template do not search the inventory again
+        """
+        cached = self._template_cache.get(template_name)
+        if cached is not None and time.time() - cached['time'] < Settings.app['vsphere']['template_cache_ttl']:
+            return cached['vm']
+
+        template = self.__search_machine_by_name(template_name)
+        if template is not None:
+            self._template_cache[template_name] = {'vm': template, 'time': time.time()}
+        return template
+
+    def __get_template_snapshot(self, template, snapshot_name):
+        key = (template._GetMoId(), snapshot_name)
+        cached = self._snapshot_cache.get(key)
+        if cached is not None and time.time() - cached['time'] < Settings.app['vsphere']['template_cache_ttl']:
+            return cached['snapshot']
 
         snap = self.search_for_snapshot(template, snapshot_name)
+        self._snapshot_cache[key] = {'snapshot': snap, 'time': time.time()}
+        return snap
+
+    def __forget_template(self, template_name, template=None):
+        cached = self._template_cache.pop(template_name, None)
+        template = template or (cached['vm'] if cached else None)
+        if template is not None:
+            template_moid = template._GetMoId()
+            for key in [key for key in self._snapshot_cache if key[0] == template_moid]:
+                del self._snapshot_cache[key]
+            self._devices_cache.pop(template_moid, None)
+
+    def __get_template_devices(self, template):
+        cached = self._devices_cache.get(template._GetMoId())
+        if cached is not None and time.time() - cached['time'] < Settings.app['vsphere']['template_cache_ttl']:
+            return cached['devices']
+
+        devices = template.config.hardware.device
+        self._devices_cache[template._GetMoId()] = {'devices': devices, 'time': time.time()}
+        return devices
 
-        picked_dest_ds = template.datastore[0] if self.destination_datastore is None else self.destination_datastore
+    @staticmethod
+    def __get_network_device_changes(devices, interface_name):
+        """
+        Returns device changes switching all network adapters to the given network
+        """
+        device_changes = []
+        for device in devices:
+            if type(device) in NIC_TYPES:
+                # only the backing is changed, the rest of the adapter (e.g. mac address of a clone) stays intact
+                edited_device = type(device)(
+                    key=device.key,
+                    controllerKey=device.controllerKey,
+                    unitNumber=device.unitNumber,
+                    backing=vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(deviceName=interface_name)
+                )
+                device_changes.append(vim.VirtualDeviceConfigSpec(
+                    operation=vim.VirtualDeviceConfigSpecOperation('edit'),
+                    device=edited_device
+                ))
+        return device_changes
+
+    def __get_clone_config_spec(self, template, network_interface):
+        # network is configured by the clone task itself, no reconfiguration task is needed afterwards
+        if not network_interface:
+            return None
+        device_changes = self.__get_network_device_changes(self.__get_template_devices(template), network_interface)
+        return vim.vm.ConfigSpec(deviceChange=device_changes) if device_changes else None
+
+    def __get_linked_clone_task(self, template, machine_name, destination_folder, snapshot_name, datastore=None,
+                                network_interface=None):
+
+        snap = self.__get_template_snapshot(template, snapshot_name)
+
+        picked_dest_ds = datastore or self.destination_datastore or template.datastore[0]
 
         # for full clone, use 'moveAllDiskBackingsAndDisallowSharing'
         if self.destination_resource_pool:
@@ -274,6 +401,7 @@ class VCenter:
                         powerOn=False,
                         snapshot=snap,
                         template=False,
+                        config=self.__get_clone_config_spec(template, network_interface),
                     )
 
         task = template.CloneVM_Task(
@@ -308,10 +436,14 @@ class VCenter:
                          template: vim.VirtualMachine,
                          target_machine_name: str,
                          machine_folder: str,
-                         default_snap_name: str):
+                         default_snap_name: str,
+                         datastore: Optional[vim.Datastore] = None,
+                         network_interface: Optional[str] = None):
 
         if clone_approach is CloneApproach.LINKED_CLONE:
-            task = self.__get_linked_clone_task(template, target_machine_name, machine_folder, default_snap_name)
+            task = self.__get_linked_clone_task(
+                template, target_machine_name, machine_folder, default_snap_name, datastore, network_interface
+            )
 
         elif clone_approach is CloneApproach.INSTANT_CLONE:
             task = self.__get_instant_clone_task(template, target_machine_name, machine_folder)
@@ -321,15 +453,21 @@ class VCenter:
         return task
 
     @log_to(vcenter_logger)
-    def clone_vm(self, template_name: str, machine_name: str, clone_approach: CloneApproach) -> Optional[vim.VirtualMachine]:
+    def clone_vm(self, template_name: str, machine_name: str, clone_approach: CloneApproach,
+                 datastore: Optional[vim.Datastore] = None,
+                 network_interface: Optional[str] = None,
+                 destination_folder_name: Optional[str] = None) -> Optional[vim.VirtualMachine]:
         """
         Clones VM specified by template_name to target VM specified by machine_name
         :param template_name: source machine name
         :param machine_name:  target machine name
         :param clone_approach: clone strategy (instant or linked)
+        :param datastore: optional, destination datastore of linked clone
+        :param network_interface: optional, network all adapters of the clone are connected to
+        :param destination_folder_name: optional, folder path the clone is created in, vsphere.folder by default
         :return: VM object if successful, else None
         """
-        template = self.__search_machine_by_name(template_name)
+        template = self.__get_template(template_name)
         if not template:
             raise RuntimeError(f"template {template_name} hasn't been found")
 
@@ -339,66 +477,100 @@ class VCenter:
         if template.snapshot:
             self.__logger.debug(f'snapshot: {template.snapshot.currentSnapshot}')
 
-        machine_folder = self.vm_folders.create_folder(Settings.app['vsphere']['folder'])
+        # machine is cloned directly into its final folder, folders are cached so no lookup is needed
+        machine_folder = self.vm_folders.create_folder(destination_folder_name or Settings.app['vsphere']['folder'])
+        if machine_folder is None:
+            raise RuntimeError(f"destination folder {destination_folder_name} hasn't been created")
         default_snap_name = Settings.app['vsphere']['default_snapshot_name']
 
         try:
-            task = self.__get_clone_task(clone_approach, template, machine_name, machine_folder, default_snap_name)
+            task = self.__get_clone_task(
+                clone_approach, template, machine_name, machine_folder, default_snap_name, datastore, network_interface
+            )
         except MachineNotFrozenError as mnfe:
             # fallback from instant clone to linked clone
             Settings.raven.captureException(exc_info=True)
             clone_approach = CloneApproach.LINKED_CLONE
             self.__logger.warning(f'Fallback from {CloneApproach.INSTANT_CLONE} to {clone_approach} due to {repr(mnfe)}')
-            task = self.__get_clone_task(clone_approach, template, machine_name, machine_folder, default_snap_name)
+            task = self.__get_clone_task(
+                clone_approach, template, machine_name, machine_folder, default_snap_name, datastore, network_interface
+            )
 
         vm = self.wait_for_task(task)
         self.__logger.debug(f'{clone_approach} task finished with result: {vm}')
 
         if vm and clone_approach is CloneApproach.INSTANT_CLONE:
             # perform the restart of the network for instant clone
-            login_username = Settings.app.get('vms', {}).get('login_username', None)
-            login_password = Settings.app.get('vms', {}).get('login_password', None)
-
-            post_install_clone_command_list = Settings.app['vsphere'].get('instant_clone_post_commands', [])
-            self.__logger.debug(f'Post instant clone commands in config: {len(post_install_clone_command_list)}')
-
-            for command_dict in post_install_clone_command_list:
-                os = command_dict.get('os', '')
-                description = command_dict.get('description', 'N/A')
-                command = command_dict.get('command')
-                args = command_dict.get('args', '')
-                username = command_dict.get('username', login_username)
-                password = command_dict.get('password', login_password)
-
-                # execute only if template matches os
-                if not template_name.startswith(os):
-                    self.__logger.debug(f'Skipping task with os={os} for {template_name}')
-                    continue
-
-                # check if command and credentials are supplied
-                if not all([command, username, password]):
-                    pass_msg = '<empty>' if not password else '*' * len(password)
-                    self.__logger.warning(f'Incomplete task definition; command={command}, args={args}'
-                                          f'username={username}, password={pass_msg}, cannot run \'{description}\'!')
-                    continue
-
-                # run post instant clone commands
-                self.__logger.debug(f'Running \'{description}\' in VM {vm.config.uuid}')
-                exit_code = self.run_process_in_vm(machine_uuid=vm.config.uuid,
-                                                   username=username,
-                                                   password=password,
-                                                   program_path=command,
-                                                   program_arguments=args)
-
-                result = 'succeeded' if exit_code == 0 else 'failed'
-                self.__logger.debug(f'\'{description}\' {result} in {vm.config.uuid}')
+            self.__run_post_clone_commands(vm, template_name)
+            # instant clone inherits the network of the running source machine
+            if network_interface:
+                self.config_network(vm.config.uuid, interface_name=network_interface)
 
         return vm
 
+    def __run_post_clone_commands(self, vm, template_name):
+        """
+        Runs post instant clone commands matching the template in their order, a command marked 'parallel'
+        is started without waiting for the previously started ones
+        """
+        login_username = Settings.app.get('vms', {}).get('login_username', None)
+        login_password = Settings.app.get('vms', {}).get('login_password', None)
+
+        post_install_clone_command_list = Settings.app['vsphere'].get('instant_clone_post_commands', [])
+        self.__logger.debug(f'Post instant clone commands in config: {len(post_install_clone_command_list)}')
+
+        deadline = time.time() + Settings.app['vsphere']['instant_clone_post_commands_timeout']
+        vm_uuid = vm.config.uuid
+        launched = []
+        started = []
+        exit_codes = {}
+        for command_dict in post_install_clone_command_list:
+            os = command_dict.get('os', '')
+            description = command_dict.get('description', 'N/A')
+            command = command_dict.get('command')
+            args = command_dict.get('args', '')
+            username = command_dict.get('username', login_username)
+            password = command_dict.get('password', login_password)
+
+            # execute only if template matches os
+            if not template_name.startswith(os):
+                self.__logger.debug(f'Skipping task with os={os} for {template_name}')
+                continue
+
+            # check if command and credentials are supplied
+            if not all([command, username, password]):
+                pass_msg = '<empty>' if not password else '*' * len(password)
+                self.__logger.warning(f'Incomplete task definition; command={command}, args={args}'
+                                      f'username={username}, password={pass_msg}, cannot run \'{description}\'!')
+                continue
+
+            if not command_dict.get('parallel', False) and started:
+                exit_codes.update(self.wait_for_guest_processes(started, deadline - time.time()))
+                started = [process for process in started if exit_codes[process['key']] is None]
+
+            self.__logger.debug(f'Running \'{description}\' in VM {vm_uuid}')
+            creds = vim.vm.guest.NamePasswordAuthentication(username=username, password=password)
+            try:
+                pid = self.__start_process_in_vm(vm, creds, command, args)
+            except Exception as e:
+                self.__logger.warning(f'\'{description}\' cannot be started in {vm_uuid}: {repr(e)}')
+                continue
+            process = {'vm': vm, 'creds': creds, 'pid': pid, 'key': (vm._GetMoId(), pid), 'description': description}
+            launched.append(process)
+            started.append(process)
+
+        if started:
+            exit_codes.update(self.wait_for_guest_processes(started, deadline - time.time()))
+        for process in launched:
+            exit_code = exit_codes.get(process['key'])
+            result = 'timeouted' if exit_code is None else 'succeeded' if exit_code == 0 else 'failed'
+            self.__logger.debug(f'\'{process["description"]}\' {result} in {vm_uuid}')
+
     @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def get_machine_by_uuid(self, machine_uuid):
         self.__logger.debug(f'-> get_machine_by_uuid({machine_uuid})')
-        self.__check_connection()
+        self._check_connection()
         vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
         if vm is None:
             raise Exception(f'machine {machine_uuid} not found')
@@ -406,16 +578,16 @@ class VCenter:
         self.__logger.debug(f'<- get_machine_by_uuid: {vm}')
         return vm
 
+    @staticmethod
+    def __get_destination_folder_name(inventory_folder=None):
+        if inventory_folder is None:
+            return Settings.app['vsphere']['folder']
+        return '{}/{}'.format(Settings.app['vsphere']['folder'], inventory_folder)
+
     @log_to(vcenter_logger)
     def deploy(self, template_name, machine_name, running, **kwargs):
-        self.__check_connection()
-        destination_folder_name = Settings.app['vsphere']['folder']
-        if 'inventory_folder' in kwargs and kwargs['inventory_folder'] is not None:
-            inventory_folder = kwargs['inventory_folder']
-            destination_folder_name = '{}/{}'.format(
-                                                        Settings.app['vsphere']['folder'],
-                                                        inventory_folder
-            )
+        self._check_connection()
+        destination_folder_name = self.__get_destination_folder_name(kwargs.get('inventory_folder'))
         retry_deploy_count = Settings.app['vsphere']['retries']['deploy']
         retry_delete_count = Settings.app['vsphere']['retries']['delete']
         inst_clone_enabled = Settings.app['vsphere']['instant_clone_enabled']
@@ -423,15 +595,25 @@ class VCenter:
         clone_approach = CloneApproach.INSTANT_CLONE if inst_clone_enabled and running else CloneApproach.LINKED_CLONE
         self.__logger.debug(f'Using {clone_approach} (running={running}, instant_clone_enabled={inst_clone_enabled})')
 
+        datastore = None
+        if kwargs.get('datastore_moref'):
+            datastore = vim.Datastore(kwargs['datastore_moref'], stub=self.si_stub)
+            self.__logger.debug(f'Using datastore picked by capacity tracker: {kwargs["datastore_moref"]}')
+
         vm = None
         vm_uuid = None
 
         for i in range(retry_deploy_count):
             try:
                 # clone VM based on specified approach
-                vm = self.clone_vm(template_name, machine_name, clone_approach)
+                vm = self.clone_vm(template_name, machine_name, clone_approach, datastore,
+                                   kwargs.get('network_interface'), destination_folder_name)
 
                 if not vm:
+                    # cached template and folder may be outdated, they are searched again next time
+                    self.__forget_template(template_name)
+                    if destination_folder_name:
+                        self.vm_folders.forget_folder(destination_folder_name)
                     # machine must be checked whether it has been created or not,
                     # in no-case machine creation must be re-executed
                     # in yes-case created machine must be deleted and no-case repeated
@@ -462,48 +644,49 @@ class VCenter:
                                 )
                     self.__sleep_between_tries()
                 else:
-                    self.__logger.debug('vms parent: {}'.format(vm.parent))
                     vm_uuid = vm.config.uuid
             except Exception:
                 Settings.raven.captureException(exc_info=True)
                 self.__logger.warning('pyvmomi related exception: ', exc_info=True)
+                self.__forget_template(template_name)
+                if destination_folder_name:
+                    self.vm_folders.forget_folder(destination_folder_name)
                 self.__sleep_between_tries()
             if vm:
-                for retry in range(retry_deploy_count):
-                    try:
-                        self.vm_folders.move_vm_to_folder(vm_uuid, destination_folder_name)
-                    except vim.fault.DuplicateName as e:
-                        Settings.raven.captureException(exc_info=True)
-                        self.__logger.warning(
-                            'destination folder {} not created because {}; trying again'.format(
-                                destination_folder_name,
-                                e
-                            )
-                        )
-                    except Exception as e:
-                        Settings.raven.captureException(exc_info=True)
-                        self.__logger.warning(
-                            'destination folder {} was not created because {}'.format(
-                                destination_folder_name,
-                                e
-                            )
-                        )
-                        self.__sleep_between_tries()
-                        raise e
-
                 return vm_uuid
 
         raise RuntimeError("virtual machine hasn't been deployed")
 
+    @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
+    def assign_pooled_machine(self, machine_uuid, machine_name, inventory_folder=None):
+        """
+        Hands a machine from the warm pool over: renames it and moves it to the destination folder
+        :return: True if the machine has been assigned, False if it does not exist anymore
+        """
+        self._check_connection()
+        vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
+        if not vm:
+            self.__logger.warning(f'pooled machine {machine_uuid} not found')
+            return False
+        task = vm.Rename_Task(newName=machine_name)
+        self.wait_for_task(task)
+        if task.info.state == 'error':
+            raise RuntimeError(f'pooled machine {machine_uuid} cannot be renamed to {machine_name}')
+        self.vm_folders.move_vm_to_folder(machine_uuid, self.__get_destination_folder_name(inventory_folder))
+        return True
+
     # noinspection PyProtectedMember
+    # returns a dict with uuid && mo_ref
     @log_to(vcenter_logger)
-    def deploy_via_ticket(self, template_name, machine_name, deploy_ticket): # returns a dict with uuid && mo_ref
+    def deploy_via_ticket(self, template_name, machine_name, deploy_ticket, network_interface=None):
+        self._check_connection()
         # search for HostSystem
         host = vim.HostSystem(deploy_ticket['host_moref'], stub=self.si_stub)
 
         # search for template
         if Settings.app['vsphere']['hosts_shared_templates']:
-            template = self.__search_machine_by_name(template_name)
+            template = self.__get_template(template_name)
         else:
             vms = self.__get_objects_list_from_container(host, vim.VirtualMachine)
             template = None
@@ -518,7 +701,7 @@ class VCenter:
         default_snap_name = Settings.app['vsphere']['default_snapshot_name']
         destination_machine_folder = self.vm_folders.create_folder(Settings.app['vsphere']['folder'])
 
-        snap = self.search_for_snapshot(template, default_snap_name)
+        snap = self.__get_template_snapshot(template, default_snap_name)
 
         picked_dest_ds = host.datastore[0]
         # search for local one
@@ -547,7 +730,7 @@ class VCenter:
             powerOn=False,
             snapshot=snap,
             template=False,
-
+            config=self.__get_clone_config_spec(template, network_interface),
         )
         vm = None
         for i in range(Settings.app['vsphere']['retries']['deploy']):
@@ -559,6 +742,7 @@ class VCenter:
             vm = self.wait_for_task(task)
             if vm:
                 break
+            self.__forget_template(template_name, template)
             self.__sleep_between_tries()
 
         self.__logger.debug(f'deploy_via_ticket finished with result: {vm}')
@@ -567,58 +751,22 @@ class VCenter:
         else:
             raise RuntimeError(f"cannot deploy the machine {template_name} as {machine_name} on {host.name}")
 
-    def __has_sibling_objects(self, parent_folder, vm_uuid):
-        self.__logger.debug('are there sibling machines in: {}({})?'.format(
-                                                                                parent_folder,
-                                                                                parent_folder.name
-        ))
-        container_view = None
-        for rep in range(5):
-            try:
-                container_view = self.content.viewManager.CreateContainerView(
-                                                                self.content.rootFolder,
-                                                                [vim.VirtualMachine, vim.Folder],
-                                                                True
-                )
-
-                for item in container_view.view:
-                    if item.parent == parent_folder:
-                        if isinstance(item, vim.Folder):
-                            self.__logger.debug('>>found folder: {}'.format(item.name))
-                            return True
-                        if item.config.uuid != vm_uuid:
-                            self.__logger.debug('>>found vm: {}'.format(item.name))
-                            return True
-                return False
-            except vmodl.fault.ManagedObjectNotFound:
-                self.__sleep_between_tries()
-                pass
-            except Exception:
-                Settings.raven.captureException(exc_info=True)
-                self.__sleep_between_tries()
-            finally:
-                self.__logger.debug('searching done')
-                if container_view:
-                    container_view.Destroy()
-        return True
-
     @log_to(vcenter_logger)
     def undeploy(self, machine_uuid):
-        self.__check_connection()
+        """
+        Destroys the machine using a single lookup, a running machine is powered off first
+        because vSphere refuses to destroy it. Folders left empty are removed later by remove_empty_folders()
+        """
+        self._check_connection()
         for attempt in range(6):
             try:
                 vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
                 if vm:
-                    self.__logger.debug('found vm: {}'.format(vm.config.uuid))
+                    self.__logger.debug('found vm: {}'.format(machine_uuid))
 
-                    parent_folder = vm.parent
-                    parent_folder_name = vm.parent.name
-                    has_sibling_machines = True
-                    # has_sibling_machines = self.__has_sibling_objects(
-                    #    has_sibling_machines = True
-                    #    parent_folder,
-                    #    vm.config.uuid
-                    # )
+                    if vm.runtime.powerState == vim.VirtualMachinePowerState.poweredOn:
+                        self.wait_for_task(vm.PowerOffVM_Task())
+                        self.__logger.debug('vm powered off')
 
                     for i in range(5):
                         try:
@@ -628,18 +776,6 @@ class VCenter:
                             break
                         except vmodl.fault.ManagedObjectNotFound:
                             self.__sleep_between_tries()
-
-                    if not has_sibling_machines:
-                        self.__logger.debug(
-                            'folder: {} is going to be removed'.format(
-                                                                    parent_folder_name
-                            )
-                        )
-                        self.vm_folders.delete_folder(parent_folder)
-                        self.__logger.debug('folder: {} has been deleted'.format(
-                            parent_folder_name
-                        )
-                        )
                     return
                 else:
                     self.__logger.warning(
@@ -656,8 +792,24 @@ class VCenter:
         raise RuntimeError("virtual machine hasn't been released")
 
     @log_to(vcenter_logger)
+    def remove_empty_folders(self, busy_folders=()):
+        """
+        Removes subfolders of the unit folder which have stayed empty since the previous call
+        :param busy_folders: folders relative to the unit folder deploys may clone into, they are kept
+        :return: number of removed folders
+        """
+        self._check_connection()
+        # folders are created by all workers, the tree known to this process may be outdated
+        if self.vm_folders is None:
+            self.vm_folders = VCenter.VmFolders(self)
+        else:
+            self.vm_folders.refresh()
+        return self.vm_folders.remove_empty_folders(busy_folders)
+
+    @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def start(self, machine_uuid):
-        self.__check_connection()
+        self._check_connection()
 
         vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
         if vm:
@@ -670,7 +822,7 @@ class VCenter:
 
     @log_to(vcenter_logger)
     def stop(self, machine_uuid):
-        self.__check_connection()
+        self._check_connection()
         failed_attempts = 0
         for i in range(Settings.app['vsphere']['retries']['config_network']):
             try:
@@ -697,8 +849,9 @@ class VCenter:
         return False
 
     @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def reset(self, machine_uuid):
-        self.__check_connection()
+        self._check_connection()
         vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
         if not vm:
             raise Exception('machine {} not found'.format(machine_uuid))
@@ -709,6 +862,7 @@ class VCenter:
         self.__logger.debug('vm reset done')
 
     @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def _take_screenshot_to_datastore(self, machine_uuid):
         """
         Takes screenshot of VM and saves it in datastore
@@ -717,7 +871,7 @@ class VCenter:
         and path to screenshot in datastore
         """
         self.__logger.debug('-> take_screenshot()')
-        self.__check_connection()
+        self._check_connection()
         vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
         if vm is None:
             raise Exception(f'machine {machine_uuid} not found')
@@ -765,10 +919,10 @@ class VCenter:
     @log_to(vcenter_logger)
     def take_screenshot(self, machine_uuid: str, store_to: str = 'db') -> Union[bytes, str]:
         """
-        Takes screenshot of VM and returns it as base64 encoded string or hcp url
+        Takes screenshot of VM and returns it as raw image data or hcp url
         :param machine_uuid: machine uuid
         :param store_to: screenshot destination, db or hcp for now
-        :return: base64 encoded string, or hcp url or None in case of failure
+        :return: image bytes, or hcp url or None in case of failure
         """
         datastore, path = self._take_screenshot_to_datastore(machine_uuid=machine_uuid)
         self.__logger.debug(f'datastore: {datastore}, path: {path}')
@@ -778,13 +932,14 @@ class VCenter:
                 if store_to == "hcp":
                     return self._store_screenshot_to_hcp(machine_uuid, screenshot_data)
                 elif store_to == "db":
-                    return base64.b64encode(screenshot_data)
+                    return screenshot_data
                 else:
                     Settings.raven.captureMessage(f'invalid store_to specification ({store_to})')
             else:
                 Settings.raven.captureMessage('Error obtaining screenshot data')
 
     @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def take_snapshot(self, machine_uuid, snapshot_name) -> bool:
         self.__logger.debug(f'-> take_snapshot({machine_uuid}, {snapshot_name})')
         vm = self.get_machine_by_uuid(machine_uuid=machine_uuid)
@@ -800,6 +955,7 @@ class VCenter:
         return result
 
     @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def remove_snapshot(self, machine_uuid, snapshot_name):
         self.__logger.debug(f'-> remove_snapshot({machine_uuid}, {snapshot_name})')
         vm = self.get_machine_by_uuid(machine_uuid)
@@ -809,6 +965,7 @@ class VCenter:
         self.__logger.debug(f'<- remove_snapshot()')
 
     @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def revert_snapshot(self, machine_uuid, snapshot_name):
         self.__logger.debug(f'-> revert_snapshot({machine_uuid}, {snapshot_name})')
         vm = self.get_machine_by_uuid(machine_uuid)
@@ -841,53 +998,182 @@ class VCenter:
 
         return result
 
-    def __get_datacenter_for_datastore(self, datastore_name):
-        dcs = self.__get_objects_list_from_container(self.content.rootFolder, vim.Datacenter)
-        for dc in dcs:
-            data_stores = self.__get_objects_list_from_container(dc, vim.Datastore)
-            for ds in data_stores:
-                if ds.info.name == datastore_name:
-                    return dc
-        return None
+    def __retrieve_properties(self, filter_spec):
+        result = []
+        collector = self.content.propertyCollector
+        retrieved = collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+        while retrieved is not None:
+            for object_content in retrieved.objects:
+                item = {prop.name: prop.val for prop in object_content.propSet}
+                item['obj'] = object_content.obj
+                result.append(item)
+            if not retrieved.token:
+                break
+            retrieved = collector.ContinueRetrievePropertiesEx(retrieved.token)
+        return result
 
-    def get_file_bytes_from_datastore(self, remote_path_to_file, datastore_name):
+    def _get_objects_properties(self, objects, object_type, properties):
         """
-        Downloads file from datastore (with retries) and returns its data.
-        Note: keep in mind requested file size, since data are in memory!
+        Retrieves given properties of all given objects via single PropertyCollector retrieval
+        :param objects: list of managed objects of the same type
+        :param object_type: vim type of the objects
+        :param properties: list of property paths to be retrieved
+        :return: list of dicts, each containing retrieved properties and the object itself under 'obj' key
+        """
+        if not objects:
+            return []
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=obj, skip=False) for obj in objects],
+            propSet=[vmodl.query.PropertyCollector.PropertySpec(type=object_type, pathSet=properties, all=False)]
+        )
+        return self.__retrieve_properties(filter_spec)
+
+    def _get_objects_properties_from_container(self, container, object_type, properties):
+        """
+        Retrieves given properties of all objects of given type in container via single PropertyCollector
+        retrieval, instead of one SOAP call per object and property.
+        :param container: managed entity to start the search from
+        :param object_type: vim type of objects to be retrieved
+        :param properties: list of property paths to be retrieved
+        :return: list of dicts, each containing retrieved properties and the object itself under 'obj' key,
+                 empty list if the retrieval fails
+        """
+        try:
+            return self.__retrieve_properties_from_container(container, object_type, properties)
+        except vmodl.fault.ManagedObjectNotFound:
+            self.__logger.warning('vmodl.fault.ManagedObjectNotFound has occurred')
+        except Exception:
+            Settings.raven.captureException(exc_info=True)
+        return []
+
+    def __retrieve_properties_from_container(self, container, object_type, properties):
+        object_view = None
+        try:
+            object_view = self.content.viewManager.CreateContainerView(
+                    container,
+                    [object_type],
+                    True)
+            traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+                name='traverseView',
+                path='view',
+                skip=False,
+                type=vim.view.ContainerView
+            )
+            object_spec = vmodl.query.PropertyCollector.ObjectSpec(
+                obj=object_view,
+                skip=True,
+                selectSet=[traversal_spec]
+            )
+            property_spec = vmodl.query.PropertyCollector.PropertySpec(
+                type=object_type,
+                pathSet=properties,
+                all=False
+            )
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+                objectSet=[object_spec],
+                propSet=[property_spec]
+            )
+            return self.__retrieve_properties(filter_spec)
+        finally:
+            if object_view is not None:
+                object_view.Destroy()
+
+    def __get_datacenter_for_datastore(self, datastore_name):
+        if datastore_name not in self._datastore_datacenters:
+            # mapping of all datastores is obtained at once and refreshed only for unknown datastores
+            datastore_names = {
+                item['obj']._GetMoId(): item['name'] for item in
+                self._get_objects_properties_from_container(self.content.rootFolder, vim.Datastore, ['name'])
+            }
+            self._datastore_datacenters = {}
+            datacenters = self._get_objects_properties_from_container(
+                self.content.rootFolder,
+                vim.Datacenter,
+                ['name', 'datastore']
+            )
+            for dc in datacenters:
+                for ds in dc.get('datastore', []):
+                    if ds._GetMoId() in datastore_names:
+                        self._datastore_datacenters[datastore_names[ds._GetMoId()]] = dc['name']
+        return self._datastore_datacenters.get(datastore_name)
+
+    def __get_http_session(self):
+        if self._http_session is None:
+            # connections to the vCenter are kept alive and reused for all downloads
+            self._http_session = requests.Session()
+            self._http_session.verify = False
+        return self._http_session
+
+    def __get_session_cookie_header(self):
+        # stub cookie looks like: vmware_soap_session="..."; Path=/; HttpOnly; Secure;
+        return {'Cookie': self.si_stub.cookie.split(';', 1)[0]}
+
+    def download_file_from_datastore(self, remote_path_to_file, datastore_name, sink):
+        """
+        Downloads file from datastore (with retries) and writes its data into sink chunk by chunk.
+        Download is retried only until the first chunk is written into the sink.
         :param remote_path_to_file: path to file in datastore (e.g. my_vm/my_vm.png)
         :param datastore_name: name of datastore
-        :return: data
+        :param sink: file-like object with write() method
+        :return: True if the whole file has been written into the sink, otherwise False
         """
-        self.__check_connection()
+        self._check_connection()
         server_name = Settings.app['vsphere']['host']
-        datacenter = self.__get_datacenter_for_datastore(datastore_name)
-        if datacenter is None:
+        datacenter_name = self.__get_datacenter_for_datastore(datastore_name)
+        if datacenter_name is None:
             raise RuntimeError(f'Cannot find datacenter for datastore {datastore_name}')
 
-        url = f'https://{server_name}/folder/{remote_path_to_file}?dcPath={datacenter.name}&dsName={datastore_name}'
+        url = f'https://{server_name}/folder/{remote_path_to_file}'
+        params = {'dcPath': datacenter_name, 'dsName': datastore_name}
+        session = self.__get_http_session()
+        use_cookie = True
+        written = 0
 
         for i in range(3):
             try:
-                # resp = requests.get(url=url, verify=False, headers={'Cookie': self._connection_cookie})
-                # the cookie usage was dropped because the new solution improved stability
-                resp = requests.get(
+                # vCenter session is reused, basic auth is used only when the session is refused
+                auth_kwargs = {'headers': self.__get_session_cookie_header()} if use_cookie else \
+                    {'auth': (Settings.app['vsphere']['username'], Settings.app['vsphere']['password'])}
+                with session.get(
                     url=url,
-                    verify=False,
-                    auth=(Settings.app['vsphere']['username'], Settings.app['vsphere']['password']),
+                    params=params,
+                    stream=True,
                     timeout=Settings.app['vsphere']['socket_default_timeout'],
-                )
-                if resp.status_code == 200:
-                    # download ok, save return path
-                    return resp.content
-                else:
-                    # try again
+                    **auth_kwargs
+                ) as resp:
+                    if resp.status_code == 200:
+                        for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            sink.write(chunk)
+                            written += len(chunk)
+                        return True
+
                     msg = f'Download of {remote_path_to_file} (retry {i}) failed with status code: {resp.status_code}'
                     self.__logger.warning(msg)
+                    if resp.status_code in (401, 403):
+                        use_cookie = False
+                        continue
                     self.__sleep_between_tries()
-                    continue
             except Exception as e:
                 self.__logger.warning(f'Downloading of {remote_path_to_file} (retry {i}) failed: {e}')
                 Settings.raven.captureException(exc_info=True)
+                if written > 0:
+                    # partially written data cannot be taken back
+                    return False
+
+        # failed, nothing has been downloaded
+        return False
+
+    def get_file_bytes_from_datastore(self, remote_path_to_file, datastore_name):
+        """
+        Downloads file from datastore (with retries) and returns its data.
+        Note: keep in mind requested file size, since data are in memory!
+        :param remote_path_to_file: path to file in datastore (e.g. my_vm/my_vm.png)
+        :param datastore_name: name of datastore
+        :return: data
+        """
+        buffer = io.BytesIO()
+        if self.download_file_from_datastore(remote_path_to_file, datastore_name, buffer):
+            return buffer.getvalue()
 
         # failed, nothing to return
         return None
@@ -895,33 +1181,20 @@ class VCenter:
     @log_to(vcenter_logger)
     def config_network(self, device_uuid, **kwargs):
         self.__logger.debug('config_network')
-        self.__check_connection()
+        self._check_connection()
         for i in range(Settings.app['vsphere']['retries']['config_network']):
             try:
 
                 vm = self.content.searchIndex.FindByUuid(None, device_uuid, True)
 
-                for device in vm.config.hardware.device:
-                    if type(device) == vim.vm.device.VirtualE1000 or \
-                       type(device) == vim.vm.device.VirtualE1000e or \
-                       type(device) == vim.vm.device.VirtualPCNet32 or \
-                       type(device) == vim.vm.device.VirtualVmxnet or \
-                       type(device) == vim.vm.device.VirtualVmxnet2 or \
-                       type(device) == vim.vm.device.VirtualVmxnet3:
-                        device.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(
-                            deviceName=kwargs['interface_name']
-                        )
-
-                        device_config_spec = vim.VirtualDeviceConfigSpec(
-                            operation=vim.VirtualDeviceConfigSpecOperation('edit'),
-                            device=device
-                        )
-
-                        machine_config_spec = vim.vm.ConfigSpec(
-                            deviceChange=[device_config_spec]
-                        )
-                        task = vm.ReconfigVM_Task(spec=machine_config_spec)
-                        self.wait_for_task(task)
+                # all network adapters are reconfigured by a single task
+                device_changes = self.__get_network_device_changes(
+                    vm.config.hardware.device,
+                    kwargs['interface_name']
+                )
+                if device_changes:
+                    task = vm.ReconfigVM_Task(spec=vim.vm.ConfigSpec(deviceChange=device_changes))
+                    self.wait_for_task(task)
                 break
             except Exception:
                 self.__sleep_between_tries()
@@ -947,6 +1220,63 @@ class VCenter:
         finally:
             return result
 
+    def __start_process_in_vm(self, vm, creds, program_path, program_arguments=''):
+        program_spec = vim.vm.guest.ProcessManager.ProgramSpec(programPath=program_path, arguments=program_arguments)
+        process_manager = self.content.guestOperationsManager.processManager
+        try:
+            pid = process_manager.StartProgramInGuest(vm, creds, program_spec)
+        except Exception as e:
+            # guest tools of a freshly cloned machine may not be ready yet
+            self.__logger.warning(f'Staring program \'{program_path}\' failed: {repr(e)}; will retry..')
+            time.sleep(GUEST_POLL_INTERVAL_MIN)
+            pid = process_manager.StartProgramInGuest(vm, creds, program_spec)
+
+        if pid <= 0:
+            raise RuntimeError(f"Could not start {program_spec.programPath} process!")
+        return pid
+
+    def wait_for_guest_processes(self, processes, timeout):
+        """
+        Waits for guest processes of any number of machines together; processes of one machine are listed
+        by a single call per iteration and the polling interval grows while nothing finishes
+        :param processes: list of dicts with vm, creds, pid and key keys, key identifies the process in the result
+        :param timeout: overall deadline in seconds
+        :return: dict with process key as a key and exit code as a value, None if the process has not finished
+        """
+        deadline = time.time() + timeout
+        exit_codes = {process['key']: None for process in processes}
+        pending = list(processes)
+        interval = GUEST_POLL_INTERVAL_MIN
+        process_manager = self.content.guestOperationsManager.processManager
+        while pending:
+            machines = {}
+            for process in pending:
+                machines.setdefault(process['vm']._GetMoId(), []).append(process)
+            for machine_processes in machines.values():
+                processes_by_pid = {process['pid']: process for process in machine_processes}
+                try:
+                    infos = process_manager.ListProcessesInGuest(
+                        machine_processes[0]['vm'], machine_processes[0]['creds'], list(processes_by_pid.keys())
+                    )
+                except Exception as e:
+                    self.__logger.warning(f'Listing guest processes failed: {repr(e)}')
+                    continue
+                for info in infos:
+                    if isinstance(info.exitCode, int) and info.pid in processes_by_pid:
+                        self.__logger.debug(f'Process pid {info.pid} {info.cmdLine} finished;\n{info}')
+                        exit_codes[processes_by_pid[info.pid]['key']] = info.exitCode
+
+            pending = [process for process in pending if exit_codes[process['key']] is None]
+            remaining = deadline - time.time()
+            if pending and remaining <= 0:
+                self.__logger.warning(f'{len(pending)} guest process(es) not finished in {timeout:.1f}s')
+                break
+            if pending:
+                self.__logger.debug(f'{len(pending)} guest process(es) still running; sleep({interval})')
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, GUEST_POLL_INTERVAL_MAX)
+        return exit_codes
+
     @log_to(vcenter_logger)
     def run_process_in_vm(self, machine_uuid, username, password, program_path, program_arguments='', run_async=False) -> Optional[int]:
         """
@@ -957,40 +1287,23 @@ class VCenter:
         :param program_path: path to program
         :param program_arguments: optional, program arguments
         :param run_async: do not wait for process end
-        :return: exit code of process (if not running async)
+        :return: exit code of process (if not running async and finished in time)
 
         Note: Process stderr and stdout is not collected as it's not directly supported by VMWare tools
 
         """
         self.__logger.debug(f'-> run_process_in_vm({machine_uuid}, {username}, ***, {program_path}, {program_arguments}, {run_async})')
-        sleep_delta = 0.5
         vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
         creds = vim.vm.guest.NamePasswordAuthentication(username=username, password=password)
-        program_spec = vim.vm.guest.ProcessManager.ProgramSpec(programPath=program_path, arguments=program_arguments)
-        process_manager = self.content.guestOperationsManager.processManager
-        try:
-            res = process_manager.StartProgramInGuest(vm, creds, program_spec)
-        except Exception as e:
-            self.__logger.warning(f'Staring program \'{program_path}\' failed: {repr(e)}; will retry..')
-            time.sleep(1)
-            res = process_manager.StartProgramInGuest(vm, creds, program_spec)
-
-        if res > 0:
-            result = None
-            while run_async is False:
-                process_info = process_manager.ListProcessesInGuest(vm, creds, [res]).pop()
-                pid_exitcode = process_info.exitCode
-                if isinstance(pid_exitcode, int):
-                    self.__logger.debug(f'Process pid {process_info.pid} {process_info.cmdLine} finished;\n{process_info}')
-                    result = pid_exitcode
-                    break
-                else:
-                    self.__logger.debug(f'Process pid {process_info.pid} {process_info.cmdLine} still running; sleep({sleep_delta})')
-                    time.sleep(sleep_delta)
-            self.__logger.debug(f'<- run_process_in_vm(): {repr(result)}')
-            return result
-        else:
-            raise RuntimeError(f"Could not start {program_spec.programPath} process!")
+        pid = self.__start_process_in_vm(vm, creds, program_path, program_arguments)
+
+        result = None
+        if run_async is False:
+            process = {'vm': vm, 'creds': creds, 'pid': pid, 'key': pid}
+            timeout = Settings.app['vsphere']['instant_clone_post_commands_timeout']
+            result = self.wait_for_guest_processes([process], timeout)[pid]
+        self.__logger.debug(f'<- run_process_in_vm(): {repr(result)}')
+        return result
 
     @log_to(vcenter_logger)
     def _get_machine_ips(self, vm, machine_uuid):
@@ -1025,8 +1338,9 @@ class VCenter:
         return result
 
     @log_to(vcenter_logger)
+    @relogin_on_not_authenticated
     def get_machine_info(self, machine_uuid):
-        self.__check_connection()
+        self._check_connection()
         result = {'ip_addresses': [], 'nos_id': '', 'machine_search_link': '', 'mo_ref': ''}
 
         vm = self.content.searchIndex.FindByUuid(None, machine_uuid, True)
@@ -1065,26 +1379,168 @@ class VCenter:
             state = task.info.state
             if state == 'success' or state == 'error':
                 break
-            message = "no-message"
-            progress = "n/a"
-            try:
-                progress = task.info.progress
-                message = task.info.description.message
-            except Exception:
-                pass
+            # the progress costs another two calls to vCenter, they are made only when it is logged
+            if self.__logger.isEnabledFor(logging.DEBUG):
+                message = "no-message"
+                progress = "n/a"
+                try:
+                    progress = task.info.progress
+                    message = task.info.description.message
+                except Exception:
+                    pass
 
-            self.__logger.debug('Progress {}% | Task: {}\r'.format(
-                progress,
-                message
-            ))
+                self.__logger.debug('Progress {}% | Task: {}\r'.format(
+                    progress,
+                    message
+                ))
             time.sleep(0.7)
 
         result = task.info.result
-        error_msg = f', message: {task.info.error.msg}' if state == 'error' else ''
-        self.__logger.debug(f'Task finished with status: {state}{error_msg}, result: {result}')
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            error_msg = f', message: {task.info.error.msg}' if state == 'error' else ''
+            self.__logger.debug(f'Task finished with status: {state}{error_msg}, result: {result}')
 
         return result
 
+    def wait_for_tasks(self, tasks, timeout=None):
+        """
+        Waits for all tasks together; states of all pending tasks are retrieved in one call per iteration.
+        Lost session is re-authenticated and only the waiting goes on, the tasks are not issued again.
+        :param tasks: list of tasks
+        :param timeout: in seconds, vsphere.bulk_tasks_timeout if not given
+        :return: dict with task moid as a key and final task state ('success' or 'error') as a value,
+                 tasks still pending after the timeout and tasks that have vanished are in 'error' state
+        """
+        pending = {task._GetMoId(): task for task in tasks}
+        states = {}
+        if timeout is None:
+            timeout = Settings.app['vsphere']['bulk_tasks_timeout']
+        deadline = time.time() + timeout
+        while pending:
+            try:
+                items = self._get_objects_properties(list(pending.values()), vim.Task, ['info.state'])
+            except vim.fault.NotAuthenticated:
+                self.__logger.warning('vCenter session not authenticated while waiting for tasks, logging in again')
+                self._check_connection(forced=True)
+                items = []
+            except vmodl.fault.ManagedObjectNotFound as e:
+                # the whole retrieval fails because of a single vanished task, the others are retrieved again
+                vanished = [e.obj._GetMoId()] if e.obj is not None and e.obj._GetMoId() in pending else list(pending)
+                self.__logger.warning(f'task(s) {vanished} not found, considered failed')
+                states.update({moid: 'error' for moid in vanished})
+                for moid in vanished:
+                    pending.pop(moid)
+                continue
+            for item in items:
+                state = item.get('info.state')
+                if state == 'success' or state == 'error':
+                    moid = item['obj']._GetMoId()
+                    states[moid] = state
+                    pending.pop(moid, None)
+            if pending and time.time() > deadline:
+                self.__logger.warning(f'task(s) {list(pending)} still pending after {timeout} s, considered failed')
+                states.update({moid: 'error' for moid in pending})
+                break
+            if pending:
+                self.__logger.debug(f'{len(states)} task(s) finished, {len(pending)} task(s) pending')
+                time.sleep(0.7)
+        return states
+
+    def __issue_task(self, machine_uuid, vm, task_factory):
+        try:
+            return task_factory(machine_uuid, vm)
+        except vim.fault.NotAuthenticated:
+            # the task has not been issued, so it is issued again with re-authenticated session
+            self.__logger.warning('vCenter session not authenticated, logging in again')
+            self._check_connection(forced=True)
+            return task_factory(machine_uuid, vim.VirtualMachine(vm._GetMoId(), stub=self.si_stub))
+
+    def __issue_tasks(self, vms, task_factory):
+        tasks = {}
+        for machine_uuid, vm in vms.items():
+            try:
+                tasks[machine_uuid] = self.__issue_task(machine_uuid, vm, task_factory)
+            except Exception as e:
+                self.__logger.warning(f'task for machine {machine_uuid} cannot be issued: {repr(e)}')
+        states = self.wait_for_tasks(list(tasks.values()))
+        return {
+            machine_uuid: machine_uuid in tasks and states.get(tasks[machine_uuid]._GetMoId()) == 'success'
+            for machine_uuid in vms
+        }
+
+    @relogin_on_not_authenticated
+    def __find_machines(self, machine_uuids):
+        return {
+            machine_uuid: self.content.searchIndex.FindByUuid(None, machine_uuid, True)
+            for machine_uuid in machine_uuids
+        }
+
+    @relogin_on_not_authenticated
+    def __get_power_states(self, vms):
+        """
+        :return: dict with machine uuid as a key and power state as a value
+        """
+        states = self._get_objects_properties(list(vms.values()), vim.VirtualMachine, ['runtime.powerState'])
+        power_states = {str(item['obj']): item.get('runtime.powerState') for item in states}
+        return {machine_uuid: power_states.get(str(vm)) for machine_uuid, vm in vms.items()}
+
+    @log_to(vcenter_logger)
+    def run_bulk_operation(self, operation, machine_uuids, snapshot_names=None):
+        """
+        Issues vCenter tasks for all machines at once and waits for all of them together.
+        Every task is issued once, a lost session is re-authenticated without issuing the tasks again.
+        :param operation: one of start, stop, restart, undeploy, take_snapshot
+        :param machine_uuids: list of machine uuids
+        :param snapshot_names: dict of snapshot names by machine uuid, required for take_snapshot
+        :return: dict with machine uuid as a key and True as a value if the operation succeeded
+        """
+        self._check_connection()
+        task_factories = {
+            'start': lambda machine_uuid, vm: vm.PowerOnVM_Task(),
+            'stop': lambda machine_uuid, vm: vm.PowerOffVM_Task(),
+            'restart': lambda machine_uuid, vm: vm.ResetVM_Task(),
+            'undeploy': lambda machine_uuid, vm: vm.Destroy_Task(),
+            'take_snapshot': lambda machine_uuid, vm: vm.CreateSnapshot_Task(
+                name=snapshot_names[machine_uuid],
+                description='',
+                memory=True,
+                quiesce=False
+            ),
+        }
+        if operation not in task_factories:
+            raise ValueError(f'Invalid bulk operation: {operation}')
+
+        vms = {}
+        result = {}
+        for machine_uuid, vm in self.__find_machines(machine_uuids).items():
+            if vm is None:
+                self.__logger.warning(f'machine {machine_uuid} not found')
+                # machine that does not exist is considered as undeployed
+                result[machine_uuid] = operation == 'undeploy'
+            else:
+                vms[machine_uuid] = vm
+
+        if operation in ['start', 'stop', 'undeploy'] and vms:
+            power_states = self.__get_power_states(vms)
+            if operation == 'undeploy':
+                # running machines cannot be destroyed, they are powered off the hard way first
+                self.__issue_tasks(
+                    {machine_uuid: vm for machine_uuid, vm in vms.items()
+                     if power_states[machine_uuid] == vim.VirtualMachinePowerState.poweredOn},
+                    task_factories['stop']
+                )
+            else:
+                # machines already in the requested power state succeed without a task, as with start() and stop()
+                requested_state = vim.VirtualMachinePowerState.poweredOn if operation == 'start' \
+                    else vim.VirtualMachinePowerState.poweredOff
+                for machine_uuid, power_state in power_states.items():
+                    if power_state == requested_state:
+                        result[machine_uuid] = True
+                        del vms[machine_uuid]
+
+        result.update(self.__issue_tasks(vms, task_factories[operation]))
+        return result
+
     @log_to(vcenter_logger)
     def get_hosts_in_folder(self, folder_name):
         result = self.__get_objects_list_from_container(self.content.rootFolder, vim.Folder)
@@ -1103,6 +1559,10 @@ class VCenter:
             self.vm_folders = {}
             # this stores all sub folders where this lm unit operates
             self.system_folders = {}
+            # folder managed objects by their full path, so no inventory scan is needed to obtain them
+            self.__folder_objects = {}
+            # morefs of folders found empty by the previous remove_empty_folders() call
+            self.__empty_folders = set()
 
             self.__logger = logging.getLogger(__name__)
             self.parent = parent
@@ -1116,73 +1576,84 @@ class VCenter:
             )
             )
 
+        @staticmethod
+        def _build_folder_paths(folders):
+            """
+            Assembles full paths of folders locally, from their names and parents
+            :param folders: list of dicts with 'obj', 'name' and 'parent' keys
+            :return: dict with full folder path as a key and folder object as a value
+            """
+            folders_by_moid = {item['obj']._GetMoId(): item for item in folders}
+            paths_by_moid = {}
+
+            def full_path(moid):
+                if moid not in paths_by_moid:
+                    item = folders_by_moid[moid]
+                    parent = item.get('parent')
+                    # only folders are collected, so anything else (e.g. datacenter) ends the path
+                    if parent is not None and parent._GetMoId() in folders_by_moid:
+                        paths_by_moid[moid] = "{}/{}".format(full_path(parent._GetMoId()), item['name'])
+                    else:
+                        paths_by_moid[moid] = "/{}".format(item['name'])
+                return paths_by_moid[moid]
+
+            return {full_path(moid): item['obj'] for moid, item in folders_by_moid.items()}
+
+        @staticmethod
+        def __is_system_path(path):
+            root_path = Settings.app['vsphere']['folder']
+            # all parent folders of the root folder belong to the system folders as well
+            return root_path.startswith(path) or path.startswith(root_path + '/')
+
+        def __register_folder(self, path, folder):
+            self.vm_folders[path] = str(folder)
+            self.__folder_objects[path] = folder
+            if self.__is_system_path(path):
+                self.system_folders[path] = str(folder)
+
+        def __unregister_folder(self, folder):
+            removed_paths = [path for path, item in self.__folder_objects.items() if str(item) == str(folder)]
+            for removed_path in removed_paths:
+                for path in list(self.__folder_objects.keys()):
+                    if path == removed_path or path.startswith(removed_path + '/'):
+                        self.__folder_objects.pop(path, None)
+                        self.vm_folders.pop(path, None)
+                        self.system_folders.pop(path, None)
+
         def __get_system_root_folder(self):
-            if not Settings.app['vsphere']['folder'] in self.vm_folders:
+            if not Settings.app['vsphere']['folder'] in self.__folder_objects:
                 self.__logger.warning('{} not in vm_folders'.format(Settings.app['vsphere']['folder']))
-                # self.__logger.warn('{}'.format(self.vm_folders.keys()))
-            folder = self.vm_folders[Settings.app['vsphere']['folder']]
-            # self.__logger.debug('folder: {}'.format(folder))
-
-            container_view = self.parent.content.viewManager.CreateContainerView(
-                self.parent.content.rootFolder,
-                [vim.Folder],
-                True
-            )
-
-            try:
-                for item in container_view.view:
-                    if str(item) == folder:
-                        return item
                 raise Exception("root folder not obtained")
-            finally:
-                container_view.DestroyView()
+            return self.__folder_objects[Settings.app['vsphere']['folder']]
 
         def create_subfolder(self, path, subpath):
             self.__logger.debug("A request to create {} in {}".format(subpath, path))
-            container_view = self.parent.content.viewManager.CreateContainerView(
-                # we have to start from parent to find the current root folder
-                self.__get_system_root_folder().parent,
-                [vim.Folder],
-                True
-            )
+            parent_folder = self.__obtain_folder(path)
+            if parent_folder is None:
+                return None
+
+            try:
+                new_folder = parent_folder.CreateFolder(name=subpath)
+            except vim.fault.DuplicateName:
+                # created meanwhile by someone else, only direct children have to be inspected
+                new_folder = next(
+                    (item for item in parent_folder.childEntity
+                     if isinstance(item, vim.Folder) and item.name == subpath),
+                    None
+                )
 
-            new_folder = None
-            for item in container_view.view:
-                if str(item) == self.system_folders[path]:
-                    self.__logger.debug('parent folder {} found'.format(path))
-                    try:
-                        new_folder = item.CreateFolder(name=subpath)
-                        break
-                    except vim.fault.DuplicateName:
-                        self.__sleep_between_tries()
-                        break
-
-            container_view.DestroyView()
+            if new_folder is not None:
+                self.__register_folder('{}/{}'.format(path, subpath), new_folder)
             self.__logger.debug("creation done.")
-            self.__collect_system_folders()
             return new_folder
 
         def __obtain_folder(self, path):
-            container_view = self.parent.content.viewManager.CreateContainerView(
-                self.__get_system_root_folder().parent,
-                [vim.Folder],
-                True
-            )
-            try:
-                for item in container_view.view:
-                    if path in self.system_folders and str(item) == self.system_folders[path]:
-                        return item
-            finally:
-                container_view.DestroyView()
+            if path in self.system_folders:
+                return self.__folder_objects[path]
 
             self.__logger.warning("folder: {} not found".format(path))
 
-        def create_folder(self, folder_path):
-            self.__collect_system_folders()
-            path = self.__correct_folder_format(folder_path)
-            if path in self.system_folders:
-                return self.__obtain_folder(path)
-
+        def __create_missing_folders(self, path):
             items = path.split('/')
             for split_index in range(2, len(items)):
                 temp_path = '/'.join(items[:split_index])
@@ -1192,6 +1663,19 @@ class VCenter:
                 else:
                     self.__logger.debug('{} exists'.format(temp_path+'/'+next_folder))
 
+        def create_folder(self, folder_path):
+            path = self.__correct_folder_format(folder_path)
+            if path in self.system_folders:
+                return self.__obtain_folder(path)
+
+            try:
+                self.__create_missing_folders(path)
+            except vmodl.fault.ManagedObjectNotFound:
+                # some of the cached folders has been removed in the meantime, the tree must be collected again
+                self.__logger.warning('cached folder tree is outdated, collecting it again')
+                self.refresh()
+                self.__create_missing_folders(path)
+
             if path not in self.system_folders:
                 self.__logger.warning("Directory {} not created".format(path))
             return self.__obtain_folder(path)
@@ -1199,71 +1683,89 @@ class VCenter:
         def delete_folder(self, folder):
             task = folder.Destroy_Task()
             self.parent.wait_for_task(task)
+            self.__unregister_folder(folder)
+
+        def remove_empty_folders(self, busy_folders=()):
+            """
+            Removes subfolders of the unit folder which were empty during this and the previous call,
+            so a folder that has just been created for a deployment is not removed under its hands.
+            Destroy_Task removes the content of the folder as well, so the busy folders and their parents are kept.
+            :param busy_folders: folders relative to the unit folder deploys may clone into
+            :return: number of removed folders
+            """
+            root_path = Settings.app['vsphere']['folder']
+            busy_paths = [self.__correct_folder_format(f'{root_path}/{folder}') for folder in busy_folders if folder]
+            candidates = {
+                str(folder): folder for path, folder in self.__folder_objects.items()
+                if path.startswith(root_path + '/') and
+                not any(busy_path == path or busy_path.startswith(path + '/') for busy_path in busy_paths)
+            }
+            if not candidates:
+                self.__empty_folders = set()
+                return 0
+
+            children = self.parent._get_objects_properties(list(candidates.values()), vim.Folder, ['childEntity'])
+            empty_folders = {str(item['obj']) for item in children if not item.get('childEntity')}
+
+            removed = set()
+            for moref in empty_folders & self.__empty_folders:
+                folder = candidates[moref]
+                try:
+                    # deployment may have used the folder since the children were retrieved
+                    if folder.childEntity:
+                        continue
+                    self.__logger.debug('empty folder: {} is going to be removed'.format(folder.name))
+                    self.delete_folder(folder)
+                    removed.add(moref)
+                except vmodl.fault.ManagedObjectNotFound:
+                    self.__unregister_folder(folder)
+                    removed.add(moref)
+                except Exception:
+                    Settings.raven.captureException(exc_info=True)
+            self.__empty_folders = empty_folders - removed
+            return len(removed)
+
+        def forget_folder(self, folder_path):
+            """
+            Drops the cached folder, so it is looked up or created again next time,
+            the folder may have been removed as empty by another process
+            """
+            path = self.__correct_folder_format(folder_path)
+            if path == Settings.app['vsphere']['folder'] or path not in self.__folder_objects:
+                return
+            self.__unregister_folder(self.__folder_objects[path])
 
         def move_vm_to_folder(self, vm_uuid, folder_path):
-            path = self.__correct_folder_format(folder_path)
-            if path not in self.system_folders:
-                self.create_folder(path)
+            folder = self.create_folder(folder_path)
 
             vm = self.parent.content.searchIndex.FindByUuid(None, vm_uuid, True)
-            self.__move_vm_to_existing_folder(vm, path)
+            self.__move_vm_to_existing_folder(vm, folder)
 
-        def __collect_system_folders(self):
-            container_view = None
-            for repetition in range(5):
-                try:
-                    root_folder_moref = self.__get_system_root_folder()
-                    container_view = self.parent.content.viewManager.CreateContainerView(
-                        root_folder_moref,
-                        [vim.Folder],
-                        True
-                    )
-
-                    self.__logger.debug("collecting system vm folders....")
-                    self.__logger.debug("\troot_folder_moref: {}".format(str(root_folder_moref)))
-                    self.system_folders = {
-                        Settings.app['vsphere']['folder']: str(root_folder_moref)
-                    }
-                    # all parent folders must be initially added as well
-                    for i in self.vm_folders.keys():
-                        if Settings.app['vsphere']['folder'].startswith(i):
-                            self.system_folders[i] = self.vm_folders[i]
-
-                    for item in container_view.view:
-                        full_name = self.__retrieve_full_folder_path(item)
-                        self.system_folders[full_name] = str(item)
+        def refresh(self):
+            self.__collect_all_folders()
 
-                    return
-                except vmodl.fault.ManagedObjectNotFound as monf:
-                    self.__logger.warning(
-                        "collect_system_folders failed attempt: {}, due to {}".format(repetition, monf)
-                    )
-                    self.__sleep_between_tries()
-                except Exception as e:
-                    Settings.raven.captureException(exc_info=True)
-                    self.__logger.error(
-                        "collect_system_folders failed attempt: {}, due to {}".format(repetition, e)
-                    )
-                    raise e
-                finally:
-                    if container_view:
-                        container_view.DestroyView()
+        def __collect_system_folders(self):
+            self.__logger.debug("collecting system vm folders....")
+            self.system_folders = {
+                path: folder for path, folder in self.vm_folders.items() if self.__is_system_path(path)
+            }
+            self.__logger.debug("\troot_folder_moref: {}".format(str(self.__get_system_root_folder())))
 
         def __collect_all_folders(self):
-            container_view = None
             for repetition in range(5):
                 try:
-                    container_view = self.parent.content.viewManager.CreateContainerView(
+                    self.__logger.debug("collecting all vm folders....")
+                    folders = self.parent._get_objects_properties_from_container(
                         self.parent.content.rootFolder,
-                        [vim.Folder],
-                        True
+                        vim.Folder,
+                        ['name', 'parent']
                     )
+                    if not folders:
+                        raise vmodl.fault.ManagedObjectNotFound()
 
-                    self.__logger.debug("collecting all vm folders....")
-                    self.vm_folders = {}
-                    for item in container_view.view:
-                        full_name = self.__retrieve_full_folder_path(item)
-                        self.vm_folders[full_name] = str(item)
+                    self.__folder_objects = self._build_folder_paths(folders)
+                    self.vm_folders = {path: str(folder) for path, folder in self.__folder_objects.items()}
+                    self.__collect_system_folders()
                     self.__logger.debug("collecting done.")
                     return
                 except vmodl.fault.ManagedObjectNotFound as monf:
@@ -1273,31 +1775,12 @@ class VCenter:
                     Settings.raven.captureException(exc_info=True)
                     self.__logger.error("collect_all_folders failed attempt: {}, due to {}".format(repetition, e))
                     raise e
-                finally:
-                    if container_view:
-                        container_view.DestroyView()
-
-        def __move_vm_to_existing_folder(self, vm, existing_path):
-            container_view = self.parent.content.viewManager.CreateContainerView(
-                self.__get_system_root_folder(),
-                [vim.Folder],
-                True
-            )
-            for item in container_view.view:
-                if str(item) == self.system_folders[existing_path]:
-                    task = item.MoveIntoFolder_Task(list=[vm])
-                    while task.info.state == 'running' or task.info.state == 'queued':
-                        time.sleep(0.2)
-            container_view.DestroyView()
-
-        def __retrieve_full_folder_path(self, folder):
-            if isinstance(folder.parent, vim.Folder):
-                return "{}/{}".format(
-                    self.__retrieve_full_folder_path(folder.parent),
-                    folder.name
-                )
-            else:
-                return "/{}".format(folder.name)
+
+        @staticmethod
+        def __move_vm_to_existing_folder(vm, folder):
+            task = folder.MoveIntoFolder_Task(list=[vm])
+            while task.info.state == 'running' or task.info.state == 'queued':
+                time.sleep(0.2)
 
         @staticmethod
         def __correct_folder_format(folder):
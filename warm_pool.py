@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import signal
+import time
+import uuid
+
+import web.modeltr as data
+from web.modeltr.enums import MachineState
+from web.settings import Settings
+import vcenter.vcenter as vcenter
+
+logger = logging.getLogger(__name__)
+
+
+def signal_handler(signum, frame):
+    global process_actions
+    logger.info(f'worker aborted by signal: {signum}')
+    process_actions = False
+
+
+def get_missing_counts(conn):
+    missing = {}
+    for template, pool_config in Settings.app['warm_pool']['templates'].items():
+        pooled_count = len(data.PooledMachine.get({'template': template}, conn=conn))
+        if pooled_count < pool_config['size']:
+            missing[template] = pool_config['size'] - pooled_count
+    return missing
+
+
+def get_free_slots(conn):
+    """
+    Pooled machines take slots as deployed ones do, so the pool is refilled only within the slot limit
+    """
+    used = sum(
+        data.Machine.count({'state': state.value}, conn=conn) for state in MachineState if state.takes_slot()
+    )
+    return Settings.app['slot_limit'] - used - data.PooledMachine.count({}, conn=conn)
+
+
+def prepare_pooled_machine(vc, template, running):
+    if Settings.app['unit_name']:
+        machine_name = f'{template}-{Settings.app["unit_name"]}-pool-{uuid.uuid4().hex[:8]}'
+    else:
+        machine_name = f'{template}-pool-{uuid.uuid4().hex[:8]}'
+    logger.info(f'preparing pooled machine {machine_name}')
+
+    machine_uuid = vc.deploy(template,
+                             machine_name,
+                             running=running,
+                             inventory_folder=Settings.app['warm_pool']['folder'])
+    machine_info = vc.get_machine_info(machine_uuid)
+    if running and machine_info['power_state'] != 'poweredOn':
+        vc.start(machine_uuid)
+
+    with data.Connection.use('conn2') as conn:
+        data.PooledMachine(
+            template=template,
+            running=running,
+            provider_id=machine_uuid,
+            mo_ref=machine_info['mo_ref'],
+            machine_name=machine_name,
+            created_at=datetime.datetime.now()
+        ).save(conn=conn)
+    logger.info(f'pooled machine {machine_name} ({machine_uuid}) is ready')
+
+
+def refill_pool(vc):
+    with data.Connection.use('conn2') as conn:
+        missing = get_missing_counts(conn)
+        free_slots = get_free_slots(conn) if missing else 0
+
+    # one machine per template in a revolution, so that a slow template does not starve the others
+    for template in missing:
+        if not process_actions:
+            break
+        if free_slots <= 0:
+            logger.info('warm pool is not refilled, there is no free slot')
+            break
+        free_slots -= 1
+        running = Settings.app['warm_pool']['templates'][template].get('running', False)
+        try:
+            prepare_pooled_machine(vc, template, running)
+        except Exception:
+            Settings.raven.captureException(exc_info=True)
+            logger.error(f'Could not prepare pooled machine of {template}: ', exc_info=True)
+
+
+if __name__ == '__main__':
+
+    Settings.app['document_abstraction']['warn_0_records'] = False
+    data.Connection.connect('conn2', dsn=Settings.app['db']['dsn'])
+
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    process_actions = Settings.app['warm_pool']['enabled']
+    if process_actions and Settings.app['vsphere']['hosts_folder_name']:
+        # machines on ticket managed units are accounted per host, pooled ones would bypass it
+        logger.warning('Warm pool is not supported on units with deploy tickets')
+        process_actions = False
+
+    vc = None
+    if process_actions:
+        vc = vcenter.VCenter()
+        # deploys need the folders, the datastore and the resource pool found by the full connect
+        vc.connect()
+
+    while process_actions:
+        try:
+            refill_pool(vc)
+        except Exception:
+            Settings.raven.captureException(exc_info=True)
+            logger.error('Exception while refilling warm pool: ', exc_info=True)
+        time.sleep(Settings.app['warm_pool']['sleep'])
+
+    logger.debug("Warm pool finished")
@@ -0,0 +1,73 @@
+import datetime
+import logging
+import math
+import time
+
+import web.modeltr as data
+from web.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+# key of the advisory lock serialising admission of deploys across web server processes
+ADMISSION_LOCK_KEY = 7301
+
+
+class Admission:
+    """
+    Keeps the deploy queue short enough to be processed within 'max_queue_wait' seconds
+    at the deploy rate observed recently
+    """
+    _deploy_rate = 0.0
+    _last_rate_check = 0
+
+    @staticmethod
+    def get_deploy_rate(conn):
+        """
+        :return: deploys finished per second within the last 'rate_window' seconds, cached for 'rate_caching_period'
+        """
+        config = Settings.app['service']['admission']
+        if time.time() - Admission._last_rate_check < config['rate_caching_period']:
+            return Admission._deploy_rate
+
+        since = (datetime.datetime.now() - datetime.timedelta(seconds=config['rate_window'])).strftime(
+            '%Y-%m-%d %H:%M:%S'
+        )
+        # failed deploys occupy workers as well
+        finished = sum(
+            data.Request.count(
+                {'type': data.RequestType.DEPLOY.value, 'state': state.value},
+                ranges={'modified_at': (since, None)},
+                conn=conn
+            )
+            for state in [data.RequestState.SUCCESS, data.RequestState.FAILED]
+        )
+        Admission._deploy_rate = finished / config['rate_window']
+        Admission._last_rate_check = time.time()
+        return Admission._deploy_rate
+
+    @staticmethod
+    def check(count, conn):
+        """
+        Decides whether 'count' deploys can be queued. Admissions are serialised until the transaction ends,
+        so the deploys must be queued in the same transaction.
+        :return: None if admitted, otherwise number of seconds after which the client should retry
+        """
+        config = Settings.app['service']['admission']
+        cur = conn.get_cursor()
+        cur.execute("select pg_advisory_xact_lock(%s);", [ADMISSION_LOCK_KEY])
+        conn.wait_for_completion()
+
+        queue_depth = data.Action.count({'type': 'deploy', 'lock': 0}, conn=conn)
+        if queue_depth == 0:
+            # deploys larger than the limit would never be admitted otherwise, the rate cannot rise on an idle unit
+            return None
+        rate = Admission.get_deploy_rate(conn)
+        max_depth = max(config['min_queue_depth'], int(rate * config['max_queue_wait']))
+        if queue_depth + count <= max_depth:
+            return None
+
+        excess = queue_depth + count - max_depth
+        retry_after = math.ceil(excess / rate) if rate > 0 else config['max_queue_wait']
+        logger.warning(f'deploy of {count} machine(s) not admitted, queue depth: {queue_depth}, '
+                       f'deploy rate: {rate:.3f}/s, retry after: {retry_after}s')
+        return min(max(retry_after, 1), config['max_queue_wait'])
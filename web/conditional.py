@@ -0,0 +1,62 @@
+import datetime
+import email.utils
+import hashlib
+
+from sanic.response import HTTPResponse
+
+# stored modified_at format
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def get_validators(versions, variant=''):
+    """
+    Computes ETag and Last-Modified of a response made of documents
+    :param versions: list of (id, modified_at, digest) tuples as returned by Document.get_versions()
+    :param variant: anything else the response body depends on, e.g. query parameters or the caller's role
+    :return: tuple of ETag and Last-Modified header values, the latter is None when unknown
+    """
+    digest = hashlib.md5(variant.encode())
+    modified = []
+    for document_id, modified_at, document_digest in versions:
+        digest.update(f'{document_id}:{document_digest};'.encode())
+        try:
+            modified.append(datetime.datetime.strptime(modified_at, TIMESTAMP_FORMAT))
+        except (TypeError, ValueError):
+            pass
+    etag = f'"{digest.hexdigest()}"'
+    # timestamps are stored in local time
+    last_modified = email.utils.format_datetime(max(modified).astimezone(datetime.timezone.utc), usegmt=True) \
+        if modified else None
+    return etag, last_modified
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return email.utils.parsedate_to_datetime(last_modified) <= email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+def conditional_response(request, versions, variant=''):
+    """
+    Answers conditional GET, the full response gets the validators via json_response middleware
+    :return: 304 response when the caller has the current representation, None otherwise
+    """
+    etag, last_modified = get_validators(versions, variant)
+    headers = {'ETag': etag}
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+
+    if is_not_modified(request, etag, last_modified):
+        return HTTPResponse(status=304, headers=headers)
+    request['response_headers'] = {**request.get('response_headers', {}), **headers}
+    return None
@@ -11,6 +11,8 @@ def get_random_hash():
 
 
 def log_d(request, message):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     try:
         func_id = request.cookies["__log_extension"]
         logger.debug(f'{func_id} {message}')
@@ -19,6 +21,8 @@ def log_d(request, message):
 
 
 def log_w(request, message):
+    if not logger.isEnabledFor(logging.WARNING):
+        return
     try:
         func_id = request.cookies["__log_extension"]
         logger.warning(f'{func_id} {message}')
@@ -27,6 +31,8 @@ def log_w(request, message):
 
 
 def log_i(request, message):
+    if not logger.isEnabledFor(logging.INFO):
+        return
     try:
         func_id = request.cookies["__log_extension"]
         logger.info(f'{func_id} {message}')
@@ -35,6 +41,8 @@ def log_i(request, message):
 
 
 def log_e(request, message):
+    if not logger.isEnabledFor(logging.ERROR):
+        return
     try:
         func_id = request.cookies["__log_extension"]
         logger.error(f'{func_id} {message}')
@@ -52,10 +60,11 @@ def log_func_boundaries(func):
             args[0].cookies.update({'__log_extension': f'-- func_{func_id}:'})
         try:
             res = await func.__call__(*args, **kwargs)
-            logger.info(f'<- func_{func_id}: {function_name} finished: {repr(res)}')
+            # the result is formatted only when logged, it can be a long list of machines
+            logger.info('<- func_%s: %s finished: %r', func_id, function_name, res)
             return res
         except Exception as e:
-            logger.info(f'<- func_{func_id}: {function_name} threw an exception: {repr(e)}', exc_info=True)
+            logger.info('<- func_%s: %s threw an exception: %r', func_id, function_name, e, exc_info=True)
             raise
 
     return inner
@@ -11,12 +11,14 @@ import web.middleware.auth_merger
 import web.middleware.json_params
 import web.middleware.json_response
 import web.module.capabilities
+import web.module.events
 import web.module.machines
 import web.module.requests
 import web.module.screenshots
 import web.module.snapshots
 import web.module.uptime
 import web.module.hosts
+import web.timing
 from web.settings import Settings as settings, set_context_var
 import web.modeltr as data
 import random
@@ -51,12 +53,18 @@ if web.settings.Settings.app['sanic_custom_accesslog_enable']:
 
 lm_unit_webserver = Sanic(__name__, log_config=lmunit_log_config)
 
+if web.timing.enabled():
+    # phase timings are reported as Server-Timing header and statsd metrics, see web/timing.py
+    lm_unit_webserver.register_middleware(web.timing.start, 'request')
+
 if settings.app['service'].get("auth_module", "<none>") == 'ldap_auth':
     logger.debug("Registering ldap_auth....")
-    lm_unit_webserver.register_middleware(web.middleware.auth_ldap.auth, 'request')
+    lm_unit_webserver.register_middleware(
+        web.timing.timed_middleware('auth', web.middleware.auth_ldap.auth), 'request'
+    )
     logger.debug("Registered ldap_auth successfully")
 else:
-    lm_unit_webserver.register_middleware(web.middleware.auth.auth, 'request')
+    lm_unit_webserver.register_middleware(web.timing.timed_middleware('auth', web.middleware.auth.auth), 'request')
 lm_unit_webserver.register_middleware(web.middleware.auth_merger.auth, 'request')
 
 lm_unit_webserver.register_middleware(web.middleware.json_params.json_params, 'request')
@@ -69,17 +77,29 @@ lm_unit_webserver.blueprint(web.module.uptime.uptime, url_prefix='/api/v4')
 lm_unit_webserver.blueprint(web.module.capabilities.capabilities, url_prefix='/api/v4')
 lm_unit_webserver.blueprint(web.module.uptime.uptime, url_prefix='/')
 lm_unit_webserver.blueprint(web.module.hosts.hosts, url_prefix='/api/v4')
+lm_unit_webserver.blueprint(web.module.events.events, url_prefix='/api/v4')
 
-lm_unit_webserver.register_middleware(web.middleware.json_response.json_response, 'response')
+lm_unit_webserver.register_middleware(
+    web.timing.timed_response_middleware(web.middleware.json_response.json_response), 'response'
+)
 
 @lm_unit_webserver.listener("before_server_start")
 async def create_db_connection(app, loop):
+    web.settings.start_log_queue(None, 'sanic.root', 'sanic.error', 'sanic.access')
     logger.debug(f"before_server_start {asyncio.current_task()}")
     data.Connection.connect(
         dsn=settings.app['db']['dsn'],
         async_mode=True,
         #socket_reusability=settings.app['db']['socket_reusability']
     )
+    # wakes up long-polling clients of /requests/<id>?wait=<seconds>
+    data.request_listener.start(settings.app['db']['dsn'], loop)
+    if data.SlotCounter.enabled():
+        # capabilities cached by this process are invalidated by changes of the slot counter
+        data.slot_counter_listener.add_callback(web.module.capabilities.Capabilities.invalidate)
+        data.slot_counter_listener.start(settings.app['db']['dsn'], loop)
+    if data.Event.enabled():
+        data.event_listener.start(settings.app['db']['dsn'], loop)
 
 
 @lm_unit_webserver.middleware('request')
@@ -98,4 +118,9 @@ async def obtain_request(request):
         logger.info(f'<< obtained')
 
 
+if web.timing.enabled():
+    # registered as the last request middleware
+    lm_unit_webserver.register_middleware(web.timing.start_handler, 'request')
+
+
 lm_unit_webserver.config.KEEP_ALIVE = settings.app['sanic_keepalive']
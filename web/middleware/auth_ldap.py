@@ -2,6 +2,12 @@ import asyncio
 import base64
 import hashlib
 import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 import ldap
 from sanic.response import json as sanic_json
@@ -11,6 +17,11 @@ from web.settings import Settings
 logger = logging.getLogger()
 
 
+# raised when the server has refused the credentials, unlike e.g. an unreachable server it is worth caching
+class InvalidCredentials(Exception):
+    pass
+
+
 def get_ldap_connection(username, password):
     if not Settings.app['service']['ldap'].get('cert_check', True):
         ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
@@ -28,6 +39,8 @@ def get_ldap_connection(username, password):
                 password
             )
             return l_obj
+        except ldap.INVALID_CREDENTIALS:
+            raise InvalidCredentials()
         except Exception as iex:
             logger.error(f'An exception occured when connecting to ldap: {iex}')
         return None
@@ -84,6 +97,170 @@ def check_group(conn, group_dn, user_dn):
         return False
 
 
+class AuthCache:
+    """
+    Results of authentication by credentials. Credentials are kept only as a salted hash,
+    the salt is random per process. Refusals are cached for a shorter time.
+    """
+
+    def __init__(self):
+        self.__salt = os.urandom(16)
+        self.__entries = OrderedDict()
+
+    def key(self, username, password):
+        return hashlib.sha256(self.__salt + f'{username}:{password}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.time():
+            del self.__entries[key]
+            return None
+        return result
+
+    def put(self, key, result):
+        config = Settings.app['service']['ldap']['cache']
+        ttl = config['ttl'] if result['role'] else config['negative_ttl']
+        if ttl <= 0:
+            return
+        self.__entries.pop(key, None)
+        self.__entries[key] = (time.time() + ttl, result)
+        # the oldest entries are evicted first
+        while len(self.__entries) > config['max_entries']:
+            self.__entries.popitem(last=False)
+
+
+class LdapPool:
+    """
+    Connections bound by the service account for DN and group lookups, so they are not done
+    on a fresh connection of every user. Used only when 'service_user' is configured.
+    """
+
+    def __init__(self):
+        self.__connections = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__created = 0
+
+    @staticmethod
+    def enabled():
+        return bool(Settings.app['service']['ldap'].get('service_user'))
+
+    @staticmethod
+    def __connect():
+        return get_ldap_connection(
+            Settings.app['service']['ldap']['service_user'],
+            Settings.app['service']['ldap']['service_password']
+        )
+
+    @contextmanager
+    def acquire(self):
+        """
+        Lends a connection for exclusive use of a thread, connections idle for longer than 'check_interval'
+        are checked first. The connection is dropped if the block raises.
+        """
+        config = Settings.app['service']['ldap']['pool']
+        with self.__lock:
+            can_create = self.__created < config['size']
+            if can_create:
+                self.__created += 1
+        if can_create:
+            conn, last_usage = None, 0
+        else:
+            conn, last_usage = self.__connections.get(timeout=config['timeout'])
+
+        try:
+            if conn is not None and time.time() - last_usage > config['check_interval']:
+                try:
+                    conn.whoami_s()
+                except Exception:
+                    logger.info('pooled ldap connection is not usable anymore, reconnecting')
+                    self.__terminate(conn)
+                    conn = None
+            if conn is None:
+                conn = self.__connect()
+                if conn is None:
+                    raise RuntimeError('service account cannot be bound to ldap')
+            yield conn
+        except BaseException:
+            self.__terminate(conn)
+            with self.__lock:
+                self.__created -= 1
+            raise
+        self.__connections.put((conn, time.time()))
+
+    @staticmethod
+    def __terminate(conn):
+        try:
+            if conn is not None:
+                terminate_ldap_connection(conn)
+        except Exception:
+            pass
+
+
+auth_cache = AuthCache()
+ldap_pool = LdapPool()
+
+
+# cached result of credentials refused by the server
+REFUSED = {'role': None, 'dn': None, 'refused': True}
+
+
+# raised when the user DN cannot be looked up, the pooled connection may be broken
+class LookupFailed(Exception):
+    pass
+
+
+def get_role(conn, username):
+    """
+    :return: dict with role ('user', 'admin' or None if not authorized) and DN of the user
+    """
+    user_dn = get_user_dn(conn, username)
+    if user_dn is None:
+        raise LookupFailed()
+    if check_group(conn, Settings.app['service']['ldap']['ugroup'], user_dn):
+        return {'role': 'user', 'dn': user_dn}
+    if check_group(conn, Settings.app['service']['ldap']['agroup'], user_dn):
+        return {'role': 'admin', 'dn': user_dn}
+    return {'role': None, 'dn': user_dn}
+
+
+def authenticate(username, password):
+    """
+    Verifies credentials by the user's bind, the role is looked up on a pooled connection if available
+    :return: tuple of the result (see get_role() and REFUSED) and a flag whether it may be cached
+    """
+    try:
+        conn = get_ldap_connection(username, password)
+    except InvalidCredentials:
+        return REFUSED, True
+    if conn is None:
+        return REFUSED, False
+
+    try:
+        if ldap_pool.enabled():
+            try:
+                with ldap_pool.acquire() as pooled_conn:
+                    return get_role(pooled_conn, username), True
+            except (queue.Empty, RuntimeError, InvalidCredentials) as ex:
+                # all pooled connections are busy or the service account cannot be bound
+                logger.warning(f'pooled ldap connection not available ({repr(ex)}), using the user\'s one')
+        return get_role(conn, username), True
+    except LookupFailed:
+        # not worth caching, it may be just a problem of the server
+        return {'role': None, 'dn': None}, False
+    finally:
+        if conn is not None:
+            terminate_ldap_connection(conn)
+
+
+def set_authorised(request, username, result):
+    request.headers['LDAP_AUTHORISED_LOGIN'] = username
+    request.headers['LDAP_AUTHORISED_DN'] = result['dn']
+    request.headers['AUTHORISED_AS'] = result['role']
+
+
 async def auth(request):
     if 'authorization' not in request.headers:
         return sanic_json(
@@ -105,29 +282,16 @@ async def auth(request):
         )
 
     logger.debug(f'An attempt to auth: {username}:{anonymized_passwd}')
-    conn = await loop.run_in_executor(None, get_ldap_connection, username, password)
-    if conn is None:
+    cache_key = auth_cache.key(username, password)
+    result = auth_cache.get(cache_key)
+    if result is None:
+        result, cacheable = await loop.run_in_executor(None, authenticate, username, password)
+        if cacheable:
+            auth_cache.put(cache_key, result)
+
+    if result.get('refused'):
         logger.warning(f'wrong credentials for {username}')
         return sanic_json({"error": "you cannot be authenticated to access the service"}, 401)
-    try:
-        user_dn = await loop.run_in_executor(None, get_user_dn, conn, username)
-        user_group_dn = Settings.app['service']['ldap']['ugroup']
-
-        is_auth_as_user = await loop.run_in_executor(None, check_group, conn, user_group_dn, user_dn)
-        if is_auth_as_user:
-            request.headers['LDAP_AUTHORISED_LOGIN'] = username
-            request.headers['LDAP_AUTHORISED_DN'] = user_dn
-            request.headers['AUTHORISED_AS'] = 'user'
-            return
-
-        admin_group_dn = Settings.app['service']['ldap']['agroup']
-        is_auth_as_admin = await loop.run_in_executor(None, check_group, conn, admin_group_dn, user_dn)
-        if is_auth_as_admin:
-            request.headers['LDAP_AUTHORISED_LOGIN'] = username
-            request.headers['LDAP_AUTHORISED_DN'] = user_dn
-            request.headers['AUTHORISED_AS'] = 'admin'
-            return
-
+    if result['role'] is None:
         return sanic_json({"error": "you are not authorized to see the content"}, 403)
-    finally:
-        await loop.run_in_executor(None, terminate_ldap_connection, conn)
+    set_authorised(request, username, result)
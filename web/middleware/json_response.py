@@ -47,5 +47,7 @@ async def json_response(request, response):
                     {
                         'responses': result
                     },
-                    status=200
+                    status=200,
+                    # e.g. validators of conditional GET, see web/conditional.py
+                    headers=request.get('response_headers')
     )
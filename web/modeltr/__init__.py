@@ -7,4 +7,9 @@ from .action import *
 from .screenshot import *
 from .snapshot import Snapshot
 from .host_runtime_info import HostRuntimeInfo
-from .deploy_ticket import DeployTicket
\ No newline at end of file
+from .deploy_ticket import DeployTicket
+from .datastore_info import DatastoreInfo
+from .pooled_machine import PooledMachine
+from .slot_counter import SlotCounter
+from .event import Event
+from .listener import Listener, request_listener, slot_counter_listener, event_listener
@@ -2,6 +2,7 @@ import asyncio
 import sys
 import psycopg2
 from web.settings import Settings
+from web.timing import measure
 import logging
 import select
 import time
@@ -40,7 +41,7 @@ class Connection(object):
         if self.async_mode:
             try:
                 self.acursor.execute('BEGIN;')
-                self.wait_for_completion()
+                self._wait_for_transaction()
             except (
                     UnitDbCommunicationError,
                     psycopg2.ProgrammingError,
@@ -54,7 +55,7 @@ class Connection(object):
                     )
                     self._connect()
                     self.acursor.execute('BEGIN;')
-                    self.wait_for_completion()
+                    self._wait_for_transaction()
                     self.__logger.warning('the db connection re-connected')
                 except Exception:
                     self.__logger.warning(
@@ -71,11 +72,21 @@ class Connection(object):
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
+        callbacks, self._before_commit = self._before_commit, []
+        callback_error = None
+        if exc_traceback is None:
+            try:
+                for callback in callbacks:
+                    callback(self)
+            except Exception as e:
+                # the transaction is rolled back as if the exception occurred within it
+                callback_error = e
+                exc_type, exc_value, exc_traceback = type(e), e, e.__traceback__
         try:
             if exc_traceback is None:
                 if self.async_mode:
                     self.acursor.execute('COMMIT;')
-                    self.wait_for_completion()
+                    self._wait_for_transaction()
                 else:
                     self.client.commit()
             else:
@@ -86,7 +97,7 @@ class Connection(object):
                 try:
                     if self.async_mode:
                         self.acursor.execute('ROLLBACK;')
-                        self.wait_for_completion()
+                        self._wait_for_transaction()
                     else:
                         self.client.rollback()
 
@@ -106,6 +117,8 @@ class Connection(object):
                     self.__logger.debug("db connection DIS-CONNECTED (on_every_usage)")
             except Exception as ex:
                 self.__logger.warning("Connection autoclose has not been successful")
+        if callback_error is not None:
+            raise callback_error
 
     def __init__(self, **kwargs):
         self.__logger = logging.getLogger(__name__)
@@ -114,6 +127,7 @@ class Connection(object):
         self._last_usage_timestamp = None
         self.client = None
         self.acursor = None
+        self._before_commit = []
         #self._connect()
 
     def _connect(self):
@@ -140,11 +154,24 @@ class Connection(object):
         return "socket_reusability" in self._connection_params and \
             self._connection_params["socket_reusability"] == "never"
 
+    def before_commit(self, callback):
+        """
+        Registers callback(connection) called just before the current transaction commits,
+        callbacks of a rolled back transaction are dropped
+        """
+        self._before_commit.append(callback)
+
     def get_cursor(self):
         return self.acursor if self.async_mode else self.client.cursor()
 
     def wait_for_completion(self):
         if self.async_mode:
+            with measure('db_execute'):
+                Connection.__wait_for_completion(client=self.client)
+
+    def _wait_for_transaction(self):
+        # BEGIN waits for the connection, COMMIT for the durability of the transaction
+        with measure('db_wait'):
             Connection.__wait_for_completion(client=self.client)
 
     __connections = {}
@@ -176,6 +203,8 @@ class Connection(object):
     def __poll_write_wait(cls, fileno):
         cnt = 0
         sleep_time = Settings.app['db']['async_polling']['sleep_time']
+        # warned once per warning_time, not on every iteration
+        next_warning_time = Settings.app['db']['async_polling']['warning_time']
         while True:
             [_, write_fds, _] = select.select([], [fileno], [], 0.0)
             if write_fds == [fileno]:
@@ -183,10 +212,11 @@ class Connection(object):
             time.sleep(sleep_time)
             cnt += 1
             elapsed_time = cnt * sleep_time
-            if elapsed_time > Settings.app['db']['async_polling']['warning_time']:
+            if elapsed_time > next_warning_time:
                 logging.getLogger(__name__).warning(
                     f'__poll_write_async_wait takes too long: now {int(elapsed_time)} secs in total'
                 )
+                next_warning_time += Settings.app['db']['async_polling']['warning_time']
             if elapsed_time > Settings.app['db']['async_polling']['exception_time']:
                 # this practically means that if the client cannot put any data within
                 # exception_time seconds, we consider the connection as broken
@@ -197,6 +227,8 @@ class Connection(object):
     def __poll_read_wait(cls, fileno):
         cnt = 0
         sleep_time = Settings.app['db']['async_polling']['sleep_time']
+        # warned once per warning_time, not on every iteration
+        next_warning_time = Settings.app['db']['async_polling']['warning_time']
         while True:
             [read_fds, _, _] = select.select([fileno], [], [], 0.0)
             if read_fds == [fileno]:
@@ -204,10 +236,11 @@ class Connection(object):
             time.sleep(sleep_time)
             cnt += 1
             elapsed_time = cnt * sleep_time
-            if elapsed_time > Settings.app['db']['async_polling']['warning_time']:
+            if elapsed_time > next_warning_time:
                 logging.getLogger(__name__).warning(
                     f'__poll_read_async_wait takes too long: now {int(elapsed_time)} secs in total'
                 )
+                next_warning_time += Settings.app['db']['async_polling']['warning_time']
             if elapsed_time > Settings.app['db']['async_polling']['exception_time']:
                 # this practically means that if the db server cannot send
                 # any data within exception_time seconds, we consider the connection as broken
@@ -0,0 +1,19 @@
+from .base import trString, trList, trSaveTimestamp, trInt, trBool
+from .document import *
+
+
+class DatastoreInfo(Document):
+    modified_at = trSaveTimestamp
+    name = trString
+    mo_ref = trString               # datastore-14882398 like string
+    free_space = trInt              # in bytes
+    capacity = trInt                # in bytes
+    accessible = trBool
+    reservations = trList           # clones in flight: {'machine': id, 'size': bytes, 'created_at': timestamp}
+
+    _defaults = {
+        'accessible': False,
+    }
+
+    def get_reserved_space(self):
+        return sum(reservation['size'] for reservation in self.reservations)
@@ -1,5 +1,6 @@
 from .base import trInt, trTimestamp, trSaveTimestamp, trString, trBool
 from .document import *
+from .slot_counter import SlotCounter
 
 
 class DeployTicket(Document):
@@ -15,3 +16,18 @@ class DeployTicket(Document):
         'created_at': trTimestamp.NOT_INITIALIZED,
         'enabled': False,
     }
+
+    @classmethod
+    def _db_record_to_instance_pq(cls, record):
+        ticket = super()._db_record_to_instance_pq(record)
+        ticket._stored_free = ticket.is_free()
+        return ticket
+
+    def is_free(self):
+        return self.enabled is True and self.taken == 0
+
+    def save(self, **kwargs):
+        stored_free = getattr(self, '_stored_free', False)
+        super().save(**kwargs)
+        SlotCounter.add(free_tickets=int(self.is_free()) - int(stored_free), **kwargs)
+        self._stored_free = self.is_free()
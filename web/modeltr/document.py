@@ -25,6 +25,8 @@ class DocumentList(list):
 class Document:
     id = trId
     __datetime_format = "%Y-%m-%d %H:%M:%S"
+    # PostgreSQL channel notified with the document id on every save, delivered on commit
+    _notify_channel = None
 
     def __init__(self, **kwargs):
         types = {}
@@ -87,6 +89,16 @@ class Document:
         else:
             self.__save(**kwargs)
 
+        if self._notify_channel:
+            self.__notify(**kwargs)
+
+    def __notify(self, **kwargs):
+        connection = self.__get_connection(**kwargs)
+
+        cur = connection.get_cursor()
+        cur.execute("select pg_notify(%s, %s);", [self._notify_channel, self.id])
+        connection.wait_for_completion()
+
     @staticmethod
     def __get_connection(**kwargs):
         if type(kwargs['conn']).__name__ == 'Connection':
@@ -183,9 +195,9 @@ class Document:
         return new_document
 
     @classmethod
-    def construct_query(cls, query):
+    def construct_query(cls, query, columns='*'):
         collection_name = cls.__name__.lower()
-        sql_query = "SELECT * FROM documents where "
+        sql_query = f"SELECT {columns} FROM documents where "
         params = []
         for key, val in query.items():
             if key == "_id":
@@ -200,7 +212,7 @@ class Document:
         return [sql_query, params]
 
     @classmethod
-    def get(cls, query, **kwargs):
+    def __get_custom(cls, query, extend, **kwargs):
         if 'conn' not in kwargs:
             raise ValueError('parameter conn must be specified')
         connection = kwargs['conn']
@@ -209,7 +221,7 @@ class Document:
         sql_query = cls.construct_query(query)
 
         cur = connection.get_cursor()
-        cur.execute(sql_query[0], sql_query[1])
+        cur.execute(sql_query[0] + " " + extend, sql_query[1])
         connection.wait_for_completion()
         if cur.rowcount == 0 and Settings.app['document_abstraction']['warn_0_records']:
             logger = logging.getLogger(__name__)
@@ -218,6 +230,141 @@ class Document:
             result.append(cls._db_record_to_instance_pq(item))
         return result
 
+    @classmethod
+    def get(cls, query, **kwargs):
+        return cls.__get_custom(query, "", **kwargs)
+
+    @classmethod
+    def count(cls, query, ranges=None, **kwargs):
+        """
+        :param ranges: the same as in get_page()
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        sql_query = cls.__construct_page_query(query, None, None, ranges, None, columns='count(*)', ordered=False)
+        cur = connection.get_cursor()
+        cur.execute(sql_query[0], sql_query[1])
+        connection.wait_for_completion()
+        return cur.fetchone()[0]
+
+    @classmethod
+    def get_by_ids(cls, ids, **kwargs):
+        """
+        Retrieves documents with given ids via single query, ids that are not numeric are skipped
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        result = DocumentList()
+        numeric_ids = [int(item) for item in ids if str(item).isdigit()]
+        if not numeric_ids:
+            return result
+
+        cur = connection.get_cursor()
+        cur.execute(
+            "SELECT * FROM documents where id = ANY(%s::bigint[]) and type = %s",
+            [numeric_ids, cls.__name__.lower()]
+        )
+        connection.wait_for_completion()
+        for item in cur.fetchall():
+            result.append(cls._db_record_to_instance_pq(item))
+        return result
+
+    @classmethod
+    def get_page(cls, query, after=None, limit=None, ranges=None, contains=None, order_by=None, **kwargs):
+        """
+        Retrieves documents ordered by id, page by page
+        :param query: equality conditions, the same as in get()
+        :param after: id of the last document of the previous page
+        :param limit: maximum number of documents returned
+        :param ranges: dict with field name as a key and (lower, upper) tuple as a value,
+                       bounds are inclusive and compared as strings, None means unbounded
+        :param contains: dict with list field name as a key and list of items it must contain as a value
+        :param order_by: field the documents are ordered by as strings instead of id, ties are ordered by id;
+                         'after' cannot be used then, as it is an id
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        if order_by is not None and after is not None:
+            raise ValueError('parameter after cannot be used along with order_by')
+        connection = kwargs['conn']
+
+        result = DocumentList()
+        cur = connection.get_cursor()
+        cur.execute(*cls.__construct_page_query(query, after, limit, ranges, contains, order_by=order_by))
+        connection.wait_for_completion()
+        for item in cur.fetchall():
+            result.append(cls._db_record_to_instance_pq(item))
+        return result
+
+    @classmethod
+    def get_versions(cls, query, after=None, limit=None, ranges=None, contains=None, **kwargs):
+        """
+        Retrieves versions of documents instead of the documents themselves, arguments are the same as in get_page()
+        :return: list of (id, modified_at, digest) tuples, digest changes with every change of the document data
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        cur = connection.get_cursor()
+        cur.execute(*cls.__construct_page_query(
+            query, after, limit, ranges, contains, columns="id, data::json->>'modified_at', md5(data::text)"
+        ))
+        connection.wait_for_completion()
+        return [(str(item[0]), item[1], item[2]) for item in cur.fetchall()]
+
+    @classmethod
+    def get_fields(cls, query, fields, **kwargs):
+        """
+        Retrieves only the given fields of documents, without loading and deserializing the whole documents
+        :return: list of dicts with the stored (string) values of the fields and the document id under 'id'
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        columns = ', '.join(['id'] + ['data::json->>%s'] * len(fields))
+        sql_query, params = cls.construct_query(query, columns)
+        cur = connection.get_cursor()
+        cur.execute(sql_query, list(fields) + params)
+        connection.wait_for_completion()
+        return [dict(zip(fields, item[1:]), id=str(item[0])) for item in cur.fetchall()]
+
+    @classmethod
+    def __construct_page_query(cls, query, after, limit, ranges, contains, columns='*', ordered=True, order_by=None):
+        sql_query, params = cls.construct_query(query, columns)
+        for key, (lower, upper) in (ranges or {}).items():
+            if lower is not None:
+                sql_query += " and data::json->>%s >= %s "
+                params += [key, str(lower)]
+            if upper is not None:
+                sql_query += " and data::json->>%s <= %s "
+                params += [key, str(upper)]
+        for key, items in (contains or {}).items():
+            sql_query += " and (data::jsonb->%s) @> %s::jsonb "
+            params += [key, json.dumps(items)]
+        if after is not None:
+            sql_query += " and id > %s "
+            params += [int(after)]
+        if order_by is not None:
+            sql_query += " ORDER BY data::json->>%s, id "
+            params += [order_by]
+        elif ordered:
+            sql_query += " ORDER BY id "
+        if limit is not None:
+            sql_query += " LIMIT %s "
+            params += [int(limit)]
+        return [sql_query, params]
+
+    @classmethod
+    def get_for_update(cls, query, **kwargs):
+        # rows are always locked in the same order to prevent deadlocks
+        return cls.__get_custom(query, "ORDER BY ID FOR UPDATE;", **kwargs)
+
     @classmethod
     def __get_one_custom(cls, query, extend, **kwargs):
         if 'conn' not in kwargs:
@@ -27,6 +27,9 @@ class MachineState(StrEnumBase):
         """
         return self not in [MachineState.UNDEPLOYED, MachineState.FAILED]
 
+    def takes_slot(self) -> bool:
+        return self in [MachineState.CREATED, MachineState.DEPLOYED, MachineState.RUNNING]
+
 
 class RequestState(StrEnumBase):
     CREATED = 'created'
@@ -55,6 +58,7 @@ class RequestType(StrEnumBase):
     TAKE_SNAPSHOT = 'take_snapshot'
     RESTORE_SNAPSHOT = 'restore_snapshot'
     DELETE_SNAPSHOT = 'delete_snapshot'
+    BULK = 'bulk'
 
     def can_change_machine_state(self) -> bool:
         return self in [RequestType.START, RequestType.STOP, RequestType.DEPLOY, RequestType.UNDEPLOY]
@@ -0,0 +1,49 @@
+import datetime
+
+from web.settings import Settings
+
+from .base import trString, trTimestamp, trDict
+from .document import *
+
+
+class Event(Document):
+    """
+    State change committed along with the changed document, streamed by GET /events.
+    Events are inserted just before the transaction commits, so their ids follow the commit order
+    and serve as resumable event ids, even if the change was made long before the commit.
+    """
+    created_at = trTimestamp
+    kind = trString         # request, machine or capabilities
+    subject_id = trString   # id of the changed document
+    payload = trDict
+
+    _notify_channel = 'event_created'
+
+    @staticmethod
+    def enabled():
+        return Settings.app['service']['events']['enabled']
+
+    @classmethod
+    def emit(cls, kind, subject_id, payload, **kwargs):
+        if not cls.enabled():
+            return
+        event = cls(created_at=datetime.datetime.now(), kind=kind, subject_id=str(subject_id), payload=payload)
+        kwargs['conn'].before_commit(lambda conn: event.save(conn=conn))
+
+    @classmethod
+    def last_id(cls, **kwargs):
+        connection = kwargs['conn']
+        cur = connection.get_cursor()
+        cur.execute("SELECT coalesce(max(id), 0) FROM documents where type = %s", [cls.__name__.lower()])
+        connection.wait_for_completion()
+        return str(cur.fetchone()[0])
+
+    @classmethod
+    def prune(cls, before, **kwargs):
+        connection = kwargs['conn']
+        cur = connection.get_cursor()
+        cur.execute(
+            "DELETE FROM documents where type = %s and data::json->>'created_at' < %s",
+            [cls.__name__.lower(), before.strftime('%Y-%m-%d %H:%M:%S')]
+        )
+        connection.wait_for_completion()
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+
+# connecting blocks the event loop, attempts are limited while the db is unreachable
+CONNECT_TIMEOUT = 3             # in seconds
+RECONNECT_BACKOFF_MIN = 1       # in seconds, doubled after every failed attempt
+RECONNECT_BACKOFF_MAX = 60      # in seconds
+
+
+class Listener:
+    """
+    Wakes up coroutines waiting for a change of a document. Changes are announced by PostgreSQL
+    NOTIFY with the document id as a payload (see Document._notify_channel), so the changes made by
+    the workers are seen as well. One dedicated connection per process is used for all waiters.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.__logger = logging.getLogger(__name__)
+        self.__dsn = None
+        self.__loop = None
+        self.__client = None
+        self.__waiters = {}
+        self.__callbacks = []
+        self.__next_attempt = 0
+        self.__backoff = RECONNECT_BACKOFF_MIN
+
+    def start(self, dsn, loop):
+        self.__dsn = dsn
+        self.__loop = loop
+        self.__listen()
+
+    def __listen(self):
+        if time.time() < self.__next_attempt:
+            return
+        try:
+            client = psycopg2.connect(self.__dsn, connect_timeout=CONNECT_TIMEOUT)
+            client.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            client.cursor().execute(f'LISTEN {self.channel};')
+            self.__loop.add_reader(client.fileno(), self.__on_readable)
+            self.__client = client
+            self.__backoff = RECONNECT_BACKOFF_MIN
+            self.__logger.debug(f'listening to {self.channel}')
+        except Exception:
+            self.__logger.warning(f'cannot listen to {self.channel}, next attempt in {self.__backoff} s', exc_info=True)
+            self.__next_attempt = time.time() + self.__backoff
+            self.__backoff = min(self.__backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def __on_readable(self):
+        try:
+            self.__client.poll()
+        except Exception:
+            self.__logger.warning(f'listening to {self.channel} failed, reconnecting next time', exc_info=True)
+            self.__loop.remove_reader(self.__client.fileno())
+            self.__client.close()
+            self.__client = None
+            # waiters would sleep until their timeout, they rather check the state themselves
+            for key in list(self.__waiters.keys()):
+                self.__wake(key)
+            self.__call_back(None)
+            return
+
+        while self.__client.notifies:
+            payload = self.__client.notifies.pop(0).payload
+            self.__wake(payload)
+            self.__call_back(payload)
+
+    def __call_back(self, payload):
+        for callback in self.__callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                self.__logger.warning(f'callback of {self.channel} failed', exc_info=True)
+
+    def __wake(self, key):
+        for future in self.__waiters.pop(key, []):
+            if not future.done():
+                future.set_result(True)
+
+    def ensure_listening(self):
+        """
+        :return: True if notifications are being received, reconnecting if needed
+        """
+        if self.__client is None and self.__dsn is not None:
+            self.__listen()
+            if self.__client is not None:
+                # notifications sent while disconnected are lost
+                self.__call_back(None)
+        return self.__client is not None
+
+    def add_callback(self, callback):
+        """
+        Registers a function called with the id of every changed document,
+        or with None when changes might have been missed
+        """
+        self.__callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self.__callbacks:
+            self.__callbacks.remove(callback)
+
+    def subscribe(self, key):
+        """
+        Registers interest in a change of the document, it must be called before the document is read,
+        otherwise a change made in between would be missed. Without notifications (see ensure_listening())
+        the future is never resolved, the caller has to check the document periodically instead.
+        :return: future resolved once the document changes, it must be passed to unsubscribe() in the end
+        """
+        future = asyncio.get_event_loop().create_future()
+        if not self.ensure_listening():
+            return future
+        self.__waiters.setdefault(key, []).append(future)
+        return future
+
+    def unsubscribe(self, key, future):
+        waiters = self.__waiters.get(key, [])
+        if future in waiters:
+            waiters.remove(future)
+        if not waiters:
+            self.__waiters.pop(key, None)
+
+    async def wait(self, future, timeout):
+        """
+        :return: True if the document has changed, False on timeout
+        """
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+
+request_listener = Listener('request_changed')
+slot_counter_listener = Listener('slot_counter_changed')
+event_listener = Listener('event_created')
@@ -1,8 +1,12 @@
+import re
+
 from web.settings import Settings
 
 from .base import trString, trList, trSaveTimestamp, trMachineState, trTimestamp, trHiddenString
 from .enums import MachineState
 from .document import *
+from .slot_counter import SlotCounter
+from .event import Event
 
 
 class Machine(Document):
@@ -38,5 +42,39 @@ class Machine(Document):
                     'machine_moref': "vm-notset"
                 }
 
+    @classmethod
+    def _db_record_to_instance_pq(cls, record):
+        machine = super()._db_record_to_instance_pq(record)
+        machine._stored_state = machine.state
+        machine._stored_ip_addresses = list(machine.ip_addresses)
+        return machine
+
+    def save(self, **kwargs):
+        stored_state = getattr(self, '_stored_state', None)
+        stored_ip_addresses = getattr(self, '_stored_ip_addresses', None)
+        super().save(**kwargs)
+        SlotCounter.add(
+            used=int(self.state.takes_slot()) - int(stored_state is not None and stored_state.takes_slot()),
+            **kwargs
+        )
+        if self.state is not stored_state or self.ip_addresses != stored_ip_addresses:
+            Event.emit('machine', self.id, {
+                'machine_id': self.id,
+                'state': self.state.value,
+                'ip_addresses': self.ip_addresses,
+            }, **kwargs)
+        self._stored_state = self.state
+        self._stored_ip_addresses = list(self.ip_addresses)
+
     def has_feat_running_label(self) -> bool:
         return 'feat:running' in self.labels
+
+    def get_inventory_folder(self):
+        """
+        :return: folder path relative to vsphere.folder the machine is cloned in, None for vsphere.folder itself
+        """
+        for label in self.labels:
+            matches = re.match('config:inventory_path=(.*)', label)
+            if matches:
+                return matches[1]
+        return None
@@ -0,0 +1,34 @@
+from .base import trString, trSaveTimestamp, trTimestamp, trBool, trId
+from .document import *
+from .slot_counter import SlotCounter
+
+
+class PooledMachine(Document):
+    """
+    Pre-deployed machine of the warm pool, it takes a slot until it is handed out to a deploy
+    """
+    modified_at = trSaveTimestamp
+    created_at = trTimestamp
+    template = trString             # template the machine has been cloned from
+    running = trBool                # powered on machines serve deploys with 'feat:running' label
+    provider_id = trString          # vm uuid
+    mo_ref = trString
+    machine_name = trString         # name in the pool, the machine is renamed when handed out
+
+    _defaults = {
+        'created_at': trTimestamp.NOT_INITIALIZED,
+        'running': False,
+    }
+
+    def save(self, **kwargs):
+        inserted = self.id == trId._default
+        super().save(**kwargs)
+        if inserted:
+            SlotCounter.add(used=1, **kwargs)
+
+    def remove(self, **kwargs):
+        """
+        Removes the machine from the pool, the deploy it is handed out to already takes its slot
+        """
+        PooledMachine.delete({'_id': self.id}, **kwargs)
+        SlotCounter.add(used=-1, **kwargs)
@@ -1,6 +1,7 @@
-from .base import trString, trSaveTimestamp, trRequestState, trRequestType
+from .base import trString, trList, trSaveTimestamp, trRequestState, trRequestType
 from .enums import RequestState
 from .document import *
+from .event import Event
 
 
 class Request(Document):
@@ -9,7 +10,53 @@ class Request(Document):
     state = trRequestState
     machine = trString
     subject_id = trString
+    subrequests = trList    # requests of single machines in case of bulk request
+    parent = trString       # aggregate request of a batch deploy, finished along with its last subrequest
+    target_folder = trString    # inventory folder of deployed machine relative to vsphere.folder, see delayed.py
+
+    _notify_channel = 'request_changed'
+
+    @classmethod
+    def _db_record_to_instance_pq(cls, record):
+        request = super()._db_record_to_instance_pq(record)
+        request._stored_state = request.state
+        return request
+
+    def save(self, **kwargs):
+        stored_state = getattr(self, '_stored_state', None)
+        super().save(**kwargs)
+        if self.state is not stored_state:
+            Event.emit('request', self.id, {
+                'request_id': self.id,
+                'machine_id': self.machine,
+                'request_type': self.type.value,
+                'state': self.state.value,
+                'is_last': self.state.has_finished(),
+            }, **kwargs)
+        self._stored_state = self.state
+        if self.parent and self.state.has_finished() and (stored_state is None or not stored_state.has_finished()):
+            Request.finish_aggregate(self.parent, **kwargs)
+
+    @classmethod
+    def finish_aggregate(cls, aggregate_id, **kwargs):
+        """
+        Finishes the aggregate request once all of its subrequests have finished. The aggregate is locked
+        before the subrequests are read, so the last of concurrently finished subrequests sees all the others.
+        :return: the aggregate request
+        """
+        aggregate = cls.get_one_for_update({'_id': aggregate_id}, **kwargs)
+        if aggregate.state.has_finished():
+            return aggregate
+        states = [subrequest.state for subrequest in cls.get_by_ids(aggregate.subrequests, **kwargs)]
+        if all(state.has_finished() for state in states):
+            aggregate.state = RequestState.FAILED if any(state.is_error() for state in states) \
+                else RequestState.SUCCESS
+            aggregate.save(**kwargs)
+        return aggregate
 
     _defaults = {
-                    'state': RequestState.CREATED
+                    'state': RequestState.CREATED,
+                    'subrequests': [],
+                    'parent': '',
+                    'target_folder': '',
                 }
@@ -1,11 +1,16 @@
-from .base import trString, trTimestamp
+import base64
+
+import psycopg2
+
+from .base import trString, trTimestamp, trInt
 from .document import *
 
 
 class Screenshot(Document):
     created_at = trTimestamp
     file_type = trString
-    image_base64 = trString
+    image_base64 = trString     # hcp url or image data of screenshots stored before screenshot_images existed
+    image_size = trInt          # in bytes
     machine = trString
     status = trString
 
@@ -13,3 +18,79 @@ class Screenshot(Document):
                     'file_type': 'png',
                     'status': 'not_obtained',
                 }
+
+    def save_image(self, image, **kwargs):
+        """
+        Stores raw image data into screenshot_images table, out of the json document
+        :param image: image bytes
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        cur = connection.get_cursor()
+        cur.execute(
+            "insert into screenshot_images (screenshot_id, data) values (%s, %s) "
+            "on conflict (screenshot_id) do update set data = excluded.data;",
+            [self.id, psycopg2.Binary(image)]
+        )
+        connection.wait_for_completion()
+        self.image_size = len(image)
+
+    def load_image(self, **kwargs):
+        """
+        Loads raw image data of obtained screenshot
+        :return: image bytes or None when there is no image
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        if self.status != 'obtained':
+            return None
+
+        cur = connection.get_cursor()
+        cur.execute("select data from screenshot_images where screenshot_id = %s;", [self.id])
+        connection.wait_for_completion()
+        record = cur.fetchone()
+        if record is None:
+            return base64.b64decode(self.image_base64) if self.image_base64 else None
+        return bytes(record[0])
+
+    def get_image_size(self, **kwargs):
+        """
+        Gets size of image data of obtained screenshot stored in screenshot_images table, without reading the data
+        :return: size in bytes or None when the image is not stored there
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        if self.status != 'obtained':
+            return None
+
+        cur = connection.get_cursor()
+        cur.execute("select octet_length(data) from screenshot_images where screenshot_id = %s;", [self.id])
+        connection.wait_for_completion()
+        record = cur.fetchone()
+        return record[0] if record is not None else None
+
+    def load_image_range(self, offset, size, **kwargs):
+        """
+        Loads part of image data stored in screenshot_images table, only the part is read and transferred
+        :param offset: offset of the part in bytes, counted from 0
+        :param size: size of the part in bytes, shorter at the end of the image
+        :return: image bytes
+        """
+        if 'conn' not in kwargs:
+            raise ValueError('parameter conn must be specified')
+        connection = kwargs['conn']
+
+        cur = connection.get_cursor()
+        cur.execute(
+            "select substring(data from %s for %s) from screenshot_images where screenshot_id = %s;",
+            [offset + 1, size, self.id]
+        )
+        connection.wait_for_completion()
+        record = cur.fetchone()
+        return bytes(record[0]) if record is not None else b''
@@ -0,0 +1,71 @@
+from web.settings import Settings
+
+from .base import trString, trSaveTimestamp, trInt
+from .document import *
+from .event import Event
+
+
+class SlotCounter(Document):
+    """
+    Slot usage of the unit, updated in the same transaction as machine states and deploy tickets,
+    so the capabilities are read from a single row. Drift is fixed by reconciliation in delayed.py.
+    """
+    modified_at = trSaveTimestamp
+    unit = trString
+    used = trInt            # machines taking a slot, see MachineState.takes_slot()
+    free_tickets = trInt    # enabled deploy tickets that are not taken
+    slot_limit = trInt      # computed from the hosts in maintenance in case of deploy tickets
+
+    _defaults = {
+        'unit': Settings.app['unit_name'],
+        'slot_limit': Settings.app['slot_limit'],
+    }
+    _notify_channel = 'slot_counter_changed'
+
+    @staticmethod
+    def enabled():
+        return Settings.app['service']['capabilities']['slot_counters']
+
+    @classmethod
+    def get_for_unit(cls, for_update=False, **kwargs):
+        query = {'unit': Settings.app['unit_name']}
+        return cls.get_one_for_update(query, **kwargs) if for_update else cls.get_one(query, **kwargs)
+
+    @classmethod
+    def add(cls, used=0, free_tickets=0, **kwargs):
+        """
+        Adds the deltas to the counter row, the row stays locked until the transaction of 'conn' ends.
+        A process must not change the counter on another connection meanwhile, e.g. release deploy tickets
+        on 'qconn' after a machine has been saved on 'conn1' in the same action: PostgreSQL does not detect
+        such a deadlock within one process, tickets are therefore taken and released before machines are saved.
+        """
+        if not cls.enabled() or (used == 0 and free_tickets == 0):
+            return
+        counter = cls.get_for_unit(for_update=True, **kwargs)
+        if counter is None:
+            # the counter is created by the first reconciliation
+            return
+        counter.used += used
+        counter.free_tickets += free_tickets
+        counter.save(**kwargs)
+
+    @classmethod
+    def _db_record_to_instance_pq(cls, record):
+        counter = super()._db_record_to_instance_pq(record)
+        counter._stored_capabilities = counter.get_capabilities()
+        return counter
+
+    def save(self, **kwargs):
+        stored_capabilities = getattr(self, '_stored_capabilities', None)
+        super().save(**kwargs)
+        if self.get_capabilities() != stored_capabilities:
+            Event.emit('capabilities', self.id, self.get_capabilities(), **kwargs)
+        self._stored_capabilities = self.get_capabilities()
+
+    def get_capabilities(self):
+        return {'slot_limit': self.slot_limit, 'free_slots': self.get_free_slots()}
+
+    def get_free_slots(self):
+        if Settings.app["vsphere"]["hosts_folder_name"]:
+            return max(min(self.free_tickets, self.slot_limit), 0)
+        return max(self.slot_limit - self.used, 0)
@@ -4,6 +4,7 @@ from sanic import Blueprint
 
 import web.modeltr as data
 from web.settings import Settings
+from web.timing import measured
 from web.modeltr.enums import MachineState
 
 logger = logging.getLogger(__name__)
@@ -15,10 +16,42 @@ class Capabilities:
     _free_slots = 0
     _slot_limit = Settings.app['slot_limit']
     _last_check = 0
+    # the cached counter is valid until its change is notified
+    _counter_valid = False
     _labels = Settings.app['labels'] + ["unit:{}".format(Settings.app['unit_name'])]
 
     @staticmethod
+    def invalidate(document_id=None):
+        Capabilities._counter_valid = False
+
+    @staticmethod
+    def fetch_counters():
+        """
+        Reads the capabilities from the slot counter row, unless the cached one is still valid
+        :return: False when the counter is not available yet
+        """
+        # reconnected listener invalidates the cache, so it is checked first
+        if data.slot_counter_listener.ensure_listening() and Capabilities._counter_valid:
+            return True
+        # notification of a change made during the read invalidates the cache again
+        Capabilities._counter_valid = data.slot_counter_listener.ensure_listening()
+        with data.Connection.use() as conn:
+            counter = data.SlotCounter.get_for_unit(conn=conn)
+        if counter is None:
+            Capabilities._counter_valid = False
+            return False
+        Capabilities._slot_limit = counter.slot_limit
+        Capabilities._free_slots = counter.get_free_slots()
+        Capabilities._last_check = int(time.time())
+        return True
+
+    @staticmethod
+    @measured('capabilities')
     async def fetch(forced=False):
+        # the counter is shared by all web server processes, each of them reads it only once per change
+        if data.SlotCounter.enabled() and Capabilities.fetch_counters():
+            return
+
         used_slots = Capabilities._slot_limit - Capabilities._free_slots
         logger.debug("Capabilities last check: {}".format(Capabilities._last_check))
         caching_period = Settings.app['service']['capabilities']['caching_period']
@@ -43,7 +76,8 @@ class Capabilities:
                     used_slots = \
                         len(data.Machine.get({'state': MachineState.RUNNING.value}, conn=conn)) + \
                         len(data.Machine.get({'state': MachineState.DEPLOYED.value}, conn=conn)) + \
-                        len(data.Machine.get({'state': MachineState.CREATED.value}, conn=conn))
+                        len(data.Machine.get({'state': MachineState.CREATED.value}, conn=conn)) + \
+                        data.PooledMachine.count({}, conn=conn)
                     Capabilities._free_slots = max(Capabilities._slot_limit - used_slots, 0)
             Capabilities._last_check = int(time.time())
             logger.debug("Real capabilities fetch finished")
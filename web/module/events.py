@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import sanic.exceptions
+import sanic.response
+from sanic import Blueprint
+
+import web.modeltr as data
+from web.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+events = Blueprint('events')
+
+
+def format_event(event):
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(event.payload)}\n\n'
+
+
+async def stream_events(request, response, after):
+    """
+    Writes events committed after the given event id until the client disconnects or 'max_duration' expires,
+    the client then reconnects with Last-Event-ID
+    """
+    config = Settings.app['service']['events']
+    changed = asyncio.Event()
+    # events committed before the stream has been opened are replayed first
+    changed.set()
+
+    def on_event(payload):
+        changed.set()
+
+    data.event_listener.add_callback(on_event)
+    # ids of recently sent events; ids are allocated just before commit, so an event with lower id can still appear
+    # while its transaction commits, only events older than 'reorder_window' seconds move the cursor
+    sent = OrderedDict()
+    cursor = int(after)
+    deadline = time.time() + config['max_duration']
+    try:
+        await response.write(f'retry: {config["retry"] * 1000}\n\n')
+        while time.time() < deadline and not request.transport.is_closing():
+            try:
+                await asyncio.wait_for(changed.wait(), config['keepalive'])
+            except asyncio.TimeoutError:
+                await response.write(': keepalive\n\n')
+                # without notifications the events are looked for once per keepalive period
+                if data.event_listener.ensure_listening():
+                    continue
+            changed.clear()
+
+            now = time.time()
+            while sent and next(iter(sent.values())) < now - config['reorder_window']:
+                event_id, _ = sent.popitem(last=False)
+                cursor = max(cursor, event_id)
+
+            # the recently sent events are read again, the limit covers them
+            limit = config['batch_size'] + len(sent)
+            with data.Connection.use() as conn:
+                new_events = data.Event.get_page({}, after=cursor, limit=limit, conn=conn)
+            for event in new_events:
+                if int(event.id) in sent:
+                    continue
+                await response.write(format_event(event))
+                sent[int(event.id)] = now
+            if len(new_events) == limit:
+                changed.set()
+    finally:
+        data.event_listener.remove_callback(on_event)
+
+
+@events.route('/events', methods=['GET'])
+async def events_get(request):
+    if not data.Event.enabled():
+        raise sanic.exceptions.InvalidUsage('events are not enabled on this unit')
+    if Settings.app['service']['personalised'] and request.headers.get("AUTHORISED_AS", "None") != "admin":
+        # events are not filtered by the owner of the machine
+        raise sanic.exceptions.InvalidUsage('Not authorized to see events of all machines.')
+
+    after = request.headers.get('Last-Event-ID', request.raw_args.get('last_event_id'))
+    if after is not None and not after.isdigit():
+        raise sanic.exceptions.InvalidUsage('malformed parameter: last_event_id, event id expected')
+    if after is None:
+        # a new client gets only the events from now on
+        with data.Connection.use() as conn:
+            after = data.Event.last_id(conn=conn)
+
+    return sanic.response.stream(
+        lambda response: stream_events(request, response, after),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache'}
+    )
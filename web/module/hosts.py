@@ -4,6 +4,7 @@ import asyncio
 from sanic import Blueprint
 import web.modeltr as data
 from web.settings import Settings
+from web.conditional import conditional_response
 import sanic.exceptions
 
 hosts = Blueprint('hosts')
@@ -13,6 +14,9 @@ hosts = Blueprint('hosts')
 async def hosts_get_info(request):
     with data.Connection.use() as conn:
         await asyncio.sleep(0.0)
+        not_modified = conditional_response(request, data.HostRuntimeInfo.get_versions({}, conn=conn))
+        if not_modified:
+            return not_modified
         result = []
         for host in data.HostRuntimeInfo.get({}, conn=conn):
             hhost = host.to_dict(redacted=True)
@@ -33,6 +37,10 @@ async def hosts_get_info(request):
 async def host_get_info(request, host_id):
     with data.Connection.use() as conn:
         await asyncio.sleep(0.0)
+        versions = data.HostRuntimeInfo.get_versions({'_id': host_id}, conn=conn)
+        not_modified = conditional_response(request, versions) if versions else None
+        if not_modified:
+            return not_modified
         host = data.HostRuntimeInfo.get_one({'_id': host_id}, conn=conn)
         hhost = host.to_dict()
         hhost['id'] = host.id
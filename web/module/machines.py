@@ -1,5 +1,6 @@
 import asyncio
 import datetime
+import json
 import logging
 import threading
 
@@ -10,6 +11,8 @@ from sanic import Blueprint
 import web.enhanced_logging as el
 import web.modeltr as data
 import web.module.capabilities as capabilities
+from web.admission import Admission
+from web.conditional import conditional_response
 from web.settings import Settings
 
 
@@ -53,13 +56,71 @@ def handle_exceptions(request, exception):
     }
 
 
-async def check_resources(labels):
+async def check_resources(labels, count=1):
     await capabilities.Capabilities.fetch(forced=True)
-    if capabilities.Capabilities.get_free_slots() < 1:
-        logger.warning(f"Attempting to deploy a vm when the unit is full at {datetime.datetime.now()}, labels:{labels}")
+    if capabilities.Capabilities.get_free_slots() < count:
+        logger.warning(f"Attempting to deploy {count} vm(s) when the unit has not enough free slots "
+                       f"at {datetime.datetime.now()}, labels:{labels}")
         raise sanic.exceptions.InvalidUsage('Unit is currently full and cannot process any new machine at the moment.')
 
 
+def get_deploy_count(request):
+    count = request.headers['json_params'].get('count', 1)
+    max_count = Settings.app['service']['deploy_max_count']
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= max_count:
+        raise sanic.exceptions.InvalidUsage(
+            f'malformed input json data, \'count\' must be an integer between 1 and {max_count}'
+        )
+    return count
+
+
+def too_many_requests(retry_after):
+    return sanic.response.json(
+        {
+            'responses': [{
+                'type': 'exception',
+                'response_id': 0,
+                'exception': 'Unit is currently saturated by deploys, please retry later.',
+                'exception_args': [],
+                'exception_traceback': [],
+                'retry_after': retry_after,
+                'is_last': True
+            }]
+        },
+        status=429,
+        headers={'Retry-After': str(retry_after)}
+    )
+
+
+def create_deploy_request(request, labels, conn, parent=''):
+    new_request = data.Request(type=data.RequestType.DEPLOY, parent=parent)
+    new_request.save(conn=conn)
+    if Settings.app['service']['personalised']:
+        # TODO handle case when request.headers["AUTHORISED_LOGIN"] is not specified?
+        new_machine = data.Machine(
+            labels=labels,
+            requests=[new_request.id],
+            owner=request.headers["AUTHORISED_LOGIN"],
+            created_at=datetime.datetime.now()
+        )
+    else:
+        new_machine = data.Machine(
+            labels=labels,
+            requests=[new_request.id],
+            created_at=datetime.datetime.now()
+        )
+    new_machine.save(conn=conn)
+
+    new_request.machine = str(new_machine.id)
+    # folders targeted by deploys are not removed as empty
+    new_request.target_folder = new_machine.get_inventory_folder() or ''
+    new_request.save(conn=conn)
+
+    # begin machine preparation
+    data.Action(type='deploy', request=new_request.id).save(conn=conn)
+    return new_request
+
+
 @machines.route('/machines', methods=['POST'])
 @el.log_func_boundaries
 async def machine_deploy(request):
@@ -67,80 +128,254 @@ async def machine_deploy(request):
     el.log_i(request, f'POST /machines wanted by: {login}')
     await check_payload_deploy(request)
     labels = request.headers['json_params']['labels']
-    await check_resources(labels)
+    count = get_deploy_count(request)
+    await check_resources(labels, count)
     el.log_i(request, "attempting to create db session")
     with data.Connection.use() as conn:
-        new_request = data.Request(type=data.RequestType.DEPLOY)
-        new_request.save(conn=conn)
-        el.log_i(request, "new request saved")
-        if Settings.app['service']['personalised']:
-            # TODO handle case when request.headers["AUTHORISED_LOGIN"] is not specified?
-            new_machine = data.Machine(
-                labels=labels,
-                requests=[new_request.id],
-                owner=request.headers["AUTHORISED_LOGIN"],
-                created_at=datetime.datetime.now()
-            )
-        else:
-            new_machine = data.Machine(
-                labels=labels,
-                requests=[new_request.id],
-                created_at=datetime.datetime.now()
-            )
-        new_machine.save(conn=conn)
-        el.log_i(request, "new machine saved")
-
-        new_request.machine = str(new_machine.id)
-        new_request.save(conn=conn)
-        el.log_i(request, "new request saved again")
-
-        # begin machine preparation
-        data.Action(type='deploy', request=new_request.id).save(conn=conn)
-        el.log_i(request, "new action saved")
+        if data.SlotCounter.enabled():
+            # the counter stays locked until the new machines are counted in, so concurrent deploys cannot overbook
+            counter = data.SlotCounter.get_for_unit(for_update=True, conn=conn)
+            if counter is not None and counter.get_free_slots() < count:
+                raise sanic.exceptions.InvalidUsage(
+                    'Unit is currently full and cannot process any new machine at the moment.'
+                )
+        if Settings.app['service']['admission']['enabled']:
+            retry_after = Admission.check(count, conn)
+            if retry_after is not None:
+                return too_many_requests(retry_after)
+        bulk_request = None
+        if count > 1:
+            # deploy requests are tracked together by an aggregate request, the last finished deploy finishes it
+            bulk_request = data.Request(type=data.RequestType.BULK)
+            bulk_request.save(conn=conn)
+        new_requests = [
+            create_deploy_request(request, labels, conn, parent=bulk_request.id if bulk_request else '')
+            for i in range(count)
+        ]
+        el.log_i(request, f"{count} deploy request(s) saved")
+        if bulk_request is not None:
+            bulk_request.subrequests = [new_request.id for new_request in new_requests]
+            bulk_request.save(conn=conn)
 
     el.log_i(request, "data committed to the db")
+    if count == 1:
+        return {
+                'request_id': '{}'.format(new_requests[0].id),
+                'is_last': False
+        }
     return {
-            'request_id': '{}'.format(new_request.id),
+            'request_id': str(bulk_request.id),
+            'machine_ids': [new_request.machine for new_request in new_requests],
+            'request_ids': [str(new_request.id) for new_request in new_requests],
             'is_last': False
     }
 
 
-async def get_machines(request, connection, **kwargs):
+def get_machines_query(request, **kwargs):
     raw_args = request.raw_args
     if 'flt' in kwargs:
         raw_args = {**raw_args, **kwargs['flt']}
     if Settings.app['service']['personalised'] and request.headers.get("AUTHORISED_AS", "None") == "user":
         # TODO: are we sure that request.headers["AUTHORISED_LOGIN"] is specified?
-        return data.Machine.get(
-            {**raw_args, **{'owner': request.headers["AUTHORISED_LOGIN"]}},
-            conn=connection
-        )
+        return {**raw_args, **{'owner': request.headers["AUTHORISED_LOGIN"]}}
     else:
-        return data.Machine.get(raw_args, conn=connection)
+        return raw_args
+
+
+async def get_machines(request, connection, **kwargs):
+    return data.Machine.get(get_machines_query(request, **kwargs), conn=connection)
+
+
+def get_response_variant(request):
+    # the same documents are presented differently based on the parameters and the caller's role
+    return f'{request.query_string}|{request.headers.get("AUTHORISED_AS", "None")}'
 
 
 async def show_hidden_strings(request):
     return request.headers.get("AUTHORISED_AS", "None") == "admin"
 
 
-@machines.route('/machines', methods=['GET'])
-async def machines_get_info(request):
+MACHINES_FILTERS = [
+    'state', 'label', 'template', 'owner', 'created_after', 'created_before', 'modified_after', 'modified_before',
+    'after_id', 'limit', 'fields', 'stream'
+]
+TIMESTAMP_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+
+
+def parse_timestamp(request, key):
+    value = request.raw_args.get(key)
+    if value is None:
+        return None
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            # timestamps are stored as strings in the first format, so they are compared the same way
+            return datetime.datetime.strptime(value, timestamp_format).strftime(TIMESTAMP_FORMATS[0])
+        except ValueError:
+            pass
+    raise sanic.exceptions.InvalidUsage(f'malformed parameter: {key}, expected format is \'YYYY-MM-DD HH:MM:SS\'')
+
+
+def get_machines_filter(request):
+    """
+    Translates query parameters of GET /machines to arguments of Machine.get_page()
+    """
     for key in request.raw_args.keys():
-        if key not in ['state']:
+        if key not in MACHINES_FILTERS:
             raise sanic.exceptions.InvalidUsage(f'malformed parameter: {key}')
 
-    with data.Connection.use() as conn:
-        await asyncio.sleep(0.1)
-        machines = await get_machines(request, conn)
-        output = []
-        for machine in machines:
-            output.append({
-                **machine.to_dict(show_hidden=await show_hidden_strings(request)),
-                **{'id': machine.id}
-            })
+    query = {key: request.raw_args[key] for key in ['state', 'owner'] if key in request.raw_args}
+    if Settings.app['service']['personalised'] and request.headers.get("AUTHORISED_AS", "None") == "user":
+        query['owner'] = request.headers["AUTHORISED_LOGIN"]
+
+    labels = list(request.args.getlist('label') or [])
+    if 'template' in request.raw_args:
+        labels.append(f'template:{request.raw_args["template"]}')
+
+    ranges = {}
+    for field, prefix in [('created_at', 'created'), ('modified_at', 'modified')]:
+        bounds = (parse_timestamp(request, f'{prefix}_after'), parse_timestamp(request, f'{prefix}_before'))
+        if bounds != (None, None):
+            ranges[field] = bounds
+
+    after_id = request.raw_args.get('after_id')
+    if after_id is not None and not after_id.isdigit():
+        raise sanic.exceptions.InvalidUsage('malformed parameter: after_id, machine id expected')
+
+    limit = request.raw_args.get('limit')
+    max_limit = Settings.app['service']['machines_page_max']
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= max_limit:
+            raise sanic.exceptions.InvalidUsage(f'malformed parameter: limit, must be between 1 and {max_limit}')
+        limit = int(limit)
 
+    return {
+        'query': query,
+        'after': after_id,
+        'limit': limit,
+        'ranges': ranges,
+        'contains': {'labels': labels} if labels else None,
+    }
+
+
+def machine_to_output(machine, fields, show_hidden):
+    output = machine.to_dict(show_hidden=show_hidden)
+    if fields:
+        output = {key: value for key, value in output.items() if key in fields}
+    return {**output, **{'id': machine.id}}
+
+
+async def stream_machines(response, machines_filter, fields, show_hidden):
+    """
+    Writes machines page by page, each page is read in its own short transaction
+    """
+    limit = machines_filter['limit']
+    after = machines_filter['after']
+    chunk_size = Settings.app['service']['machines_stream_chunk']
+    count = 0
+    await response.write('{"responses": [{"type": "return_value", "response_id": 0, "is_last": true, "result": [')
+    while limit is None or count < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - count)
+        with data.Connection.use() as conn:
+            page = data.Machine.get_page(conn=conn, **{**machines_filter, 'after': after, 'limit': size})
+        if page:
+            items = [json.dumps(machine_to_output(machine, fields, show_hidden)) for machine in page]
+            await response.write((',' if count else '') + ','.join(items))
+            count += len(page)
+            after = page[-1].id
+        if len(page) < size:
+            after = None
+            break
+    next_after_id = json.dumps(after if limit is not None else None)
+    await response.write(f'], "next_after_id": {next_after_id}}}]}}')
+
+
+@machines.route('/machines', methods=['GET'])
+async def machines_get_info(request):
+    machines_filter = get_machines_filter(request)
+    fields = [field for field in request.raw_args.get('fields', '').split(',') if field]
+    show_hidden = await show_hidden_strings(request)
+
+    if request.raw_args.get('stream') in ['1', 'true']:
+        return sanic.response.stream(
+            lambda response: stream_machines(response, machines_filter, fields, show_hidden),
+            content_type='application/json'
+        )
+
+    with data.Connection.use() as conn:
+        not_modified = conditional_response(
+            request, data.Machine.get_versions(conn=conn, **machines_filter), get_response_variant(request)
+        )
+        if not_modified:
+            return not_modified
+        machines = data.Machine.get_page(conn=conn, **machines_filter)
+    output = [machine_to_output(machine, fields, show_hidden) for machine in machines]
+
+    # id of the last machine is the cursor of the next page, there is none when the page is not full
+    next_after_id = None
+    if machines_filter['limit'] is not None and len(machines) == machines_filter['limit']:
+        next_after_id = machines[-1].id
     return {
             'result': output,
+            'next_after_id': next_after_id,
+            'is_last': True
+    }
+
+
+def to_undeploy_candidate(machine, last_request, now):
+    return {
+        'id': machine.id,
+        'machine_name': machine.machine_name,
+        'owner': machine.owner,
+        'modified_at': machine.modified_at.strftime(TIMESTAMP_FORMATS[0]),
+        'age': int((now - machine.modified_at).total_seconds()),
+        'last_request_type': last_request.type.value if last_request is not None else None,
+    }
+
+
+@machines.route('/machines/undeploy_candidates', methods=['GET'])
+async def machines_undeploy_candidates(request):
+    """
+    Machines in the state not modified for min_age seconds, along with the type of their last request,
+    oldest first. Replaces GET /machines followed by GET /requests/<id> for each machine in the undeployer.
+    """
+    state = request.raw_args.get('state')
+    if state not in [machine_state.value for machine_state in data.MachineState]:
+        raise sanic.exceptions.InvalidUsage('malformed parameter: state, machine state expected')
+    min_age = request.raw_args.get('min_age', '0')
+    if not min_age.isdigit():
+        raise sanic.exceptions.InvalidUsage('malformed parameter: min_age, number of seconds expected')
+    limit = request.raw_args.get('limit')
+    if limit is not None and not limit.isdigit():
+        raise sanic.exceptions.InvalidUsage('malformed parameter: limit, number expected')
+    last_request_types = request.args.getlist('last_request_type') or []
+
+    query = {'state': state}
+    if Settings.app['service']['personalised'] and request.headers.get("AUTHORISED_AS", "None") == "user":
+        query['owner'] = request.headers["AUTHORISED_LOGIN"]
+    now = datetime.datetime.now()
+    modified_before = (now - datetime.timedelta(seconds=int(min_age))).strftime(TIMESTAMP_FORMATS[0])
+
+    with data.Connection.use() as conn:
+        # the oldest machines are selected by the db, unless they are filtered by their last requests below
+        machines = data.Machine.get_page(
+            query,
+            ranges={'modified_at': (None, modified_before)},
+            order_by='modified_at',
+            limit=limit if not last_request_types else None,
+            conn=conn
+        )
+        # last requests of all the machines are read by one query
+        last_request_ids = [machine.requests[-1] for machine in machines if machine.requests]
+        last_requests = {req.id: req for req in data.Request.get_by_ids(last_request_ids, conn=conn)}
+
+    candidates = [
+        to_undeploy_candidate(machine, last_requests.get(str(machine.requests[-1])) if machine.requests else None, now)
+        for machine in machines
+    ]
+    if last_request_types:
+        candidates = [candidate for candidate in candidates if candidate['last_request_type'] in last_request_types]
+    return {
+            'result': candidates[:int(limit)] if limit is not None else candidates,
             'is_last': True
     }
 
@@ -149,7 +384,10 @@ async def machines_get_info(request):
 async def machine_get_info(request, machine_id):
     logger.debug(f'Current thread name: {threading.current_thread().name}')
     with data.Connection.use() as conn:
-        await asyncio.sleep(0.1)
+        versions = data.Machine.get_versions(get_machines_query(request, flt={'_id': machine_id}), conn=conn)
+        not_modified = conditional_response(request, versions, get_response_variant(request)) if versions else None
+        if not_modified:
+            return not_modified
         try:
             req = (await get_machines(request, conn, flt={'_id': machine_id})).first()
             result = req.to_dict(show_hidden=await show_hidden_strings(request))
@@ -195,6 +433,66 @@ async def machine_delete(request, machine_id):
     }
 
 
+BULK_OPERATIONS = ['start', 'stop', 'restart', 'undeploy', 'take_snapshot']
+
+
+@machines.route('/machines/bulk', methods=['POST'])
+@el.log_func_boundaries
+async def machines_bulk(request):
+    params = request.headers.get('json_params', {})
+    operation = params.get('operation')
+    machine_ids = params.get('machine_ids')
+    if operation not in BULK_OPERATIONS:
+        raise sanic.exceptions.InvalidUsage(
+            f'malformed input json data, \'operation\' must be one of {BULK_OPERATIONS}'
+        )
+    if not isinstance(machine_ids, list) or not machine_ids or \
+            not all(str(machine_id).isdigit() for machine_id in machine_ids):
+        raise sanic.exceptions.InvalidUsage('malformed input json data, \'machine_ids\' must be a non-empty list')
+    if len(machine_ids) > Settings.app['service']['bulk_max_machines']:
+        raise sanic.exceptions.InvalidUsage(
+            f'too many machines specified, limit is {Settings.app["service"]["bulk_max_machines"]}'
+        )
+    if operation == 'take_snapshot' and not params.get('name'):
+        raise sanic.exceptions.InvalidUsage('malformed input json data, \'name\' must be specified for snapshots')
+
+    request_type = data.RequestType(operation)
+    el.log_i(request, f'POST /machines/bulk: {operation} of {len(machine_ids)} machine(s)')
+
+    with data.Connection.use() as conn:
+        bulk_request = data.Request(type=data.RequestType.BULK, subrequests=[])
+        bulk_request.save(conn=conn)
+        # machines are locked in the same order to prevent deadlocks with concurrent bulk requests
+        for machine_id in sorted(set(str(machine_id) for machine_id in machine_ids), key=int):
+            machine = data.Machine.get_one_for_update({'_id': machine_id}, conn=conn)
+            await check_machine_owner(machine, request)
+            if request_type is data.RequestType.RESTART and machine.state is not data.MachineState.RUNNING:
+                msg = f'Machine {machine_id} must be running to invoke \'reset\', but was in state \'{machine.state}\''
+                raise sanic.exceptions.InvalidUsage(msg)
+
+            new_request = data.Request(type=request_type, machine=machine_id)
+            if request_type is data.RequestType.TAKE_SNAPSHOT:
+                new_snapshot = data.Snapshot(
+                    machine=machine_id, name=params['name'], created_at=datetime.datetime.now()
+                )
+                new_snapshot.save(conn=conn)
+                new_request.subject_id = new_snapshot.id
+            new_request.save(conn=conn)
+            machine.requests.append(new_request.id)
+            machine.save(conn=conn)
+            bulk_request.subrequests.append(new_request.id)
+
+        bulk_request.save(conn=conn)
+        # single action processes all the machines
+        data.Action(type='other', request=bulk_request.id).save(conn=conn)
+        el.log_i(request, "bulk request saved")
+
+    return {
+            'request_id': str(bulk_request.id),
+            'is_last': False
+    }
+
+
 @machines.route('/machines/<machine_id>', methods=['PUT'])
 async def machine_do_start_stop_reset(request, machine_id):
     logger.debug('Current thread name: {}'. format(threading.current_thread().name))
@@ -1,9 +1,13 @@
 import asyncio
 import logging
+import math
+import time
 
+import sanic.exceptions
 from sanic import Blueprint
 
 import web.modeltr as data
+from web.conditional import conditional_response
 from web.module.capabilities import Capabilities
 from web.settings import Settings
 
@@ -12,12 +16,101 @@ logger = logging.getLogger(__name__)
 requests = Blueprint('requests')
 
 
+def update_bulk_request_state(req, conn):
+    """
+    Derives state of the aggregate request once all of its subrequests have finished, aggregates are finished
+    by their last subrequest, this covers the ones created before subrequests knew their aggregate
+    """
+    states = [subrequest.state for subrequest in data.Request.get_by_ids(req.subrequests, conn=conn)]
+    if not all(state.has_finished() for state in states):
+        return req
+    return data.Request.finish_aggregate(req.id, conn=conn)
+
+
+def is_versioned(fields):
+    """
+    Tells whether the request version covers the whole response, fields are the request type and state as stored
+    """
+    if not fields:
+        return False
+    req_type = data.RequestType(fields[0]['type'])
+    # deploy responses carry current capabilities too and unfinished bulk requests are finished on load
+    return req_type is not data.RequestType.DEPLOY and \
+        (req_type is not data.RequestType.BULK or data.RequestState(fields[0]['state']).has_finished())
+
+
+def get_wait_timeout(request):
+    wait = request.raw_args.get('wait', 0)
+    try:
+        wait = float(wait)
+        if math.isnan(wait):
+            raise ValueError()
+    except ValueError:
+        raise sanic.exceptions.InvalidUsage('malformed input data, \'wait\' must be a number of seconds')
+    return min(max(wait, 0), Settings.app['service']['request_wait_max'])
+
+
+def load_request(req_id, conn):
+    req = data.Request.get({'_id': req_id}, conn=conn).first()
+    if req.type is data.RequestType.BULK and not req.state.has_finished():
+        req = update_bulk_request_state(req, conn)
+    return req
+
+
+async def poll_request_change(req_id, state, wait):
+    """
+    Checks the request periodically, used when change notifications are not available
+    """
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        await asyncio.sleep(min(Settings.app['service']['request_wait_poll_interval'], deadline - time.time()))
+        with data.Connection.use() as conn:
+            if load_request(req_id, conn).state is not state:
+                return
+
+
+async def wait_for_request_change(req_id, wait):
+    """
+    Waits until the request changes its state or the timeout expires, the transaction
+    is not held while waiting. Aggregate requests are woken by changes of their subrequests.
+    """
+    with data.Connection.use() as conn:
+        req = load_request(req_id, conn)
+    if req.state.has_finished():
+        return
+    if not data.request_listener.ensure_listening():
+        await poll_request_change(req_id, req.state, wait)
+        return
+    keys = [req_id] + req.subrequests
+    futures = [data.request_listener.subscribe(key) for key in keys]
+    try:
+        # the change may have happened before the subscription
+        with data.Connection.use() as conn:
+            if load_request(req_id, conn).state is not req.state:
+                return
+        await data.request_listener.wait(
+            asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED), wait
+        )
+    finally:
+        for key, future in zip(keys, futures):
+            data.request_listener.unsubscribe(key, future)
+
+
 @requests.route('/requests/<req_id>', methods=['GET'])
 async def req_get_info(request, req_id):
+    wait = get_wait_timeout(request)
+    if wait:
+        await wait_for_request_change(req_id, wait)
+    else:
+        await asyncio.sleep(0.1)
 
     with data.Connection.use() as conn:
-        await asyncio.sleep(0.1)
-        req = data.Request.get({'_id': req_id}, conn=conn).first()
+        # the version is checked before the request is loaded, an unchanged request is never deserialized
+        if is_versioned(data.Request.get_fields({'_id': req_id}, ['type', 'state'], conn=conn)):
+            not_modified = conditional_response(request, data.Request.get_versions({'_id': req_id}, conn=conn))
+            if not_modified:
+                return not_modified
+        req = load_request(req_id, conn)
         result_dict = {
                     'machine_id': req.machine,
                     'state': str(req.state),
@@ -27,6 +120,8 @@ async def req_get_info(request, req_id):
 
         # TODO solve this better
         # add required result data based on request type
+        if req.type is data.RequestType.BULK:
+            result_dict['subrequests'] = req.subrequests
         if req.type is data.RequestType.TAKE_SNAPSHOT:
             snap_ro = data.Snapshot.get_one({'_id': req.subject_id}, conn=conn)
             result_dict['id'] = snap_ro.id
@@ -39,7 +134,8 @@ async def req_get_info(request, req_id):
             }]
 
         if req.type is data.RequestType.DEPLOY:
-            await Capabilities.fetch(forced=True)
+            # cached capabilities are good enough until the deploy has finished
+            await Capabilities.fetch(forced=req.state.has_finished())
             extra_result = [{
                                'result': {
                                    'machine_id': req.machine,
@@ -68,7 +164,7 @@ async def req_get_info(request, req_id):
             })
             logger.warning(f'Exception block returned for request: {req_id}, type: {req.type} -- {exception_message}')
 
-        if req.state.has_finished() and req.state is not data.RequestState.SUCCESS:
+        if req.state.has_finished() and req.state is not data.RequestState.SUCCESS and req.machine:
             message = f'Request has finished in state: {str(req.state)}, type: {str(req.type)}'
             logger.warning(message)
             try:
@@ -80,6 +176,54 @@ async def req_get_info(request, req_id):
         return result
 
 
+@requests.route('/requests/query', methods=['POST'])
+async def req_query(request):
+    request_ids = request.headers.get('json_params', {}).get('request_ids')
+    if not isinstance(request_ids, list) or not request_ids:
+        raise sanic.exceptions.InvalidUsage('malformed input json data, \'request_ids\' must be a non-empty list')
+    if len(request_ids) > Settings.app['service']['request_query_max']:
+        raise sanic.exceptions.InvalidUsage(
+            f'too many requests specified, limit is {Settings.app["service"]["request_query_max"]}'
+        )
+
+    with data.Connection.use() as conn:
+        reqs = data.Request.get_by_ids(request_ids, conn=conn)
+        reqs = [
+            update_bulk_request_state(req, conn)
+            if req.type is data.RequestType.BULK and not req.state.has_finished() else req
+            for req in reqs
+        ]
+
+    # ids that do not exist are reported as None
+    states = {str(request_id): None for request_id in request_ids}
+    for req in reqs:
+        states[req.id] = {
+            'machine_id': req.machine,
+            'state': str(req.state),
+            'request_type': str(req.type),
+            'modified_at': req.to_dict()['modified_at'],
+            'is_last': req.state.has_finished(),
+        }
+        if req.type is data.RequestType.BULK:
+            states[req.id]['subrequests'] = req.subrequests
+
+    result_dict = {'requests': states}
+    deploys = [req for req in reqs if req.type is data.RequestType.DEPLOY]
+    if deploys:
+        # computed once for the whole response, cached values are good enough until some deploy has finished
+        await Capabilities.fetch(forced=any(req.state.has_finished() for req in deploys))
+        result_dict['capabilities'] = {
+            'slot_limit': Capabilities.get_slot_limit(),
+            'free_slots': Capabilities.get_free_slots(),
+            'labels': Capabilities.get_labels(),
+        }
+
+    return {
+        'result': result_dict,
+        'is_last': True
+    }
+
+
 @requests.route('/requests', methods=['GET'])
 async def req_get_info(request):
 
@@ -1,8 +1,10 @@
+import base64
 import datetime
 import logging
 
 from sanic import Blueprint
-from sanic.response import json as sjson
+from sanic.exceptions import NotFound
+from sanic.response import json as sjson, redirect, stream, HTTPResponse
 
 import web.modeltr as data
 
@@ -11,6 +13,9 @@ logger = logging.getLogger(__name__)
 
 screenshots = Blueprint('screenshots')
 
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_MAX_AGE = 24 * 60 * 60
+
 
 @screenshots.route('/machines/<machine_id>/screenshots', methods=['POST'])
 async def take_screenshot(request, machine_id):
@@ -44,12 +49,15 @@ async def get_screenshot(request, machine_id, screenshot_id):
     screenshot = {}
     with data.Connection.use() as conn:
         screenshot = data.Screenshot.get({'_id': screenshot_id}, conn=conn).first()
+        image = screenshot.load_image(conn=conn)
+    # kept for clients not using the image endpoint yet
+    base64_data = base64.b64encode(image).decode('ascii') if image is not None else screenshot.image_base64
     return sjson(
         {
             'responses': [{
                 'result': {
                     'screenshot_id': f'{screenshot_id}',
-                    'base64_data': screenshot.image_base64,
+                    'base64_data': base64_data,
                     'suffix': screenshot.file_type,
                     'status': screenshot.status,
                 },
@@ -59,3 +67,40 @@ async def get_screenshot(request, machine_id, screenshot_id):
         },
         status=200
     )
+
+
+@screenshots.route('/machines/<machine_id>/screenshots/<screenshot_id>/image', methods=['GET'])
+async def get_screenshot_image(request, machine_id, screenshot_id):
+    with data.Connection.use() as conn:
+        screenshot = data.Screenshot.get_one({'_id': screenshot_id, 'machine': machine_id}, conn=conn)
+        if screenshot is None:
+            raise NotFound('Specified screenshot cannot be obtained')
+        if screenshot.status == 'hcpstored':
+            return redirect(screenshot.image_base64)
+
+        # obtained screenshot never changes, so its id is sufficient as an entity tag
+        headers = {
+            'Cache-Control': f'private, max-age={IMAGE_MAX_AGE}',
+            'ETag': f'"screenshot-{screenshot_id}"',
+        }
+        if request.headers.get('If-None-Match') == headers['ETag'] and screenshot.status == 'obtained':
+            return HTTPResponse(status=304, headers=headers)
+
+        image_size = screenshot.get_image_size(conn=conn)
+        # screenshots stored before screenshot_images existed are in the document
+        image = screenshot.load_image(conn=conn) if image_size is None else None
+    if image_size is None and image is None:
+        raise NotFound(f'Screenshot is not available, status: {screenshot.status}')
+
+    async def stream_image(response):
+        if image is not None:
+            for offset in range(0, len(image), IMAGE_CHUNK_SIZE):
+                await response.write(image[offset:offset + IMAGE_CHUNK_SIZE])
+            return
+        # image is read by chunks, so neither the whole image nor a connection is held while the client reads
+        for offset in range(0, image_size, IMAGE_CHUNK_SIZE):
+            with data.Connection.use() as conn:
+                chunk = screenshot.load_image_range(offset, IMAGE_CHUNK_SIZE, conn=conn)
+            await response.write(chunk)
+
+    return stream(stream_image, headers=headers, content_type=f'image/{screenshot.file_type}')
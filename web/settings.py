@@ -1,6 +1,10 @@
+import atexit
+import copy
 import logging
+import logging.handlers
 import functools
 import os
+import queue
 from collections import Iterable
 
 import raven
@@ -18,6 +22,8 @@ class Settings:
                           '[http:%(http_request_uuid)s] [%(http_verb)s%(http_address)s] '
                           '%(message)s',
             'log_datefmt': '%Y-%m-%dT%H:%M:%S.000Z',
+            # log records are written by a thread, see start_log_queue()
+            'log_queue': False,
             'sanic_accesslog': True,
             'sanic_custom_accesslog_enable': True,
             'sanic_custom_accesslog': '%(asctime)s [%(process)s] [ACCESS:%(levelname)s]'
@@ -62,6 +68,7 @@ class Settings:
                 'datacenter': None,
                 'root_system_folder': None,
                 'instant_clone_enabled': False,
+                # commands run one by one, the one with 'parallel': True runs alongside the previous ones
                 'instant_clone_post_commands': [
                     {
                         'os': 'Win',
@@ -70,10 +77,63 @@ class Settings:
                         'args': '/run /tn restartnet'
                     }
                 ],
+                'instant_clone_post_commands_timeout': 120,  # in seconds, for all commands of a machine
                 'timeout': 20,
+                'bulk_tasks_timeout': 1800,  # in seconds, tasks of bulk operations still pending are failed then
                 'hosts_folder_name': None,
                 'hosts_shared_templates': True,
                 'socket_default_timeout': None,
+                'template_cache_ttl': 300,  # in seconds, templates and their snapshots are shared by clones
+                'datastore_tracker': {
+                    # datastores are picked by projected free space and clones in flight
+                    # capacity is refreshed by delayed.py, clones reserve the space in the db
+                    'enabled': False,
+                    'refresh_interval': 60,         # in seconds
+                    'clone_reservation_gb': 10,     # space expected to be consumed by one clone
+                    'concurrency_penalty_gb': 50,   # free space handicap per clone in flight
+                    'reservation_timeout': 3600,    # in seconds, reservations of crashed workers expire
+                },
+                'folder_cleanup': {
+                    # machine folders left empty by undeploy are removed by delayed.py,
+                    # a folder must be found empty by two consecutive runs
+                    'enabled': False,
+                    'interval': 300,  # in seconds
+                },
+                'session': {
+                    'check_interval': 60,  # in seconds, session liveness is not checked more often
+                },
+                'simulator': {
+                    # vCenter is simulated by vcenter/simulator.py, for tests and benchmarks
+                    'enabled': False,
+                    'address': None,            # host:port of a shared simulator, in-process one if not set
+                    'authkey': 'simulator',
+                    'seed': 0,
+                    'inventory': {
+                        'hosts': 4,
+                        'datastores': 4,
+                        'datastore_capacity_gb': 4096,
+                        'folders': 10,
+                        'vms': 100,             # machines that are not managed by the unit
+                        'templates': [],        # template labels are used if empty
+                    },
+                    'latency': {                # in seconds
+                        'call': 0.0,            # every property read and method call
+                        'clone': 2.0,
+                        'instant_clone': 0.5,
+                        'power': 0.5,
+                        'destroy': 0.5,
+                        'rename': 0.1,
+                        'move': 0.1,
+                        'reconfigure': 0.2,
+                        'snapshot': 1.0,
+                        'screenshot': 0.3,
+                        'guest_command': 0.5,
+                    },
+                    'failure_rate': 0.0,        # probability of clone failure
+                    'clone_size_gb': 1,
+                    'page_size': 100,           # objects per property collector page
+                    'session_timeout': None,    # in seconds of inactivity, sessions do not expire if not set
+                },
             },
             'vms': {
                 'login_username': None,
@@ -89,8 +149,59 @@ class Settings:
                     # the db query is performed only once in the caching_period interval
                     'caching_period': 15,             # in seconds
                     'caching_enabled_threshold': 90,  # in percent
+                    # free slots are read from a counter maintained along with machine states and deploy tickets,
+                    # delayed.py reconciles it once per reconciliation_interval
+                    'slot_counters': False,
+                    'reconciliation_interval': 60,    # in seconds
                 },
                 'screenshot_store': 'db',  # hcp eventually
+                'bulk_max_machines': 200,      # maximum number of machines in one bulk request
+                'deploy_max_count': 100,       # maximum number of machines deployed by one request
+                'machines_page_max': 1000,     # maximum page size of GET /machines
+                'machines_stream_chunk': 200,  # machines read by one query of streamed GET /machines
+                'request_query_max': 1000,     # maximum number of requests in one POST /requests/query
+                'request_wait_max': 30,        # in seconds, maximum wait of GET /requests/<id>?wait=<seconds>
+                # in seconds, the waiting request is checked that often when change notifications are not available
+                'request_wait_poll_interval': 1,
+                'admission': {
+                    # deploys are refused with 429 when the queue could not be processed within max_queue_wait
+                    # at the deploy rate observed within rate_window
+                    'enabled': False,
+                    'max_queue_wait': 300,        # in seconds
+                    'min_queue_depth': 10,        # deploys always admitted to the queue, e.g. after an idle period
+                    'rate_window': 600,           # in seconds
+                    'rate_caching_period': 10,    # in seconds
+                },
+                'timing': {
+                    # phase timings of requests (auth, db_wait, db_execute, capabilities, handler, serialisation)
+                    'enabled': False,
+                    'server_timing': True,      # sent as Server-Timing response header
+                    'statsd': True,             # sent as statsd timings <prefix>.web.<method>.<route>.<phase>
+                },
+                'events': {
+                    # state changes are stored as events and streamed by GET /events
+                    'enabled': False,
+                    'retention': 3600,      # in seconds, events are pruned by delayed.py
+                    'keepalive': 15,        # in seconds
+                    'retry': 3,             # in seconds, reconnection delay advised to clients
+                    'max_duration': 3600,   # in seconds, the client reconnects with Last-Event-ID then
+                    'reorder_window': 10,   # in seconds, events are inserted before commit and appear after it
+                    'batch_size': 500,      # events read by one query
+                },
+                'ldap': {
+                    'cache': {
+                        'ttl': 300,           # in seconds, authenticated users
+                        'negative_ttl': 30,   # in seconds, refused credentials and users without a group
+                        'max_entries': 10000,
+                    },
+                    # DN and group lookups are done on pooled connections bound by 'service_user'
+                    # and 'service_password' if they are configured
+                    'pool': {
+                        'size': 4,
+                        'timeout': 10,          # in seconds, waiting for a free connection
+                        'check_interval': 60,   # in seconds, idle connections are checked before use
+                    },
+                },
             },
             'hcp': {
                 'url': None,
@@ -124,6 +235,14 @@ class Settings:
             'ticketeer': {
                 'sleep': 6,
             },
+            'warm_pool': {
+                # pre-deployed machines handed out by deploys instead of cloning, refilled by warm_pool.py
+                'enabled': False,
+                'sleep': 10,
+                'folder': 'warm_pool',  # inventory folder of pooled machines, relative to vsphere.folder
+                # template name -> {'size': machines kept, 'running': powered on or not}, pooled machines take slots
+                'templates': {},
+            },
             'document_abstraction':{
                 'warn_0_records': True,
             }
@@ -201,19 +320,21 @@ if env_log_level_str in ['TRACE', 'DEBUG', 'INFO', 'WARNING']:
     log_level_str = env_log_level_str
 
 
-logging_vars = {
-    'http_request_uuid': contextvars.ContextVar('http_request_uuid', default=''),
-    'http_verb': contextvars.ContextVar('http_verb', default=''),
-    'http_address': contextvars.ContextVar('http_address', default=''),
-}
+# attributes of log records, kept in a single variable so that a record reads the context once;
+# the dict is replaced on change, the contexts of other tasks keep theirs
+logging_context = contextvars.ContextVar('logging_context', default={
+    'http_request_uuid': '',
+    'http_verb': '',
+    'http_address': '',
+})
 
 
 def set_context_var(name, val):
-    logging_vars[name].set(val)
+    logging_context.set({**logging_context.get(), name: val})
 
 
 def reset_context_var(name):
-    logging_vars[name].set('')
+    set_context_var(name, '')
 
 
 logging.basicConfig(
@@ -226,9 +347,7 @@ logging.basicConfig(
 old_factory = logging.getLogRecordFactory()
 def record_factory(*args, **kwargs):
     record = old_factory(*args, **kwargs)
-    record.http_request_uuid = logging_vars['http_request_uuid'].get()
-    record.http_verb = logging_vars['http_verb'].get()
-    record.http_address = logging_vars['http_address'].get()
+    record.__dict__.update(logging_context.get())
     return record
 logging.setLogRecordFactory(record_factory)
 
@@ -237,9 +356,60 @@ def log_to(logger: logging.Logger, level=TRACE):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            logger.log(level=level, msg=f"-> {func.__name__}()")
+            if not logger.isEnabledFor(level):
+                return func(*args, **kwargs)
+            logger.log(level, "-> %s()", func.__name__)
             result = func(*args, **kwargs)
-            logger.log(level=level, msg=f"<- {func.__name__}(): {repr(result)}")
+            logger.log(level, "<- %s(): %r", func.__name__, result)
             return result
         return wrapper
     return decorator
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records in a queue with the message merged with its arguments, the records are formatted
+    and written by the handlers of the listener thread
+    """
+    exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # the traceback cannot be formatted once the frames are gone
+            record.exc_text = self.exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+log_queue_listeners = []
+
+
+def stop_log_queue():
+    while log_queue_listeners:
+        log_queue_listeners.pop().stop()
+
+
+def start_log_queue(*logger_names):
+    """
+    Moves the handlers of the loggers (root logger by default) to a thread, so logging does not block
+    the event loop or the worker loop. Threads do not survive fork, it is called in every process.
+    """
+    if not Settings.app['log_queue']:
+        return
+    for name in logger_names or [None]:
+        target = logging.getLogger(name)
+        handlers = [handler for handler in target.handlers if not isinstance(handler, LogQueueHandler)]
+        if not handlers:
+            continue
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        target.handlers = [LogQueueHandler(records)]
+        listener.start()
+        if not log_queue_listeners:
+            # the records still queued are written at exit
+            atexit.register(stop_log_queue)
+        log_queue_listeners.append(listener)
@@ -0,0 +1,142 @@
+import contextlib
+import contextvars
+import functools
+import logging
+import re
+import time
+
+from web.settings import Settings
+from web.stats import stats_add_timing_metric
+
+logger = logging.getLogger(__name__)
+
+# phase timings of the request being handled, None outside of requests or when timing is disabled
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+NOT_MEASURED = contextlib.nullcontext()
+
+
+class Timings:
+    """
+    Durations of the phases of one request in seconds, the phases may overlap, e.g. 'handler' contains 'db_execute'
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler_started = None
+        self.phases = {}
+
+    def add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def to_header(self):
+        return ', '.join(f'{phase};dur={duration * 1000:.1f}' for phase, duration in self.phases.items())
+
+
+def enabled():
+    return Settings.app['service']['timing']['enabled']
+
+
+@contextlib.contextmanager
+def _measure(timings, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
+
+
+def measure(phase):
+    """
+    Context manager adding its duration to the phase of the current request, it does nothing outside of requests
+    """
+    timings = current_timings.get()
+    if timings is None:
+        return NOT_MEASURED
+    return _measure(timings, phase)
+
+
+def measured(phase):
+    """
+    Decorator of coroutines measured as the phase of the current request
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def inner(*args, **kwargs):
+            with measure(phase):
+                return await func(*args, **kwargs)
+        return inner
+    return decorator
+
+
+def timed_middleware(phase, middleware):
+    """
+    :return: request middleware measured as the phase, the middleware itself when timing is disabled
+    """
+    if not enabled():
+        return middleware
+
+    @functools.wraps(middleware)
+    async def inner(request):
+        with measure(phase):
+            return await middleware(request)
+    return inner
+
+
+async def start(request):
+    timings = Timings()
+    request['timings'] = timings
+    current_timings.set(timings)
+
+
+async def start_handler(request):
+    request['timings'].handler_started = time.perf_counter()
+
+
+def get_route_name(request):
+    try:
+        uri = request.app.router.get(request)[3]
+    except Exception:
+        # e.g. not found
+        return 'unknown'
+    return re.sub(r'[^a-zA-Z0-9]+', '_', uri).strip('_') or 'root'
+
+
+def finish(request, response):
+    timings = request['timings']
+    now = time.perf_counter()
+    timings.add('total', now - timings.started)
+    if response is None:
+        return
+    if Settings.app['service']['timing']['server_timing']:
+        response.headers['Server-Timing'] = timings.to_header()
+    if Settings.app['service']['timing']['statsd'] and Settings.statsd_client:
+        route = f'{request.method}.{get_route_name(request)}'
+        for phase, duration in timings.phases.items():
+            stats_add_timing_metric(f'web.{route}', phase, duration)
+
+
+def timed_response_middleware(middleware):
+    """
+    Wraps the response middleware serialising the response, the timings are reported on its result.
+    Sanic stops calling response middlewares once one of them returns a response, so there is a single wrapper.
+    :return: the middleware itself when timing is disabled
+    """
+    if not enabled():
+        return middleware
+
+    @functools.wraps(middleware)
+    async def inner(request, response):
+        timings = request.get('timings')
+        if timings is None:
+            # request middlewares did not run, e.g. unsupported method
+            return await middleware(request, response)
+        if timings.handler_started is not None:
+            timings.add('handler', time.perf_counter() - timings.handler_started)
+        with _measure(timings, 'serialisation'):
+            result = await middleware(request, response)
+        try:
+            finish(request, result or response)
+        except Exception:
+            logger.warning('reporting of request timings failed', exc_info=True)
+        return result
+    return inner